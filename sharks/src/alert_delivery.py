@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Alert delivery - ship detection reports to the shark-detection-service without
+blocking the video loop.
+
+Payloads are queued in memory and sent by a background thread over a pooled
+keep-alive HTTP session as multipart/form-data: the detection frame (`image`,
+raw JPEG bytes) goes as a file part, the other fields as form fields with
+`metadata` JSON-encoded, matching the service's `upload.single('image')` route.
+Reports from the same drone that arrive within the batch window are coalesced
+into one POST (highest confidence wins). Failed sends are retried with
+exponential backoff; when the link stays down, payloads are appended to a local
+JSON Lines spool file which is replayed once the API is reachable again.
+
+Example:
+    dispatcher = AlertDispatcher(os.environ['SHARK_API_URL'], spool_path='detections/alert_spool.jsonl')
+    dispatcher.submit(payload)   # never blocks
+    ...
+    dispatcher.close()
+"""
+
+import base64
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+
+
+def encode_multipart(fields, files=None):
+    """Build a multipart/form-data body.
+
+    Args:
+        fields: Mapping of form field names to string values
+        files: Mapping of field names to (filename, bytes, content_type)
+
+    Returns:
+        (body, content_type)
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'.encode('utf-8'))
+        parts.append(str(value).encode('utf-8') + b'\r\n')
+    for name, (filename, data, content_type) in (files or {}).items():
+        parts.append((f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                      f'Content-Type: {content_type}\r\n\r\n').encode('utf-8'))
+        parts.append(data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def form_parts(payload):
+    """Split a report payload into form fields and the JPEG file part."""
+    fields = {}
+    for key, value in payload.items():
+        if key == 'image' or value is None:
+            continue
+        fields[key] = json.dumps(value, separators=(',', ':')) if isinstance(value, (dict, list)) else value
+    files = {}
+    if payload.get('image'):
+        files['image'] = ('frame.jpg', payload['image'], 'image/jpeg')
+    return fields, files
+
+
+class AlertSpool:
+    """Append-only JSON Lines spool with a persisted replay offset."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.offset_path = self.path + '.offset'
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _dump(payload):
+        if isinstance(payload.get('image'), (bytes, bytearray)):
+            # JSON has no bytes: the JPEG is kept base64-encoded on disk only
+            payload = dict(payload, image=base64.b64encode(payload['image']).decode('ascii'), image_b64=True)
+        return json.dumps(payload, separators=(',', ':')) + '\n'
+
+    @staticmethod
+    def _load(raw):
+        payload = json.loads(raw)
+        if payload.pop('image_b64', False):
+            payload['image'] = base64.b64decode(payload['image'])
+        return payload
+
+    def append(self, payload):
+        line = self._dump(payload)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _read_offset(self):
+        try:
+            with open(self.offset_path, 'r') as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _write_offset(self, offset):
+        tmp = self.offset_path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(str(offset))
+        os.replace(tmp, self.offset_path)
+
+    def pending(self):
+        """True if the spool holds records that have not been replayed yet."""
+        try:
+            return os.path.getsize(self.path) > self._read_offset()
+        except OSError:
+            return False
+
+    def replay(self, send_fn):
+        """Send spooled records in order until one fails.
+
+        Args:
+            send_fn: Callable(payload) -> bool
+
+        Returns:
+            (replayed, complete) - number of records sent and whether the spool was drained.
+        """
+        replayed = 0
+        offset = self._read_offset()
+        try:
+            f = open(self.path, 'rb')
+        except OSError:
+            return 0, True
+        # Appends only go to the end of the file, so sends happen without holding
+        # the lock and `append` never waits on the network.
+        with f:
+            f.seek(offset)
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break  # partially written tail, retry later
+                try:
+                    payload = self._load(raw)
+                except ValueError:
+                    payload = None
+                if payload is not None and not send_fn(payload):
+                    return replayed, False
+                offset += len(raw)
+                self._write_offset(offset)
+                replayed += payload is not None
+        with self._lock:
+            # Everything delivered: start a fresh spool file
+            if offset >= os.path.getsize(self.path):
+                os.remove(self.path)
+                if os.path.exists(self.offset_path):
+                    os.remove(self.offset_path)
+                return replayed, True
+        return replayed, False
+
+
+class AlertDispatcher:
+    """Background, non-blocking delivery of detection payloads."""
+
+    def __init__(self, api_url, spool_path=None, max_queue=64, batch_window=1.0, max_batch=32,
+                 max_retries=3, backoff_base=0.5, backoff_max=60.0, timeout=5.0, pool_size=2):
+        """Start the delivery thread.
+
+        Args:
+            api_url: Endpoint receiving detection reports (e.g. .../api/sharks/report)
+            spool_path: JSON Lines file used while the link is down (None disables spooling)
+            max_queue: In-memory queue capacity; overflow goes to the spool (or is dropped)
+            batch_window: Seconds to gather reports before coalescing and sending
+            max_batch: Maximum reports gathered per batch window
+            max_retries: Send attempts per report before it is spooled
+            backoff_base: Initial retry delay in seconds (doubled per failure)
+            backoff_max: Upper bound for the retry delay in seconds
+            timeout: Per-request timeout in seconds
+            pool_size: Keep-alive connections kept in the HTTP pool
+        """
+        self.api_url = api_url
+        self.spool = AlertSpool(spool_path) if spool_path else None
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.max_retries = max(1, int(max_retries))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._retry_at = 0.0
+        self._failures = 0
+        self.stats = {'queued': 0, 'sent': 0, 'failed': 0, 'coalesced': 0,
+                      'spooled': 0, 'replayed': 0, 'dropped': 0}
+
+        # requests is imported here rather than at module level: it costs ~100 ms at
+        # start-up and is only needed once an API endpoint is configured
+        self.session = None
+        try:
+            import requests
+            from requests.adapters import HTTPAdapter
+        except ImportError:
+            pass
+        else:
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+
+        self._thread = threading.Thread(target=self._run, name='alert-delivery', daemon=True)
+        self._thread.start()
+
+    def submit(self, payload):
+        """Queue a payload for delivery. Never blocks.
+
+        Returns:
+            True if the payload was queued or spooled, False if it was dropped.
+        """
+        try:
+            self._queue.put_nowait(payload)
+            self.stats['queued'] += 1
+            return True
+        except queue.Full:
+            if self.spool:
+                self.spool.append(payload)
+                self.stats['spooled'] += 1
+                return True
+            self.stats['dropped'] += 1
+            return False
+
+    def _post(self, payload):
+        """Single delivery attempt; returns True on a 2xx response."""
+        try:
+            body, content_type = encode_multipart(*form_parts(payload))
+            headers = {'Content-Type': content_type}
+            if self.session is not None:
+                resp = self.session.post(self.api_url, data=body, headers=headers, timeout=self.timeout)
+                resp.raise_for_status()
+            else:
+                import urllib.request
+                req = urllib.request.Request(self.api_url, data=body, headers=headers)
+                with urllib.request.urlopen(req, timeout=self.timeout) as r:
+                    _ = r.read()
+            return True
+        except Exception:
+            return False
+
+    def _backoff_delay(self):
+        delay = min(self.backoff_max, self.backoff_base * (2 ** max(0, self._failures - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _link_ok(self):
+        self._failures = 0
+        self._retry_at = 0.0
+
+    def _link_failed(self):
+        self._failures += 1
+        self._retry_at = time.monotonic() + self._backoff_delay()
+
+    def _deliver(self, payload):
+        """Send with retries; spool the payload if it could not be delivered."""
+        # While the link is known to be down, go straight to disk
+        if self.spool and self._failures and time.monotonic() < self._retry_at:
+            self.spool.append(payload)
+            self.stats['spooled'] += 1
+            return
+        for attempt in range(self.max_retries):
+            if self._post(payload):
+                self.stats['sent'] += 1
+                self._link_ok()
+                return
+            self._link_failed()
+            if attempt + 1 < self.max_retries and not self._stop.is_set():
+                self._stop.wait(max(0.0, self._retry_at - time.monotonic()))
+        self.stats['failed'] += 1
+        if self.spool:
+            self.spool.append(payload)
+            self.stats['spooled'] += 1
+
+    def _replay_spool(self):
+        if not self.spool or time.monotonic() < self._retry_at or not self.spool.pending():
+            return
+
+        def send(payload):
+            ok = self._post(payload)
+            if ok:
+                self.stats['sent'] += 1
+            return ok
+
+        replayed, complete = self.spool.replay(send)
+        self.stats['replayed'] += replayed
+        if complete:
+            self._link_ok()
+        else:
+            self._link_failed()
+
+    @staticmethod
+    def coalesce(payloads):
+        """Merge reports from the same drone into the most confident one.
+
+        If that report carries no image (deduplicated), the latest image of the
+        merged reports is attached instead.
+        """
+        best = {}
+        counts = {}
+        images = {}
+        for p in payloads:
+            key = p.get('droneName')
+            counts[key] = counts.get(key, 0) + 1
+            if p.get('image'):
+                images[key] = p
+            if key not in best or p.get('accuracy', 0.0) >= best[key].get('accuracy', 0.0):
+                best[key] = p
+        merged = []
+        for key, p in best.items():
+            if counts[key] > 1:
+                p = dict(p)
+                metadata = dict(p.get('metadata') or {}, coalesced=counts[key])
+                if not p.get('image') and key in images:
+                    source = images[key]
+                    p['image'] = source['image']
+                    metadata.pop('image_deduplicated', None)
+                    if 'roi' in (source.get('metadata') or {}):
+                        metadata['roi'] = source['metadata']['roi']
+                p['metadata'] = metadata
+            merged.append(p)
+        return merged
+
+    def _gather(self):
+        """Collect up to `max_batch` payloads arriving within the batch window."""
+        try:
+            first = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._replay_spool()
+            batch = self._gather()
+            if not batch:
+                continue
+            merged = self.coalesce(batch)
+            self.stats['coalesced'] += len(batch) - len(merged)
+            for payload in merged:
+                self._deliver(payload)
+
+    def close(self, timeout=5.0):
+        """Stop the worker, flushing what is left in memory to the spool."""
+        self._stop.set()
+        self._thread.join(timeout=timeout)
+        leftover = []
+        while True:
+            try:
+                leftover.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for payload in self.coalesce(leftover):
+            if self.spool:
+                self.spool.append(payload)
+                self.stats['spooled'] += 1
+            else:
+                self.stats['dropped'] += 1
+        if self.session is not None:
+            self.session.close()
+        return dict(self.stats)
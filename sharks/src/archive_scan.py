@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Archive scan - re-score recorded drone footage and image folders offline.
+
+Videos and images found under the given directories / globs are split into
+work units: fixed-length segments of each video (`--segment-seconds`) and
+chunks of images (`--image-chunk`). Units run on a process pool; each worker
+pins itself to its own CPU (see sweep.cpu_slots), loads its own interpreter /
+Keras engine once, seeks straight to the first frame of its segment and scores
+frames in micro-batches, without a display and as fast as it can decode.
+
+Every finished unit is written atomically to `<out>/shards/<unit>.npz`, so an
+interrupted scan picks up where it stopped when run again: units whose shard
+exists are skipped. A shard belongs to the exact file contents it was made
+from (path, size, mtime) and `<out>/scan.json` records the model it was scored
+with; scanning into the same directory with a different model is refused
+unless `--restart` clears it.
+
+Once all units are done the shards are merged into one columnar per-frame file,
+`<out>/scores.npz` (or `scores.parquet` with `--format parquet`, needs pyarrow):
+
+    source      index into `sources` (npz) / dictionary-encoded path (parquet)
+    frame       frame index in the video (0 for images)
+    timestamp   seconds from the start of the video (NaN for images)
+    score       shark probability
+
+Usage:
+  python src/shark_detector.py scan --model models/best_shark_mobilenetv2.tflite --tflite \\
+      archive/2024-06-01 'archive/2024-06-0[2-9]/*.mp4' --out scans/june --workers 8
+"""
+
+import argparse
+import concurrent.futures
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from feature_cache import file_digest
+from preprocessing import load_manifest, resolve_threshold
+from sweep import cpu_slots
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.m4v')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+FORMATS = ('npz', 'parquet')
+
+# Detector of this worker process, set by _init_worker
+_detector = None
+
+
+def find_media(patterns):
+    """Videos and images matched by files, directories (recursive) and glob patterns.
+
+    Returns:
+        (videos, images), sorted absolute paths
+    """
+    videos, images = set(), set()
+    for pattern in patterns:
+        # A literal path is kept when glob syntax in its name ([...]) stops it matching itself
+        matches = glob.glob(pattern, recursive=True) or ([pattern] if os.path.exists(pattern) else [])
+        if not matches:
+            print(f"[scan] skipping {pattern}: no such file or directory")
+        for match in matches:
+            if os.path.isdir(match):
+                paths = [os.path.join(root, name) for root, _, names in os.walk(match) for name in names]
+            else:
+                paths = [match]
+            for path in paths:
+                ext = os.path.splitext(path)[1].lower()
+                if ext in VIDEO_EXTENSIONS:
+                    videos.add(os.path.abspath(path))
+                elif ext in IMAGE_EXTENSIONS:
+                    images.add(os.path.abspath(path))
+    return sorted(videos), sorted(images)
+
+
+def _file_key(path):
+    st = os.stat(path)
+    return f"{path}|{st.st_size}|{st.st_mtime_ns}"
+
+
+def _unit_id(*parts):
+    return hashlib.sha1('\n'.join(str(p) for p in parts).encode('utf-8')).hexdigest()[:16]
+
+
+def plan_units(videos, images, segment_seconds=60.0, image_chunk=256, every=1):
+    """Split videos into seekable segments and images into chunks.
+
+    Unit ids cover the file identity, the frame range and the frame stride, so a
+    shard is only reused for exactly the same work.
+
+    Returns:
+        List of unit dicts (`id`, `kind`, `frames` and either `path`/`start`/`end`/`fps`
+        or `paths`), largest first so the pool does not end on one long unit.
+    """
+    units = []
+    for path in videos:
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            print(f"[scan] skipping unreadable video: {path}")
+            continue
+        count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        cap.release()
+        key = _file_key(path)
+        if count <= 0:
+            # No frame count (some containers / live dumps): one unit read to the end
+            units.append({'id': _unit_id(key, 0, -1, every), 'kind': 'video', 'path': path, 'start': 0, 'end': -1,
+                          'fps': fps, 'frames': 0})
+            continue
+        step = max(1, int(round(segment_seconds * fps)))
+        for start in range(0, count, step):
+            end = min(count, start + step)
+            units.append({'id': _unit_id(key, start, end, every), 'kind': 'video', 'path': path, 'start': start,
+                          'end': end, 'fps': fps, 'frames': end - start})
+    for i in range(0, len(images), image_chunk):
+        chunk = images[i:i + image_chunk]
+        units.append({'id': _unit_id(*(_file_key(p) for p in chunk)), 'kind': 'images', 'paths': chunk,
+                      'frames': len(chunk)})
+    units.sort(key=lambda u: -u['frames'])
+    return units
+
+
+def read_segment(path, start, end, every=1):
+    """Yield (frame index, seconds, BGR frame) for frames [start, end) of a video, every `every`-th frame.
+
+    Seeks to `start` instead of decoding from the beginning; if the container
+    cannot seek exactly, the frames before `start` are skipped with `grab()`.
+    """
+    cap = cv2.VideoCapture(path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        if start:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+            if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != start:
+                cap.release()
+                cap = cv2.VideoCapture(path)
+                for _ in range(start):
+                    if not cap.grab():
+                        return
+        index = start
+        while end < 0 or index < end:
+            if (index - start) % every:
+                # Skipped frames are demuxed but never converted to BGR
+                if not cap.grab():
+                    break
+            else:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                yield index, index / fps, frame
+            index += 1
+    finally:
+        cap.release()
+
+
+def _unit_frames(unit, every):
+    if unit['kind'] == 'video':
+        for index, seconds, frame in read_segment(unit['path'], unit['start'], unit['end'], every):
+            yield unit['path'], index, seconds, frame
+        return
+    for path in unit['paths']:
+        frame = cv2.imread(path, cv2.IMREAD_COLOR)
+        if frame is None:
+            print(f"[scan] skipping unreadable image: {path}")
+            continue
+        yield path, 0, float('nan'), frame
+
+
+def _init_worker(slots, model, use_tflite, threads, batch):
+    """Pool initializer: claim a CPU slot, then load this worker's detector."""
+    global _detector
+    cpus = slots.get()
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    cv2.setNumThreads(1)
+    # Offline re-scoring never reports to the backend
+    os.environ.pop('SHARK_API_URL', None)
+    from shark_detector import SharkDetector
+    if use_tflite:
+        from interpreter_pool import InterpreterPool
+        _detector = SharkDetector(model, use_tflite=True, pool=InterpreterPool(model, num_threads=threads))
+    else:
+        import tensorflow as tf
+        from keras_engine import load_engine
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+        _detector = SharkDetector(model, keras_engine=load_engine(model, max_batch=batch))
+    _detector.warmup()
+
+
+def _write_shard(path, sources, rows):
+    index = {s: i for i, s in enumerate(sources)}
+    source, frame, timestamp, score = zip(*rows) if rows else ((), (), (), ())
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, sources=np.array(sources, dtype=str),
+             source=np.array([index[s] for s in source], dtype=np.int32),
+             frame=np.array(frame, dtype=np.int64), timestamp=np.array(timestamp, dtype=np.float64),
+             score=np.array(score, dtype=np.float32))
+    os.replace(tmp, path)
+
+
+def score_unit(unit, shard_dir, every=1, batch=8):
+    """Score one unit in a worker and write its shard; returns (unit id, frames scored, seconds)."""
+    t0 = time.perf_counter()
+    d = _detector
+    pre = d.preprocessor
+    buffer = np.empty((batch, pre.height, pre.width, 3), dtype=pre.dtype)
+    rows, pending, sources = [], [], []
+
+    def flush():
+        n = len(pending)
+        if n < batch:
+            buffer[n:] = 0
+        scores = d.predict_batch(buffer)[:n]
+        rows.extend((src, index, seconds, float(s)) for (src, index, seconds), s in zip(pending, scores))
+        pending.clear()
+
+    for source, index, seconds, frame in _unit_frames(unit, every):
+        if not sources or sources[-1] != source:
+            sources.append(source)
+        d.preprocess_frame(frame, out=buffer[len(pending)])
+        pending.append((source, index, seconds))
+        if len(pending) == batch:
+            flush()
+    if pending:
+        flush()
+    _write_shard(os.path.join(shard_dir, unit['id'] + '.npz'), sources, rows)
+    return unit['id'], len(rows), time.perf_counter() - t0
+
+
+def merge_shards(shard_dir, units):
+    """Concatenate unit shards in source / frame order.
+
+    Returns:
+        (sources, columns): source paths and a dict of per-frame column arrays
+    """
+    index = {}
+    columns = {'source': [], 'frame': [], 'timestamp': [], 'score': []}
+    order = sorted(units, key=lambda u: (u.get('path') or u['paths'][0], u.get('start', 0)))
+    for unit in order:
+        with np.load(os.path.join(shard_dir, unit['id'] + '.npz')) as shard:
+            remap = np.array([index.setdefault(s, len(index)) for s in shard['sources'].tolist()], dtype=np.int32)
+            columns['source'].append(remap[shard['source']] if len(remap) else shard['source'])
+            for name in ('frame', 'timestamp', 'score'):
+                columns[name].append(shard[name])
+    sources = sorted(index, key=index.get)
+    return sources, {name: np.concatenate(parts) for name, parts in columns.items()}
+
+
+def write_scores(out_path, sources, columns, fmt='npz'):
+    """Write merged columns atomically as npz or parquet."""
+    tmp = out_path + '.tmp'
+    if fmt == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.table({
+            'source': pa.DictionaryArray.from_arrays(pa.array(columns['source'], pa.int32()), pa.array(sources)),
+            'frame': columns['frame'], 'timestamp': columns['timestamp'], 'score': columns['score'],
+        })
+        pq.write_table(table, tmp)
+    else:
+        with open(tmp, 'wb') as f:
+            np.savez(f, sources=np.array(sources, dtype=str), **columns)
+    os.replace(tmp, out_path)
+
+
+def summarize(sources, columns, threshold, top=10):
+    """Per-source peak score and frames over `threshold`, highest peak first."""
+    source, score = columns['source'], columns['score']
+    peak = np.full(len(sources), -1.0)
+    np.maximum.at(peak, source, score)
+    hits = np.bincount(source[score >= threshold], minlength=len(sources))
+    order = np.argsort(-peak)[:top]
+    return [{'source': str(sources[i]), 'peak': round(float(peak[i]), 4), 'frames_over_threshold': int(hits[i])}
+            for i in order]
+
+
+def _check_model(out_dir, model, restart):
+    """Tie the output directory to one model; returns its digest."""
+    path = os.path.join(out_dir, 'scan.json')
+    digest = file_digest(model)
+    if restart and os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    try:
+        with open(path, 'r') as f:
+            recorded = json.load(f)
+    except (OSError, ValueError):
+        recorded = None
+    if recorded and recorded.get('model_sha1') != digest:
+        raise SystemExit(f"{out_dir} was scanned with {recorded.get('model')} ({(recorded.get('model_sha1') or '')[:10]}); "
+                         f"use another --out or --restart")
+    os.makedirs(os.path.join(out_dir, 'shards'), exist_ok=True)
+    return digest
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='shark_detector.py scan',
+                                     description='Re-score archived videos and images on a process pool.')
+    parser.add_argument('inputs', nargs='+', help='Video / image files, directories or glob patterns')
+    parser.add_argument('--model', required=True, help='Path to model file (.h5 or .tflite)')
+    parser.add_argument('--tflite', action='store_true', help='Use TFLite model')
+    parser.add_argument('--out', help='Output directory (default: scans/<model name>)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+    parser.add_argument('--threads', type=int, default=1, help='Inference threads per worker')
+    parser.add_argument('--batch', type=int, default=8, help='Frames per inference batch')
+    parser.add_argument('--every', type=int, default=1, help='Score every N-th video frame')
+    parser.add_argument('--segment-seconds', type=float, default=60.0, help='Video length per work unit')
+    parser.add_argument('--image-chunk', type=int, default=256, help='Images per work unit')
+    parser.add_argument('--format', choices=FORMATS, default='npz', help='Merged per-frame score file format')
+    parser.add_argument('--threshold', type=float, default=None,
+                        help="Threshold for the summary (default: the model's calibrated threshold, else 0.5)")
+    parser.add_argument('--restart', action='store_true', help='Discard existing shards in --out and start over')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.format == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise SystemExit("--format parquet needs pyarrow (pip install pyarrow)")
+    videos, images = find_media(args.inputs)
+    if not videos and not images:
+        raise SystemExit("No videos or images found")
+    out_dir = args.out or os.path.join('scans', os.path.splitext(os.path.basename(args.model))[0])
+    digest = _check_model(out_dir, args.model, args.restart)
+    shard_dir = os.path.join(out_dir, 'shards')
+
+    every = max(1, args.every)
+    units = plan_units(videos, images, args.segment_seconds, max(1, args.image_chunk), every)
+    if not units:
+        raise SystemExit("No videos or images found")
+    with open(os.path.join(out_dir, 'scan.json'), 'w') as f:
+        json.dump({'model': os.path.abspath(args.model), 'model_sha1': digest, 'every': every,
+                   'videos': len(videos), 'images': len(images), 'units': len(units)}, f, indent=2)
+    todo = [u for u in units if not os.path.exists(os.path.join(shard_dir, u['id'] + '.npz'))]
+    print(f"[scan] {len(videos)} videos, {len(images)} images -> {len(units)} units, "
+          f"{len(units) - len(todo)} already done")
+
+    failed = []
+    if todo:
+        workers = max(1, min(args.workers, len(todo)))
+        ctx = multiprocessing.get_context('spawn')
+        slots = ctx.Queue()
+        for slot in cpu_slots(workers, args.threads):
+            slots.put(slot)
+        start = time.perf_counter()
+        frames = done = 0
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                initargs=(slots, args.model, args.tflite, args.threads, args.batch)) as pool:
+            futures = {pool.submit(score_unit, u, shard_dir, every, args.batch): u for u in todo}
+            for future in concurrent.futures.as_completed(futures):
+                unit = futures[future]
+                try:
+                    _, n, _ = future.result()
+                except Exception as e:
+                    failed.append(unit)
+                    print(f"[scan] unit {unit['id']} ({unit.get('path') or unit['paths'][0]}) failed: {e}")
+                    continue
+                done += 1
+                frames += n
+                elapsed = time.perf_counter() - start
+                print(f"[scan] {done}/{len(todo)} units, {frames} frames, {frames / elapsed:.1f} frames/s")
+    if failed:
+        print(f"[scan] {len(failed)} units failed; run again to retry them")
+        return 1
+
+    out_path = os.path.join(out_dir, f"scores.{args.format}")
+    sources, columns = merge_shards(shard_dir, units)
+    write_scores(out_path, sources, columns, args.format)
+    print(f"[scan] {len(columns['score'])} scored frames -> {out_path}")
+    threshold = resolve_threshold(args.threshold, load_manifest(args.model))
+    for entry in summarize(sources, columns, threshold):
+        print(f"  peak {entry['peak']:.3f}  frames>={threshold:.2f} {entry['frames_over_threshold']:6d}  "
+              f"{entry['source']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Benchmark - reproducible latency / throughput measurements for the detectors.
+
+Replays a video and/or the data/test images through the detectors without any
+display, alert delivery or disk output and reports per stage:
+
+    decode       - cv2.VideoCapture.read / cv2.imread
+    preprocess   - resize, colour conversion, normalization (into the input tensor)
+    invoke       - model execution (TFLite invoke / Keras predict)
+    postprocess  - dequantize, event engine, overlay
+    buffer       - pre-trigger ring push (drone target)
+    encode       - alert JPEG + multipart body (detector target; nothing is sent)
+
+Each case reports p50 / p95 / p99 latency per stage (ms), sustained FPS over the
+whole loop, peak RSS and Python-visible allocations per frame (tracemalloc peak
+of everything after decode, NumPy buffers included), measured in a separate pass
+so tracing does not skew the timings. Cases run one at a time, each in a fresh process.
+
+Targets:
+    detector  - SharkDetector (Keras .h5 or TFLite)
+    drone     - the drone_inference_tflite frame loop (TFLite only)
+
+`--save-baseline` stores the results; `--baseline` compares against them and
+exits non-zero when p50 / p95 latency, allocations or peak RSS grow (or FPS
+drops) by more than `--tolerance`. Baselines are only comparable on the same
+hardware and thread settings; record one per device.
+
+Usage:
+  python src/benchmark.py --model models/best_shark_mobilenetv2.tflite --save-baseline benchmarks/pi4.json
+  python src/benchmark.py --model models/best_shark_mobilenetv2.tflite models/best_shark_mobilenetv2.h5 \
+      --baseline benchmarks/pi4.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+STAGES = ('decode', 'preprocess', 'invoke', 'postprocess', 'buffer', 'encode')
+TARGETS = ('detector', 'drone')
+SOURCES = ('video', 'images')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+# Latency growth below this is treated as noise, whatever the tolerance (ms)
+LATENCY_SLACK_MS = 0.2
+# Allocation growth below this is treated as noise (KB per frame)
+ALLOC_SLACK_KB = 1.0
+
+
+def frames_from(source, path):
+    """Endless (decode_seconds, frame) stream from a video (rewound at the end) or an image directory."""
+    if source == 'video':
+        cap = cv2.VideoCapture(str(path))
+        if not cap.isOpened():
+            raise ValueError(f"Could not open video: {path}")
+        try:
+            while True:
+                t0 = time.perf_counter()
+                ok, frame = cap.read()
+                elapsed = time.perf_counter() - t0
+                if not ok:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                yield elapsed, frame
+        finally:
+            cap.release()
+    paths = sorted(p for p in Path(path).rglob('*') if p.suffix.lower() in IMAGE_EXTENSIONS)
+    if not paths:
+        raise FileNotFoundError(f"No images found under {path}")
+    while True:
+        for p in paths:
+            t0 = time.perf_counter()
+            frame = cv2.imread(str(p), cv2.IMREAD_COLOR)
+            yield time.perf_counter() - t0, frame
+
+
+def stage_metrics():
+    """LoopMetrics that also forward stage timings to the current case.step recorder."""
+    from metrics import LoopMetrics
+
+    class StageMetrics(LoopMetrics):
+        record = None
+
+        def observe(self, stage, seconds):
+            super().observe(stage, seconds)
+            if self.record is not None and stage in STAGES:
+                self.record(stage, seconds)
+
+    return StageMetrics()
+
+
+class DetectorCase:
+    """SharkDetector frame path: predict (preprocess -> invoke) -> events / overlay -> alert encoding."""
+
+    def __init__(self, model, num_threads=None, delegate='xnnpack'):
+        from alert_delivery import encode_multipart, form_parts
+        from interpreter_pool import InterpreterPool
+        from shark_detector import SharkDetector
+        use_tflite = str(model).endswith('.tflite')
+        pool = InterpreterPool(model, num_threads=num_threads, delegate=delegate) if use_tflite else None
+        self.metrics = stage_metrics()
+        self.detector = SharkDetector(model, use_tflite=use_tflite, api_url=None, pool=pool, metrics=self.metrics)
+        # Alerts are timed on their own in the encode stage, without the API log lines
+        self.detector.send_alert = lambda *args, **kwargs: None
+        self._encode_multipart = encode_multipart
+        self._form_parts = form_parts
+
+    def step(self, frame, record):
+        d = self.detector
+        self.metrics.record = record
+        try:
+            # Records preprocess, invoke and postprocess
+            score = d.predict(frame)
+            d.handle_result(frame, score)
+        finally:
+            self.metrics.record = None
+        t0 = time.perf_counter()
+        image, roi = d.encoder.region(frame)
+        payload = {'droneName': 'benchmark', 'accuracy': score, 'metadata': {'roi': list(roi)},
+                   'image': d.encoder.encode(image)}
+        self._encode_multipart(*self._form_parts(payload))
+        record('encode', time.perf_counter() - t0)
+
+    def close(self):
+        self.detector.close()
+
+
+class DroneCase:
+    """drone_inference_tflite frame path: preprocess into the input tensor -> invoke -> events / overlay -> ring."""
+
+    def __init__(self, model, num_threads=None, delegate='xnnpack'):
+        from drone_inference_tflite import DroneLoop
+        if not str(model).endswith('.tflite'):
+            raise ValueError("The drone target needs a .tflite model")
+        self.metrics = stage_metrics()
+        self.loop = DroneLoop(model, num_threads=num_threads, delegate=delegate, metrics=self.metrics)
+
+    def step(self, frame, record):
+        self.metrics.record = record
+        try:
+            # Records preprocess, invoke, buffer and postprocess
+            self.loop.step(frame)
+        finally:
+            self.metrics.record = None
+
+    def close(self):
+        pass
+
+
+CASES = {'detector': DetectorCase, 'drone': DroneCase}
+
+
+def percentiles(samples):
+    ms = np.asarray(samples, dtype=np.float64) * 1000.0
+    p50, p95, p99 = np.percentile(ms, (50, 95, 99))
+    return {'p50': round(float(p50), 3), 'p95': round(float(p95), 3), 'p99': round(float(p99), 3),
+            'mean': round(float(ms.mean()), 3)}
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process (MB)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return round(peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0, 1)
+
+
+def run_case(spec):
+    """Run one case (in its own process) and return its result dict."""
+    target, model, source, path = spec['target'], spec['model'], spec['source'], spec['path']
+    case = CASES[target](model, spec['num_threads'], spec['delegate'])
+    samples = {stage: [] for stage in STAGES}
+    stream = frames_from(source, path)
+    try:
+        for _ in range(spec['warmup']):
+            _, frame = next(stream)
+            case.step(frame, lambda stage, seconds: None)
+
+        def record(stage, seconds):
+            samples[stage].append(seconds)
+
+        t0 = time.perf_counter()
+        for _ in range(spec['frames']):
+            decode, frame = next(stream)
+            record('decode', decode)
+            case.step(frame, record)
+        elapsed = time.perf_counter() - t0
+
+        # Allocation pass: peak traced memory above the pre-frame level, per frame (decode excluded)
+        peaks = []
+        tracemalloc.start()
+        start = tracemalloc.get_traced_memory()[0]
+        for _ in range(spec['alloc_frames']):
+            _, frame = next(stream)
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            case.step(frame, lambda stage, seconds: None)
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        retained = tracemalloc.get_traced_memory()[0] - start
+        tracemalloc.stop()
+    finally:
+        stream.close()
+        case.close()
+    return {
+        'case': spec['case'],
+        'frames': spec['frames'],
+        'fps': round(spec['frames'] / elapsed, 2) if elapsed > 0 else 0.0,
+        'stages': {stage: percentiles(values) for stage, values in samples.items() if values},
+        'peak_rss_mb': peak_rss_mb(),
+        'alloc_kb_per_frame': round(float(np.median(peaks)) / 1024.0, 2) if peaks else None,
+        'alloc_retained_kb': round(retained / 1024.0, 2) if peaks else None,
+    }
+
+
+def host_info():
+    return {'machine': platform.machine(), 'system': platform.system(), 'python': platform.python_version(),
+            'cpus': os.cpu_count(), 'opencv': cv2.__version__}
+
+
+def compare(results, baseline, tolerance=0.15):
+    """Regressions of `results` against a stored baseline, as printable strings."""
+    cases = {r['case']: r for r in baseline.get('results', [])}
+    regressions = []
+    for r in results:
+        b = cases.get(r['case'])
+        if b is None:
+            print(f"[baseline] no baseline for {r['case']}")
+            continue
+        for stage, stats in r['stages'].items():
+            for q in ('p50', 'p95'):
+                old = b['stages'].get(stage, {}).get(q)
+                if old is not None and stats[q] > old * (1.0 + tolerance) + LATENCY_SLACK_MS:
+                    regressions.append(f"{r['case']} {stage} {q}: {old:.3f} -> {stats[q]:.3f} ms")
+        if b.get('fps') and r['fps'] < b['fps'] * (1.0 - tolerance):
+            regressions.append(f"{r['case']} fps: {b['fps']:.2f} -> {r['fps']:.2f}")
+        if b.get('alloc_kb_per_frame') is not None and r['alloc_kb_per_frame'] is not None and \
+                r['alloc_kb_per_frame'] > b['alloc_kb_per_frame'] * (1.0 + tolerance) + ALLOC_SLACK_KB:
+            regressions.append(f"{r['case']} allocations: {b['alloc_kb_per_frame']:.2f} -> "
+                               f"{r['alloc_kb_per_frame']:.2f} KB/frame")
+        if b.get('peak_rss_mb') and r['peak_rss_mb'] and r['peak_rss_mb'] > b['peak_rss_mb'] * (1.0 + tolerance):
+            regressions.append(f"{r['case']} peak RSS: {b['peak_rss_mb']:.1f} -> {r['peak_rss_mb']:.1f} MB")
+    return regressions
+
+
+def print_results(results):
+    for r in results:
+        print(f"\n{r['case']}: {r['fps']:.1f} FPS over {r['frames']} frames, peak RSS {r['peak_rss_mb']} MB, "
+              f"{r['alloc_kb_per_frame']} KB allocated/frame ({r['alloc_retained_kb']} KB retained)")
+        print(f"  {'stage':<12}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}")
+        for stage, s in r['stages'].items():
+            print(f"  {stage:<12}{s['p50']:>10.3f}{s['p95']:>10.3f}{s['p99']:>10.3f}")
+
+
+def build_cases(args):
+    sources = {'video': args.video, 'images': args.images}
+    cases = []
+    for model in args.model:
+        for target in args.targets:
+            if target == 'drone' and not str(model).endswith('.tflite'):
+                continue
+            for source in args.sources:
+                cases.append({'case': f"{target}:{os.path.basename(model)}:{source}", 'target': target,
+                              'model': model, 'source': source, 'path': sources[source], 'frames': args.frames,
+                              'warmup': args.warmup, 'alloc_frames': args.alloc_frames,
+                              'num_threads': args.num_threads, 'delegate': args.delegate})
+    return cases
+
+
+def main():
+    p = argparse.ArgumentParser(description='Benchmark detector latency, throughput and memory.')
+    p.add_argument('--model', nargs='+', default=['models/best_shark_mobilenetv2.tflite'],
+                   help='Models to benchmark (.tflite and/or Keras .h5)')
+    p.add_argument('--targets', nargs='+', choices=TARGETS, default=list(TARGETS), help='Frame loops to measure')
+    p.add_argument('--sources', nargs='+', choices=SOURCES, default=list(SOURCES), help='Inputs to replay')
+    p.add_argument('--video', default='videos/shark_near_beach_360p.mp4', help='Video replayed for the video source')
+    p.add_argument('--images', default='data/test', help='Image directory for the images source')
+    p.add_argument('--frames', type=int, default=300, help='Timed frames per case')
+    p.add_argument('--warmup', type=int, default=20, help='Untimed frames before measuring')
+    p.add_argument('--alloc-frames', type=int, default=50, help='Frames traced for allocations (0 disables)')
+    p.add_argument('--num-threads', type=int, default=None, help='CPU threads per TFLite interpreter')
+    p.add_argument('--delegate', default='xnnpack',
+                   help="TFLite delegate: 'xnnpack', 'none' or path to an external delegate library")
+    p.add_argument('--output', help='Write results as JSON')
+    p.add_argument('--baseline', help='Compare against this results file; exit 1 on regressions')
+    p.add_argument('--save-baseline', help='Store the results as a baseline')
+    p.add_argument('--tolerance', type=float, default=0.15, help='Allowed relative regression')
+    args = p.parse_args()
+
+    # The benchmark never reports detections
+    os.environ.pop('SHARK_API_URL', None)
+    cases = build_cases(args)
+    if not cases:
+        print("Nothing to benchmark")
+        return 2
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    for spec in cases:
+        print(f"Running {spec['case']} ({spec['frames']} frames)")
+        # A fresh process per case keeps peak RSS and warm caches independent of the other cases
+        with ctx.Pool(1) as pool:
+            results.append(pool.apply(run_case, (spec,)))
+    print_results(results)
+
+    report = {'host': host_info(), 'num_threads': args.num_threads, 'delegate': args.delegate, 'results': results}
+    for path in (args.output, args.save_baseline):
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Wrote {path}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline.get('host') != report['host']:
+            print(f"[baseline] recorded on {baseline.get('host')}, running on {report['host']}")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\n" + "!" * 72)
+            print(f"PERFORMANCE REGRESSION against {args.baseline} (tolerance {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"  {line}")
+            print("!" * 72)
+            return 1
+        print(f"\nNo regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
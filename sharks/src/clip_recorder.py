@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Clip recorder - memory-bounded pre-trigger buffer and a background clip writer.
+
+`FrameRing` keeps the last N frames either JPEG-compressed (default, bounded by
+a byte budget) or raw in one preallocated NumPy arena (no per-frame allocation,
+capacity capped by the budget). `ClipWriter` encodes clips on its own thread, so
+the capture loop only hands over frames: the pre-trigger snapshot when a clip
+opens, then each post-trigger frame. A trigger while a clip is open extends it
+instead of starting a second one.
+
+Example:
+    ring = FrameRing(50, budget_mb=128)
+    writer = ClipWriter(fps=10)
+    ring.push(frame)
+    clip = writer.open('detections/clip.mp4', ring.snapshot())
+    clip.write(frame)
+    clip.close()
+    writer.close()
+"""
+
+import collections
+import queue
+import threading
+
+import cv2
+import numpy as np
+
+ENCODINGS = ('jpeg', 'raw')
+
+# Marks the end of the writer queue
+_STOP = object()
+
+
+class FrameRing:
+    """Fixed-capacity ring of recent frames within a memory budget."""
+
+    def __init__(self, capacity, budget_mb=128.0, encoding='jpeg', quality=90):
+        """Create the ring.
+
+        Args:
+            capacity: Maximum number of frames kept
+            budget_mb: Maximum memory held by buffered frames (MB)
+            encoding: 'jpeg' (compressed frames) or 'raw' (preallocated arena)
+            quality: JPEG quality for 'jpeg' encoding
+        """
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown encoding: {encoding}")
+        self.capacity = max(1, int(capacity))
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.encoding = encoding
+        self.params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+        self.nbytes = 0
+        self._jpegs = collections.deque()
+        self._arena = None
+        self._head = 0
+        self._count = 0
+
+    def __len__(self):
+        return len(self._jpegs) if self.encoding == 'jpeg' else self._count
+
+    def _allocate(self, frame):
+        slots = max(1, min(self.capacity, self.budget // frame.nbytes))
+        if slots < self.capacity:
+            print(f"[ring] budget holds {slots} of {self.capacity} raw {frame.shape[1]}x{frame.shape[0]} frames")
+        self._arena = np.empty((slots,) + frame.shape, dtype=frame.dtype)
+        self.nbytes = self._arena.nbytes
+
+    def push(self, frame):
+        """Add a frame, evicting the oldest ones beyond capacity or budget."""
+        if self.encoding == 'jpeg':
+            ok, data = cv2.imencode('.jpg', frame, self.params)
+            if not ok:
+                return
+            self._jpegs.append(data)
+            self.nbytes += data.nbytes
+            while len(self._jpegs) > self.capacity or (self.nbytes > self.budget and len(self._jpegs) > 1):
+                self.nbytes -= self._jpegs.popleft().nbytes
+            return
+        if self._arena is None or self._arena.shape[1:] != frame.shape:
+            self._allocate(frame)
+            self._head = self._count = 0
+        np.copyto(self._arena[self._head], frame)
+        self._head = (self._head + 1) % len(self._arena)
+        self._count = min(self._count + 1, len(self._arena))
+
+    def snapshot(self):
+        """Buffered frames, oldest first, detached from the ring.
+
+        JPEG rings return the encoded buffers (no copy); raw rings return one
+        contiguous (N, H, W, C) array.
+        """
+        if self.encoding == 'jpeg':
+            return list(self._jpegs)
+        if not self._count:
+            return []
+        slots = len(self._arena)
+        order = (np.arange(self._count) + self._head - self._count) % slots
+        return np.take(self._arena, order, axis=0)
+
+    def clear(self):
+        self._jpegs.clear()
+        if self.encoding == 'jpeg':
+            self.nbytes = 0
+        self._head = self._count = 0
+
+
+class Clip:
+    """Handle for a clip being written by a ClipWriter."""
+
+    def __init__(self, writer, path):
+        self.writer = writer
+        self.path = path
+        self.frames = 0
+        self.closed = False
+
+    def write(self, frame):
+        """Queue a frame; the caller must not modify it afterwards."""
+        self.frames += 1
+        self.writer._put(('frame', self, frame))
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.writer._put(('close', self, None))
+
+
+class ClipWriter:
+    """Background thread that decodes buffered frames and encodes clips."""
+
+    def __init__(self, fps=10, fourcc='mp4v', max_queue=256):
+        """Create the writer and start its thread.
+
+        Args:
+            fps: Frame rate of written clips
+            fourcc: VideoWriter codec
+            max_queue: Pending frames before `Clip.write` blocks
+        """
+        self.fps = fps
+        self.fourcc = cv2.VideoWriter_fourcc(*fourcc)
+        self.saved = []
+        self.errors = 0
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._writers = {}
+        self._thread = threading.Thread(target=self._run, name='clip-writer', daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        self._queue.put(item)
+
+    def open(self, path, frames=()):
+        """Start a clip at `path`, seeded with pre-trigger frames (ring snapshot)."""
+        clip = Clip(self, path)
+        self._put(('open', clip, frames))
+        clip.frames += len(frames)
+        return clip
+
+    def _write(self, clip, frame):
+        if isinstance(frame, np.ndarray) and frame.ndim == 1:
+            frame = cv2.imdecode(frame, cv2.IMREAD_COLOR)
+        writer = self._writers.get(clip)
+        if writer is None:
+            h, w = frame.shape[:2]
+            writer = cv2.VideoWriter(clip.path, self.fourcc, self.fps, (w, h))
+            self._writers[clip] = writer
+        writer.write(frame)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            op, clip, payload = item
+            try:
+                if op == 'open':
+                    for frame in payload:
+                        self._write(clip, frame)
+                elif op == 'frame':
+                    self._write(clip, payload)
+                elif op == 'close':
+                    writer = self._writers.pop(clip, None)
+                    if writer is not None:
+                        writer.release()
+                        self.saved.append(clip.path)
+                        print(f"Saved clip {clip.path} ({clip.frames} frames)")
+            except Exception as e:
+                self.errors += 1
+                print(f"[clip-writer] {clip.path}: {e}")
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def close(self, timeout=None):
+        """Finish queued clips and stop the thread."""
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        for writer in self._writers.values():
+            writer.release()
+        self._writers.clear()
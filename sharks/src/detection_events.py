@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Detection events - turn noisy per-frame scores into debounced
+"detection started / updated / ended" events.
+
+Per-frame sigmoid scores are smoothed over time (EMA or a windowed vote), then
+passed through hysteresis: an event starts once the smoothed signal reaches the
+enter threshold and only ends when it drops below the lower exit threshold.
+After an event ends, new events are suppressed for a cooldown period, and
+"updated" events are rate limited, so one sighting yields a handful of alerts
+instead of one per frame.
+
+Example:
+    engine = DetectionEventEngine(enter_threshold=0.6, exit_threshold=0.4)
+    for score in scores:
+        for event in engine.update(score):
+            print(event.kind, event.event_id, event.score)
+"""
+
+import time
+from collections import deque
+
+SMOOTHING_MODES = ('ema', 'vote', 'none')
+
+STARTED = 'started'
+UPDATED = 'updated'
+ENDED = 'ended'
+
+
+class DetectionEvent:
+    """A change in detection state."""
+
+    __slots__ = ('kind', 'event_id', 'score', 'raw_score', 'peak_score', 'started_at', 'timestamp', 'frames')
+
+    def __init__(self, kind, event_id, score, raw_score, peak_score, started_at, timestamp, frames):
+        self.kind = kind
+        self.event_id = event_id
+        self.score = score
+        self.raw_score = raw_score
+        self.peak_score = peak_score
+        self.started_at = started_at
+        self.timestamp = timestamp
+        self.frames = frames
+
+    @property
+    def duration(self):
+        return self.timestamp - self.started_at
+
+    def to_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __repr__(self):
+        return (f"DetectionEvent({self.kind}, id={self.event_id}, score={self.score:.3f}, "
+                f"peak={self.peak_score:.3f}, frames={self.frames})")
+
+
+class DetectionEventEngine:
+    """Temporal smoothing + hysteresis + cooldown over a stream of scores."""
+
+    def __init__(self, enter_threshold=0.5, exit_threshold=None, smoothing='ema', alpha=0.4,
+                 window=5, min_votes=3, cooldown=10.0, update_interval=5.0, clock=time.monotonic):
+        """Configure the engine.
+
+        Args:
+            enter_threshold: Smoothed score at which an event starts
+            exit_threshold: Smoothed score below which it ends (default: enter_threshold - 0.15,
+                but at least half the enter threshold)
+            smoothing: 'ema', 'vote' (at least `min_votes` of the last `window` frames) or 'none'
+            alpha: EMA weight of the newest score
+            window: Frames considered by the vote
+            min_votes: Frames in the window that must be above threshold for 'vote'
+            cooldown: Seconds after an event ends before a new one may start
+            update_interval: Minimum seconds between 'updated' events of one event
+            clock: Time source used when `update` is called without `now`
+        """
+        if smoothing not in SMOOTHING_MODES:
+            raise ValueError(f"Unknown smoothing mode: {smoothing}")
+        if exit_threshold is None:
+            # Low calibrated thresholds keep a positive exit threshold, else events never end
+            exit_threshold = max(enter_threshold - 0.15, 0.5 * enter_threshold)
+        if exit_threshold > enter_threshold:
+            raise ValueError("exit_threshold must not exceed enter_threshold")
+        if exit_threshold <= 0.0:
+            raise ValueError("exit_threshold must be above 0, or detections never end")
+        self.enter_threshold = enter_threshold
+        self.exit_threshold = exit_threshold
+        self.smoothing = smoothing
+        self.alpha = alpha
+        self.min_votes = min(min_votes, window)
+        self.cooldown = cooldown
+        self.update_interval = update_interval
+        self.clock = clock
+
+        self._window = deque(maxlen=window)
+        self._event_id = 0
+        self.reset()
+
+    def reset(self):
+        """Forget score history and any open event (e.g. after the source changed)."""
+        self._window.clear()
+        self.smoothed = None
+        self.active = False
+        self._started_at = None
+        self._peak = 0.0
+        self._frames = 0
+        self._last_update = None
+        self._last_update_peak = 0.0
+        self._cooldown_until = float('-inf')
+
+    def _smooth(self, score):
+        self._window.append(score)
+        if self.smoothing == 'ema' and self.smoothed is not None:
+            self.smoothed = self.alpha * score + (1.0 - self.alpha) * self.smoothed
+        elif self.smoothing == 'vote':
+            self.smoothed = sum(self._window) / len(self._window)
+        else:
+            # first EMA sample, or no smoothing
+            self.smoothed = score
+
+    def _is_on(self):
+        if self.smoothing == 'vote':
+            return sum(1 for s in self._window if s >= self.enter_threshold) >= self.min_votes
+        return self.smoothed >= self.enter_threshold
+
+    def _is_off(self):
+        if self.smoothing == 'vote':
+            return sum(1 for s in self._window if s >= self.exit_threshold) < self.min_votes
+        return self.smoothed < self.exit_threshold
+
+    def _event(self, kind, raw, now):
+        return DetectionEvent(kind, self._event_id, self.smoothed, raw, self._peak,
+                              self._started_at, now, self._frames)
+
+    def update(self, score, now=None):
+        """Feed one frame score.
+
+        Args:
+            score: Raw model score for the frame
+            now: Frame time in seconds (default: `clock()`)
+
+        Returns:
+            List of DetectionEvent (usually empty).
+        """
+        now = self.clock() if now is None else now
+        score = float(score)
+        self._smooth(score)
+
+        if not self.active:
+            if now < self._cooldown_until or not self._is_on():
+                return []
+            self.active = True
+            self._event_id += 1
+            self._started_at = now
+            self._peak = max(score, self.smoothed)
+            self._frames = 1
+            self._last_update = now
+            self._last_update_peak = self._peak
+            return [self._event(STARTED, score, now)]
+
+        self._frames += 1
+        self._peak = max(self._peak, score)
+        if self._is_off():
+            return self.end(now, score)
+        if now - self._last_update >= self.update_interval and self._peak > self._last_update_peak:
+            self._last_update = now
+            self._last_update_peak = self._peak
+            return [self._event(UPDATED, score, now)]
+        return []
+
+    def end(self, now=None, raw_score=None):
+        """Close the active event (if any), e.g. at end of stream."""
+        if not self.active:
+            return []
+        now = self.clock() if now is None else now
+        self.active = False
+        self._cooldown_until = now + self.cooldown
+        return [self._event(ENDED, self.smoothed if raw_score is None else raw_score, now)]
+
+
+def add_event_args(parser):
+    """Register the event engine CLI options on an argparse parser."""
+    parser.add_argument('--exit-threshold', type=float, default=None,
+                        help='Score below which a detection ends (default: threshold - 0.15, at least threshold / 2)')
+    parser.add_argument('--smoothing', choices=SMOOTHING_MODES, default='ema',
+                        help='Temporal smoothing applied to scores before thresholding')
+    parser.add_argument('--ema-alpha', type=float, default=0.4, help='EMA weight of the newest score')
+    parser.add_argument('--vote-window', type=int, default=5, help='Frames in the vote window')
+    parser.add_argument('--min-votes', type=int, default=3, help='Frames above threshold needed in the vote window')
+    parser.add_argument('--cooldown', type=float, default=10.0,
+                        help='Seconds after a detection ends before a new one can start')
+    parser.add_argument('--update-interval', type=float, default=5.0,
+                        help='Minimum seconds between "updated" events of one detection')
+
+
+def engine_from_args(args, threshold):
+    """Build a DetectionEventEngine from options registered by `add_event_args`."""
+    return DetectionEventEngine(
+        enter_threshold=threshold,
+        exit_threshold=args.exit_threshold,
+        smoothing=args.smoothing,
+        alpha=args.ema_alpha,
+        window=args.vote_window,
+        min_votes=args.min_votes,
+        cooldown=args.cooldown,
+        update_interval=args.update_interval,
+    )
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Detection log - durable, append-only JSON Lines log with rotation and an index.
+
+Records are appended as single lines to numbered segments
+(`detections.000001.jsonl`, ...) opened with O_APPEND, so each append is one
+write and never rewrites earlier records. Data is fsynced at most every
+`fsync_interval` seconds (and on rotation / close). A segment is rotated when it
+exceeds `max_bytes` or is older than `max_age`; every writer start opens a new
+segment, so a line torn by power loss can only ever be the last line of a
+closed segment, where readers skip it.
+
+`detections.index.json` lists each segment with its record count and time
+range, which lets readers skip closed segments outside a requested time range.
+
+Readers address records by offset `"<segment>:<byte>"`; `read_since` returns the
+records after a stored offset plus the offset to store next, which is all a
+ground-station sync job needs:
+
+    python detection_log.py detections --offset-file sync.offset > new_records.jsonl
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+SEGMENT_RE = re.compile(r'\.(\d{6})\.jsonl$')
+
+
+def _segment_path(directory, prefix, seq):
+    return os.path.join(directory, f"{prefix}.{seq:06d}.jsonl")
+
+
+def _index_path(directory, prefix):
+    return os.path.join(directory, f"{prefix}.index.json")
+
+
+def list_segments(directory, prefix='detections'):
+    """Segment numbers present on disk, ascending."""
+    seqs = []
+    for path in glob.glob(os.path.join(glob.escape(directory), f"{prefix}.*.jsonl")):
+        match = SEGMENT_RE.search(path)
+        if match:
+            seqs.append(int(match.group(1)))
+    return sorted(seqs)
+
+
+def load_index(directory, prefix='detections'):
+    """Segment metadata keyed by segment number (empty if there is no index yet)."""
+    try:
+        with open(_index_path(directory, prefix), 'r') as f:
+            return {int(k): v for k, v in json.load(f).get('segments', {}).items()}
+    except (OSError, ValueError):
+        return {}
+
+
+def parse_offset(offset):
+    """'<segment>:<byte>' -> (segment, byte); None -> start of the log."""
+    if not offset:
+        return 0, 0
+    seq, pos = str(offset).split(':')
+    return int(seq), int(pos)
+
+
+def format_offset(seq, pos):
+    return f"{seq}:{pos}"
+
+
+class DetectionLog:
+    """Append-only JSONL writer with periodic fsync, rotation and a segment index."""
+
+    def __init__(self, directory, prefix='detections', max_bytes=16 * 1024 * 1024, max_age=24 * 3600.0,
+                 fsync_interval=5.0):
+        """Open a new segment in `directory`.
+
+        Args:
+            directory: Log directory
+            prefix: Segment file prefix
+            max_bytes: Rotate when the current segment exceeds this size
+            max_age: Rotate when the current segment is older than this (seconds, 0 disables)
+            fsync_interval: Maximum seconds between fsyncs (0 fsyncs every record)
+        """
+        self.directory = str(directory)
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.fsync_interval = fsync_interval
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._index = load_index(self.directory, prefix)
+        existing = list_segments(self.directory, prefix)
+        self._seq = max(existing + list(self._index) + [0])
+        self._fd = None
+        self._open_segment()
+
+    def _open_segment(self):
+        self._seq += 1
+        self.path = _segment_path(self.directory, self.prefix, self._seq)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._opened = time.time()
+        self._last_sync = time.monotonic()
+        self._dirty = False
+        self._entry = {'file': os.path.basename(self.path), 'records': 0, 'bytes': 0,
+                       'first_ts': None, 'last_ts': None, 'closed': False}
+        self._index[self._seq] = self._entry
+        self._write_index()
+
+    def _write_index(self):
+        path = _index_path(self.directory, self.prefix)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'segments': {str(k): v for k, v in sorted(self._index.items())}}, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _sync(self):
+        if self._dirty:
+            os.fsync(self._fd)
+            self._dirty = False
+        self._last_sync = time.monotonic()
+
+    def _rotate(self):
+        self._sync()
+        os.close(self._fd)
+        self._entry['closed'] = True
+        self._open_segment()
+
+    def append(self, record):
+        """Append one record (a dict); adds `ts` (epoch seconds) if missing.
+
+        Returns:
+            The record's offset.
+        """
+        record = dict(record)
+        record.setdefault('ts', time.time())
+        line = (json.dumps(record, separators=(',', ':'), default=str) + '\n').encode('utf-8')
+        with self._lock:
+            if self._entry['records'] and (self._entry['bytes'] + len(line) > self.max_bytes or
+                                           (self.max_age and time.time() - self._opened > self.max_age)):
+                self._rotate()
+            offset = format_offset(self._seq, self._entry['bytes'])
+            os.write(self._fd, line)
+            self._dirty = True
+            entry = self._entry
+            entry['records'] += 1
+            entry['bytes'] += len(line)
+            if entry['first_ts'] is None:
+                entry['first_ts'] = record['ts']
+            entry['last_ts'] = record['ts']
+            if not self.fsync_interval or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+                self._write_index()
+        return offset
+
+    def flush(self):
+        """fsync pending records and persist the index."""
+        with self._lock:
+            self._sync()
+            self._write_index()
+
+    def close(self):
+        with self._lock:
+            if self._fd is None:
+                return
+            self._sync()
+            os.close(self._fd)
+            self._fd = None
+            self._entry['closed'] = True
+            self._write_index()
+
+
+def iter_records(directory, prefix='detections', since=None, start=None, end=None):
+    """Yield (record, next_offset) for records after offset `since`.
+
+    Args:
+        directory: Log directory
+        prefix: Segment file prefix
+        since: Offset ('<segment>:<byte>') to resume from, None for the beginning
+        start: Only records with ts >= start (epoch seconds)
+        end: Only records with ts < end (epoch seconds)
+    """
+    seq0, pos0 = parse_offset(since)
+    index = load_index(directory, prefix)
+    segments = [s for s in list_segments(directory, prefix) if s >= seq0]
+    for seq in segments:
+        entry = index.get(seq)
+        if entry and entry.get('closed') and entry.get('first_ts') is not None:
+            # Closed segment (index entry is final) entirely outside the time range
+            if (start is not None and entry['last_ts'] < start) or (end is not None and entry['first_ts'] >= end):
+                continue
+        pos = pos0 if seq == seq0 else 0
+        with open(_segment_path(directory, prefix, seq), 'rb') as f:
+            f.seek(pos)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Torn or still-being-written tail: retry it next time if this is the open segment
+                    break
+                pos += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                ts = record.get('ts')
+                if ts is not None and ((start is not None and ts < start) or (end is not None and ts >= end)):
+                    continue
+                yield record, format_offset(seq, pos)
+
+
+def read_since(directory, offset=None, prefix='detections', limit=None):
+    """Records after `offset` and the offset to resume from next time."""
+    records = []
+    next_offset = offset
+    for record, next_offset in iter_records(directory, prefix, since=offset):
+        records.append(record)
+        if limit is not None and len(records) >= limit:
+            break
+    return records, next_offset
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream detection log records as JSON Lines.')
+    parser.add_argument('directory', help='Detection log directory')
+    parser.add_argument('--prefix', default='detections', help='Segment file prefix')
+    parser.add_argument('--since', help="Offset '<segment>:<byte>' to resume from")
+    parser.add_argument('--offset-file', help='File holding the last synced offset; updated after reading')
+    parser.add_argument('--start', type=float, help='Only records with ts >= start (epoch seconds)')
+    parser.add_argument('--end', type=float, help='Only records with ts < end (epoch seconds)')
+    args = parser.parse_args()
+
+    since = args.since
+    if since is None and args.offset_file and os.path.exists(args.offset_file):
+        with open(args.offset_file, 'r') as f:
+            since = f.read().strip() or None
+    offset = since
+    for record, offset in iter_records(args.directory, args.prefix, since=since, start=args.start, end=args.end):
+        sys.stdout.write(json.dumps(record) + '\n')
+    sys.stdout.flush()
+    if args.offset_file and offset:
+        tmp = args.offset_file + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(offset)
+        os.replace(tmp, args.offset_file)
+    print(f"offset {offset or '0:0'}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Display - optional preview window for the detector loops.
+
+On drones and servers there is usually no display: `cv2.imshow` either raises or
+spends time rendering frames nobody sees. `FrameDisplay` wraps the imshow / waitKey
+pair so the loops do not care: with `--headless` (or when no X11 / Wayland display
+is found on Linux) it does nothing, and a window that cannot be opened switches it
+to headless instead of stopping the run.
+
+Example:
+    display = display_from_args(args, 'Drone Shark Detection')
+    while ...:
+        if not display.show(frame):   # False once 'q' is pressed
+            break
+    display.close()
+"""
+
+import os
+import sys
+
+import cv2
+
+
+def display_available():
+    """True unless this is a Linux host without an X11 / Wayland display."""
+    if not sys.platform.startswith('linux'):
+        return True
+    return bool(os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+
+
+class FrameDisplay:
+    """Preview window that can be switched off."""
+
+    def __init__(self, window, enabled=True):
+        self.window = window
+        self.enabled = enabled
+        self._opened = False
+
+    def show(self, frame, window=None):
+        """Show a frame and poll the keyboard; returns False when 'q' was pressed."""
+        if not self.enabled:
+            return True
+        try:
+            cv2.imshow(window or self.window, frame)
+        except cv2.error as e:
+            if self._opened:
+                raise
+            print(f"[display] cannot open a window ({str(e).strip().splitlines()[-1]}), running headless")
+            self.enabled = False
+            return True
+        self._opened = True
+        return not (cv2.waitKey(1) & 0xFF == ord('q'))
+
+    def close(self):
+        if self._opened:
+            cv2.destroyAllWindows()
+            self._opened = False
+
+
+def add_display_args(parser):
+    """Add the --headless option to an argparse parser."""
+    parser.add_argument('--headless', action='store_true',
+                        help='Do not open a preview window (default when no display is available)')
+
+
+def display_from_args(args, window):
+    """FrameDisplay for the parsed --headless option."""
+    if args.headless:
+        return FrameDisplay(window, enabled=False)
+    if not display_available():
+        print("[display] no display found, running headless")
+        return FrameDisplay(window, enabled=False)
+    return FrameDisplay(window)
@@ -2,8 +2,10 @@
 """
 Drone inference script for TFLite model.
 - Loads a TFLite model and runs inference on incoming frames.
-- Maintains a short circular buffer of frames; when detection confidence > threshold,
-  saves buffer + next N frames to disk as a short clip and logs a JSON with GPS.
+- Maintains a short circular buffer of frames (JPEG-compressed within a memory budget);
+  when a detection starts, a background thread saves buffer + next N frames to disk as a
+  short clip that runs until the detection ends (a new trigger in the tail extends it) and
+  appends a JSON Lines record with GPS to the detection log (see detection_log.py).
 
 Requirements:
 - tflite-runtime or TensorFlow with tflite interpreter
@@ -21,19 +23,23 @@ telemetry (MAVLink) or GPS module.
 
 import argparse
 import time
-import json
 import os
-from collections import deque
 from datetime import datetime
 
 import cv2
 import numpy as np
 
-try:
-    import tflite_runtime.interpreter as tflite
-except Exception:
-    import tensorflow as tf
-    tflite = tf.lite
+from clip_recorder import ENCODINGS, ClipWriter, FrameRing
+from detection_events import STARTED, DetectionEventEngine, add_event_args, engine_from_args
+from detection_log import DetectionLog
+from display import add_display_args, display_from_args
+from frame_gate import add_gate_args, gate_from_args
+from interpreter_pool import PooledInterpreter, add_interpreter_args, autotune, make_interpreter
+from metrics import LoopMetrics, add_metrics_args, metrics_from_args, process_age
+from preprocessing import (FramePreprocessor, dequantize, is_quantized, load_manifest, positive_index,
+                           quantize_pixels, resolve_threshold)
+from stream_source import add_stream_args, stream_from_args
+from tiling import TiledScore, add_tile_args, grid_from_args
 
 
 # Placeholder GPS getter: replace with real GPS/MAVLink code on the drone
@@ -43,139 +49,315 @@ def get_gps():
     return {'lat': None, 'lon': None, 'alt': None}
 
 
-def load_tflite_model(model_path):
-    interpreter = tflite.Interpreter(model_path=model_path)
-    interpreter.allocate_tensors()
+def load_tflite_model(model_path, num_threads=None, delegate='xnnpack'):
+    # tflite-runtime preferred, TensorFlow's tf.lite as fallback
+    interpreter = make_interpreter(model_path, num_threads=num_threads, delegate=delegate)
     input_details = interpreter.get_input_details()
     output_details = interpreter.get_output_details()
     return interpreter, input_details, output_details
 
 
-def preprocess_frame_for_tflite(frame, input_shape, preprocess_type='default'):
-    # input_shape: (1, H, W, C)
-    h, w = input_shape[1], input_shape[2]
-    img = cv2.resize(frame, (w, h))
-    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    img = img_rgb.astype(np.float32)
+def preprocess_tiles_for_tflite(tiles, preprocess_type='default', input_detail=None):
+    # tiles: (N, H, W, 3) BGR uint8 -> float32 RGB batch, vectorized over all tiles
+    if input_detail is not None and is_quantized(input_detail):
+        normalization = 'mobilenetv2' if preprocess_type == 'mobilenetv2' else 'unit'
+        return quantize_pixels(np.ascontiguousarray(tiles[..., ::-1]), input_detail, normalization)
+    batch = tiles[..., ::-1].astype(np.float32)
     if preprocess_type == 'mobilenetv2':
-        from tensorflow.keras.applications.mobilenet_v2 import preprocess_input
-        img = preprocess_input(img)
+        batch *= 1.0 / 127.5
+        batch -= 1.0
     else:
-        img = img / 255.0
-    # Check input dtype
-    return np.expand_dims(img, axis=0)
-
-
-def run_inference(interpreter, input_details, output_details, prepped):
-    interpreter.set_tensor(input_details[0]['index'], prepped.astype(input_details[0]['dtype']))
+        batch *= 1.0 / 255.0
+    return batch
+
+
+def run_inference_batch(interpreter, batch):
+    # Resize the input tensor to the batch dimension when it changes
+    input_detail = interpreter.get_input_details()[0]
+    if input_detail['shape'][0] != batch.shape[0]:
+        interpreter.resize_tensor_input(input_detail['index'], list(batch.shape))
+        interpreter.allocate_tensors()
+        input_detail = interpreter.get_input_details()[0]
+    interpreter.set_tensor(input_detail['index'], batch.astype(input_detail['dtype']))
     interpreter.invoke()
-    output_data = interpreter.get_tensor(output_details[0]['index'])
-    # Assuming output is single sigmoid probability
-    score = float(output_data.ravel()[0])
-    return score
+    output_detail = interpreter.get_output_details()[0]
+    output_data = dequantize(interpreter.get_tensor(output_detail['index']), output_detail)
+    return output_data.reshape(len(batch), -1)[:, 0]
+
+
+class DroneLoop:
+    """The per-frame step of the drone loop.
+
+    Scores a frame (through the optional gate and tile grid), updates the detection
+    events, keeps the clean frame in the pre-trigger ring and draws the overlay.
+    Capture, clip recording and display stay with the caller.
+    """
+
+    def __init__(self, model, threshold=None, preprocess=None, num_threads=None, delegate='xnnpack',
+                 metrics=None):
+        """Load the model and set up default per-frame state.
+
+        Args:
+            model: Path to the .tflite model
+            threshold: Detection threshold (default: the manifest's, else 0.5)
+            preprocess: 'default' or 'mobilenetv2' (default: from the manifest)
+            num_threads: Interpreter threads
+            delegate: Interpreter delegate
+            metrics: LoopMetrics receiving stage timings and counters
+
+        `events`, `ring`, `grid` and `gate` may be replaced after construction.
+        """
+        self.interpreter, self.input_details, self.output_details = load_tflite_model(model, num_threads, delegate)
+        self.input_shape = self.input_details[0]['shape']
+        # Normalization, class order and threshold come from the trainer's manifest
+        # unless given explicitly
+        manifest = load_manifest(model)
+        if preprocess is None:
+            self.normalization = manifest['normalization']
+        else:
+            self.normalization = 'mobilenetv2' if preprocess == 'mobilenetv2' else 'unit'
+        self.preprocess_type = 'mobilenetv2' if self.normalization == 'mobilenetv2' else 'default'
+        self.threshold = resolve_threshold(threshold, manifest)
+        self.invert = positive_index(manifest) == 0
+        # Frames are resized / normalized in preallocated buffers and written straight
+        # into the interpreter's input tensor
+        self.preprocessor = FramePreprocessor(self.input_shape[1], self.input_shape[2], self.normalization,
+                                              self.input_details[0])
+        self.runner = PooledInterpreter(self.interpreter)
+        self.metrics = metrics if metrics is not None else LoopMetrics()
+        self.events = DetectionEventEngine(enter_threshold=self.threshold)
+        self.ring = FrameRing(50)
+        self.grid = None
+        self.gate = None
+        self._frame = None
+        self._preprocess_time = 0.0
+
+    def _fill(self, view):
+        t0 = time.perf_counter()
+        self.preprocessor(self._frame, out=view)
+        self._preprocess_time = time.perf_counter() - t0
+
+    def predict(self, frame):
+        """Score one frame (a TiledScore when a tile grid is set)."""
+        metrics = self.metrics
+        metrics.frames_inferred.inc()
+        t0 = time.perf_counter()
+        if self.grid is not None:
+            tiles, boxes = self.grid.extract(frame)
+            batch = preprocess_tiles_for_tflite(tiles, preprocess_type=self.preprocess_type,
+                                                input_detail=self.input_details[0])
+            t1 = time.perf_counter()
+            scores = run_inference_batch(self.interpreter, batch)
+            metrics.observe('preprocess', t1 - t0)
+            metrics.observe('invoke', time.perf_counter() - t1)
+            score = TiledScore(1.0 - scores if self.invert else scores, boxes)
+        else:
+            self._frame = frame
+            try:
+                output_data = self.runner.run_into(self._fill)
+            finally:
+                self._frame = None
+            metrics.observe('preprocess', self._preprocess_time)
+            metrics.observe('invoke', time.perf_counter() - t0 - self._preprocess_time)
+            score = float(dequantize(output_data, self.output_details[0]).ravel()[0])
+            score = 1.0 - score if self.invert else score
+        metrics.scores.observe(score)
+        metrics.mark_first_inference()
+        return score
+
+    def step(self, frame, on_events=None):
+        """Run one frame through the loop, drawing the overlay onto it.
+
+        Args:
+            frame: BGR frame
+            on_events: Optional callable(score, events), run before the frame enters the
+                ring so a clip opened there starts with the pre-trigger frames only
+
+        Returns:
+            (score, list of DetectionEvent)
+        """
+        metrics = self.metrics
+        # Run inference on every frame, or only on frames the gate lets through
+        score = self.predict(frame) if self.gate is None else self.gate.score(frame, self.predict)
+
+        t0 = time.perf_counter()
+        events = self.events.update(score)
+        for event in events:
+            metrics.event(event.kind)
+        if on_events is not None:
+            on_events(score, events)
+
+        # Keep the clean frame for later pre-trigger footage
+        t1 = time.perf_counter()
+        self.ring.push(frame)
+        t2 = time.perf_counter()
+        metrics.observe('buffer', t2 - t1)
 
-
-def save_clip(frames, out_path, fps=10):
-    if not frames:
-        return
-    h, w = frames[0].shape[:2]
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    writer = cv2.VideoWriter(out_path, fourcc, fps, (w, h))
-    for f in frames:
-        writer.write(f)
-    writer.release()
+        # Visual overlay
+        label = f"Shark: {score:.2f}"
+        color = (0, 0, 255) if self.events.active else (0, 255, 0)
+        cv2.putText(frame, label, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, color, 2)
+        if isinstance(score, TiledScore):
+            for x, y, bw, bh in score.fired(self.threshold):
+                cv2.rectangle(frame, (int(x), int(y)), (int(x + bw), int(y + bh)), (0, 0, 255), 2)
+        metrics.observe('postprocess', (t1 - t0) + (time.perf_counter() - t2))
+        return score, events
 
 
 def main(args):
-    interpreter, input_details, output_details = load_tflite_model(args.model)
-    input_shape = input_details[0]['shape']
-
-    # Circular buffer to store recent frames (store raw BGR frames)
-    buffer = deque(maxlen=args.buffer_size)
-
-    cap = cv2.VideoCapture(args.camera)
+    num_threads, delegate = args.num_threads, args.delegate
+    if args.autotune:
+        choice = autotune(args.model)
+        num_threads, delegate = choice['num_threads'], choice['delegate']
+    # Stage timings / counters, optional /metrics endpoint, log line and profiler
+    runtime = metrics_from_args(args)
+    metrics = runtime.metrics
+    loop = DroneLoop(args.model, threshold=args.threshold, preprocess=args.preprocess,
+                     num_threads=num_threads, delegate=delegate, metrics=metrics)
+    input_shape = loop.input_shape
+    threshold = loop.threshold
+    print(f"Model input {input_shape[1]}x{input_shape[2]}, {loop.normalization} normalization, threshold {threshold:.2f}")
+    # Blank invocations before the camera opens, so the first real frame runs at full speed
+    loaded = process_age()
+    warmup = loop.runner.warmup()
+    print(f"[startup] model ready {loaded:.2f} s after process start, warm-up {1000 * warmup:.0f} ms")
+
+    # Pre-trigger frames, JPEG-compressed (or in a raw arena) within a memory budget
+    ring = loop.ring = FrameRing(args.buffer_size, budget_mb=args.buffer_mb, encoding=args.buffer_encoding,
+                                 quality=args.buffer_quality)
+    # Clips are encoded on a background thread so the capture loop never stalls
+    clip_writer = ClipWriter(fps=args.fps)
+
+    # Optional tiled inference for high-resolution footage
+    grid = loop.grid = grid_from_args(args, tile=int(input_shape[1]))
+
+    # Live feeds: low-latency options, freshest frame only, reconnect on link loss.
+    # Decode-time reduction stops at the model input size (tiles need the full frame)
+    cap = stream_from_args(args, args.camera, min_side=None if grid is not None else int(min(input_shape[1:3])))
     if not cap.isOpened():
         print('Error: cannot open camera/file')
+        runtime.close()
         return
 
     post_trigger_frames = args.post_trigger
-    triggered = False
-    post_count = 0
+    clip = None
+    remaining = 0
+    ts = None
 
-    detection_log = []
+    # Append-only JSONL log (rotated, indexed, fsynced periodically)
+    detection_log = DetectionLog(args.output_dir, max_bytes=int(args.log_max_mb * 1024 * 1024))
     clip_idx = 0
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        buffer.append(frame.copy())
-
-        # Run inference every N frames to save CPU if desired
-        # For now run every frame
-        prepped = preprocess_frame_for_tflite(frame, input_shape, preprocess_type=args.preprocess)
-        score = run_inference(interpreter, input_details, output_details, prepped)
-
-        # Visual overlay
-        label = f"Shark: {score:.2f}"
-        color = (0, 0, 255) if score > args.threshold else (0, 255, 0)
-        cv2.putText(frame, label, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, color, 2)
-
-        cv2.imshow('Drone Shark Detection', frame)
-
-        if score > args.threshold and not triggered:
-            print(f"Trigger at {datetime.utcnow().isoformat()} score={score:.3f}")
-            triggered = True
-            post_count = 0
-            # Save the buffer + upcoming frames after trigger
-            clip_frames = list(buffer)
-            # Continue collecting post_trigger_frames
-        if triggered:
-            post_count += 1
-            clip_frames.append(frame.copy())
-            if post_count >= post_trigger_frames:
-                # Save clip
+    # Debounced detection state (smoothing + hysteresis + cooldown)
+    events = loop.events = engine_from_args(args, threshold)
+    event_id = None
+    # Optional adaptive stride / motion gate; skipped frames reuse the last score
+    gate = loop.gate = gate_from_args(args, threshold)
+
+    metrics.track_queue('clip-writer', clip_writer.pending)
+    metrics.track_stream(cap)
+    if gate is not None:
+        metrics.track_skipped(gate)
+    # Preview window unless --headless or no display is available
+    display = display_from_args(args, 'Drone Shark Detection')
+
+    def on_events(score, detections):
+        # Opens or extends the clip before the current frame enters the ring
+        nonlocal clip, remaining, ts, event_id
+        started = False
+        for event in detections:
+            print(f"Detection {event.kind}: id={event.event_id} score={event.score:.3f} peak={event.peak_score:.3f}")
+            if event.kind == STARTED:
+                started = True
+                event_id = event.event_id
+
+        if started:
+            if clip is None:
+                print(f"Trigger at {datetime.utcnow().isoformat()} score={score:.3f}")
                 ts = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
-                clip_name = f"detection_clip_{ts}_{clip_idx}.mp4"
-                clip_path = os.path.join(args.output_dir, clip_name)
-                save_clip(clip_frames, clip_path, fps=args.fps)
-
-                gps = get_gps()
-                log_entry = {
-                    'timestamp_utc': ts,
-                    'clip': clip_path,
-                    'score': float(score),
-                    'gps': gps
-                }
-                detection_log.append(log_entry)
-                # write log to file
-                log_file = os.path.join(args.output_dir, 'detections.json')
-                with open(log_file, 'w') as lf:
-                    json.dump(detection_log, lf, indent=2)
-
-                print(f"Saved clip {clip_path}")
-                clip_idx += 1
-                triggered = False
-                clip_frames = []
-
-        key = cv2.waitKey(1) & 0xFF
-        if key == ord('q'):
-            break
-
-    cap.release()
-    cv2.destroyAllWindows()
+                clip_path = os.path.join(args.output_dir, f"detection_clip_{ts}_{clip_idx}.mp4")
+                # Pre-trigger frames go to the writer thread as they are (no copies)
+                clip = clip_writer.open(clip_path, ring.snapshot())
+            else:
+                print(f"Trigger during open clip, extending {clip.path}")
+        if clip is not None and (started or events.active):
+            # The clip runs until the detection ends, then for the post-trigger tail
+            remaining = post_trigger_frames
+
+    try:
+        while True:
+            t0 = time.perf_counter()
+            ret, frame = cap.read()
+            if not ret:
+                break
+            metrics.observe('decode', time.perf_counter() - t0)
+            metrics.frames_read.inc()
+
+            # Score, events, ring and overlay
+            score, _ = loop.step(frame, on_events)
+
+            t0 = time.perf_counter()
+            keep_going = display.show(frame)
+
+            if clip is not None:
+                # The frame is not touched after this, so it is handed over without a copy
+                clip.write(frame)
+                remaining -= 1
+                if remaining <= 0:
+                    clip.close()
+                    gps = get_gps()
+                    log_entry = {
+                        'timestamp_utc': ts,
+                        'clip': clip.path,
+                        'score': float(score),
+                        'event_id': event_id,
+                        'gps': gps
+                    }
+                    detection_log.append(log_entry)
+
+                    clip_idx += 1
+                    clip = None
+
+            metrics.observe('output', time.perf_counter() - t0)
+            if not keep_going:
+                break
+    finally:
+        if clip is not None:
+            clip.close()
+        cap.release()
+        display.close()
+        # Wait for queued clips to be encoded
+        clip_writer.close()
+        detection_log.close()
+        if gate is not None:
+            print(gate.report())
+        runtime.close()
 
 
 if __name__ == '__main__':
     p = argparse.ArgumentParser()
     p.add_argument('--model', required=True, help='Path to .tflite model')
     p.add_argument('--camera', default=0, help='Camera index or video file')
-    p.add_argument('--threshold', type=float, default=0.5, help='Detection threshold')
+    p.add_argument('--threshold', type=float, default=None,
+                   help="Detection threshold (default: the model's calibrated threshold, else 0.5)")
+    add_event_args(p)
+    add_gate_args(p)
+    add_tile_args(p)
+    add_interpreter_args(p, pool=False)
     p.add_argument('--buffer-size', type=int, default=50, help='Pre-trigger buffer size (frames)')
-    p.add_argument('--post-trigger', type=int, default=30, help='Frames to record after trigger')
+    p.add_argument('--buffer-mb', type=float, default=128.0, help='Memory budget for pre-trigger frames (MB)')
+    p.add_argument('--buffer-encoding', choices=ENCODINGS, default='jpeg',
+                   help="Pre-trigger frames as 'jpeg' (compressed) or 'raw' (preallocated arena)")
+    p.add_argument('--buffer-quality', type=int, default=90, help='JPEG quality of buffered frames')
+    p.add_argument('--post-trigger', type=int, default=30,
+                   help='Frames to record after the detection ends (a new trigger during a clip extends it)')
     p.add_argument('--output-dir', default='detections', help='Directory to save clips and logs')
+    p.add_argument('--log-max-mb', type=float, default=16.0, help='Rotate the detection log segment at this size (MB)')
     p.add_argument('--fps', type=int, default=10, help='FPS for saved clips')
-    p.add_argument('--preprocess', choices=['default', 'mobilenetv2'], default='mobilenetv2', help='Preprocessing type')
+    p.add_argument('--preprocess', choices=['default', 'mobilenetv2'], default=None,
+                   help="Preprocessing type (default: from the model's manifest, mobilenetv2 if there is none)")
+    add_stream_args(p)
+    add_display_args(p)
+    add_metrics_args(p)
     args = p.parse_args()
 
     os.makedirs(args.output_dir, exist_ok=True)
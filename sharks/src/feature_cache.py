@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Feature cache - frozen-backbone embeddings computed once and memory-mapped.
+
+While the backbone is frozen, the head only ever sees the backbone's pooled
+embedding of each (image, augmentation) pair, so those embeddings can be computed
+once and reused across epochs, runs and hyperparameter sweeps.
+
+Each split is stored as `<cache_dir>/<name>/features.npy` (read back with
+`mmap_mode='r'`) plus `keys.json`, one `<sha1 of file contents>:<seed>:<resize>` key
+per row. Images are resized like `tf.keras.utils.load_img` (PIL nearest neighbour),
+so the head sees the pixels flow_from_directory and the trainer's evaluation see.
+Seed 0 is the plain image; seeds 1..N are deterministic random
+rotation / shift / flip variants (the ImageDataGenerator settings). On every use
+the keys needed for the current data are compared with the stored ones: rows of
+unchanged files are kept, new files are embedded and rows of removed or modified
+files are dropped, so the cache follows the data directory by itself.
+"""
+
+import hashlib
+import json
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Part of every key: rows embedded from differently resampled pixels are never reused
+RESIZE = 'nearest'
+
+
+def file_digest(path, chunk=1 << 20):
+    """SHA-1 of a file's contents."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_rgb(path, img_size):
+    """Read an image as a (img_size, img_size, 3) uint8 RGB array, resized like `tf.keras.utils.load_img`."""
+    try:
+        with Image.open(path) as img:
+            img = img.convert('RGB')
+            if img.size != (img_size, img_size):
+                img = img.resize((img_size, img_size), Image.NEAREST)
+            return np.asarray(img, dtype=np.uint8)
+    except OSError as e:
+        raise ValueError(f"Could not read image: {path}") from e
+
+
+def augment(img, seed, digest='0', rotation=20.0, shift=0.2):
+    """Deterministic rotation / shift / horizontal flip for (image, seed); seed 0 is the identity."""
+    if not seed:
+        return img
+    rng = np.random.default_rng([int(seed), int(digest[:8], 16)])
+    h, w = img.shape[:2]
+    m = cv2.getRotationMatrix2D((w / 2.0, h / 2.0), rng.uniform(-rotation, rotation), 1.0)
+    m[:, 2] += (rng.uniform(-shift, shift) * w, rng.uniform(-shift, shift) * h)
+    out = cv2.warpAffine(img, m, (w, h), borderMode=cv2.BORDER_REPLICATE)
+    return out[:, ::-1] if rng.random() < 0.5 else out
+
+
+class FeatureStore:
+    """Memory-mapped embedding rows keyed by `<file digest>:<seed>`."""
+
+    def __init__(self, cache_dir, name):
+        self.directory = os.path.join(str(cache_dir), name)
+        self.features_path = os.path.join(self.directory, 'features.npy')
+        self.keys_path = os.path.join(self.directory, 'keys.json')
+
+    def _load(self):
+        try:
+            with open(self.keys_path, 'r') as f:
+                keys = json.load(f)
+            features = np.load(self.features_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return [], None
+        if len(keys) != len(features):
+            return [], None
+        return keys, features
+
+    def features(self, items, embed_fn, img_size, batch_size=32):
+        """Embeddings for `items`, computing only rows that are not cached yet.
+
+        Args:
+            items: List of (path, seed)
+            embed_fn: Callable(uint8 RGB batch (N, H, W, 3)) -> (N, D) array
+            img_size: Input size the backbone is run at
+            batch_size: Images embedded per call
+
+        Returns:
+            (len(items), D) array, memory-mapped when the store already matches `items`.
+        """
+        digests = {}
+        for path, _ in items:
+            if path not in digests:
+                digests[path] = file_digest(path)
+        keys = [f"{digests[path]}:{seed}:{RESIZE}" for path, seed in items]
+        stored_keys, stored = self._load()
+        if stored is not None and stored_keys == keys:
+            return stored
+
+        rows = {k: i for i, k in enumerate(stored_keys)}
+        missing = [i for i, k in enumerate(keys) if k not in rows]
+        reused = len(keys) - len(missing)
+        print(f"[features] {self.directory}: {reused} cached, {len(missing)} to compute, "
+              f"{len(set(stored_keys) - set(keys))} stale")
+
+        computed = {}
+        for start in range(0, len(missing), batch_size):
+            chunk = missing[start:start + batch_size]
+            batch = np.stack([augment(load_rgb(items[i][0], img_size), items[i][1], digests[items[i][0]])
+                              for i in chunk])
+            for i, vector in zip(chunk, np.asarray(embed_fn(batch), dtype=np.float32)):
+                computed[i] = vector
+        dim = stored.shape[1] if stored is not None and len(stored) else len(next(iter(computed.values())))
+
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self.features_path + '.tmp.npy'
+        out = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float32, shape=(len(keys), dim))
+        for i, k in enumerate(keys):
+            out[i] = computed[i] if i in computed else stored[rows[k]]
+        out.flush()
+        del out, stored
+        os.replace(tmp, self.features_path)
+        with open(self.keys_path + '.tmp', 'w') as f:
+            json.dump(keys, f)
+        os.replace(self.keys_path + '.tmp', self.keys_path)
+        return np.load(self.features_path, mmap_mode='r')
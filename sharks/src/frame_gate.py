@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Frame gate - decide cheaply whether a frame needs a model invocation.
+
+Two mechanisms, usable together:
+    adaptive stride - run the model every N frames; N doubles while recent scores
+                      stay far below the threshold and drops back to 1 as soon as a
+                      score moves towards it
+    motion gate     - compare a tiny grayscale thumbnail against the last inferred
+                      frame and skip the model when the scene has not changed
+
+Skipped frames reuse the last score, so overlays and the detection trigger logic
+keep seeing a value for every frame.
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """Downscaled frame-difference change detector."""
+
+    def __init__(self, threshold=4.0, size=32):
+        """Create the gate.
+
+        Args:
+            threshold: Mean absolute gray-level difference (0-255) that counts as motion
+            size: Thumbnail edge length used for the comparison
+        """
+        self.threshold = threshold
+        self.size = size
+        self._reference = None
+        self._thumb = np.empty((size, size), dtype=np.uint8)
+        self.last_diff = 0.0
+
+    def _thumbnail(self, frame):
+        small = cv2.resize(frame, (self.size, self.size), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            cv2.cvtColor(small, cv2.COLOR_BGR2GRAY, dst=self._thumb)
+            return self._thumb
+        return small
+
+    def changed(self, frame):
+        """True if the frame differs from the reference (last accepted) frame."""
+        thumb = self._thumbnail(frame)
+        if self._reference is None:
+            return True
+        self.last_diff = float(cv2.absdiff(thumb, self._reference).mean())
+        return self.last_diff >= self.threshold
+
+    def accept(self, frame):
+        """Make `frame` the new reference (call when the model ran on it)."""
+        self._reference = self._thumbnail(frame).copy()
+
+
+class AdaptiveStride:
+    """Inference stride that grows while scores are far below the threshold."""
+
+    def __init__(self, threshold, max_stride=8, near_margin=0.25, patience=3):
+        """Create the stride controller.
+
+        Args:
+            threshold: Detection threshold the scores are compared to
+            max_stride: Largest allowed stride (frames between inferences)
+            near_margin: Scores within this distance below the threshold count as "near"
+            patience: Consecutive far scores needed before the stride doubles
+        """
+        self.threshold = threshold
+        self.max_stride = max(1, int(max_stride))
+        self.near_margin = near_margin
+        self.patience = max(1, int(patience))
+        self.stride = 1
+        self._far_streak = 0
+
+    def near(self, score):
+        return score >= self.threshold - self.near_margin
+
+    def observe(self, score):
+        if self.near(score):
+            self.stride = 1
+            self._far_streak = 0
+            return
+        self._far_streak += 1
+        if self._far_streak >= self.patience:
+            self.stride = min(self.max_stride, self.stride * 2)
+            self._far_streak = 0
+
+
+class InferenceGate:
+    """Combine adaptive stride and motion gating, and count what was skipped."""
+
+    def __init__(self, stride=None, motion=None, max_skip=30, report_interval=10.0):
+        """Create the gate.
+
+        Args:
+            stride: AdaptiveStride or None
+            motion: MotionGate or None
+            max_skip: Never skip more than this many consecutive frames
+            report_interval: Seconds between counter lines (0 disables them)
+        """
+        self.stride = stride
+        self.motion = motion
+        self.max_skip = max(1, int(max_skip))
+        self.report_interval = report_interval
+        self.last_score = 0.0
+        self.counters = {'frames': 0, 'inferred': 0, 'skipped_stride': 0, 'skipped_motion': 0}
+        self._since_inference = 0
+        self._start = time.perf_counter()
+        self._last_report = self._start
+
+    def should_infer(self, frame):
+        """Decide whether to run the model on `frame`."""
+        self.counters['frames'] += 1
+        self._since_inference += 1
+        if self._since_inference > self.max_skip:
+            return True
+        hot = self.stride is not None and self.stride.near(self.last_score)
+        if self.stride is not None and self._since_inference < self.stride.stride:
+            self.counters['skipped_stride'] += 1
+            return False
+        if self.motion is not None and not hot and not self.motion.changed(frame):
+            self.counters['skipped_motion'] += 1
+            return False
+        return True
+
+    def observe(self, frame, score):
+        """Record the score of a frame the model ran on."""
+        self.counters['inferred'] += 1
+        self._since_inference = 0
+        self.last_score = score
+        if self.stride is not None:
+            self.stride.observe(score)
+        if self.motion is not None:
+            self.motion.accept(frame)
+        self._maybe_report()
+
+    def score(self, frame, predict_fn):
+        """Return the model score for `frame`, or the last score if it is skipped."""
+        if self.should_infer(frame):
+            self.observe(frame, predict_fn(frame))
+        else:
+            self._maybe_report()
+        return self.last_score
+
+    def effective_fps(self):
+        """Model invocations per second since the gate was created."""
+        elapsed = time.perf_counter() - self._start
+        return self.counters['inferred'] / elapsed if elapsed > 0 else 0.0
+
+    def report(self):
+        c = self.counters
+        ratio = c['inferred'] / c['frames'] if c['frames'] else 0.0
+        stride = self.stride.stride if self.stride is not None else 1
+        return (f"[gate] frames {c['frames']} | inferred {c['inferred']} ({ratio:.0%}) | "
+                f"skipped stride {c['skipped_stride']} motion {c['skipped_motion']} | "
+                f"stride {stride} | inference {self.effective_fps():.1f} fps")
+
+    def _maybe_report(self):
+        if not self.report_interval:
+            return
+        now = time.perf_counter()
+        if now - self._last_report >= self.report_interval:
+            self._last_report = now
+            print(self.report())
+
+
+def add_gate_args(parser):
+    """Register frame-gating CLI options on an argparse parser."""
+    parser.add_argument('--adaptive-stride', action='store_true',
+                        help='Skip inference on frames while scores stay far below the threshold')
+    parser.add_argument('--max-stride', type=int, default=8, help='Largest adaptive inference stride (frames)')
+    parser.add_argument('--near-margin', type=float, default=0.25,
+                        help='Scores within this margin below the threshold force inference on every frame')
+    parser.add_argument('--motion-gate', action='store_true',
+                        help='Skip inference when the scene has not changed since the last inferred frame')
+    parser.add_argument('--motion-threshold', type=float, default=4.0,
+                        help='Mean gray-level difference (0-255) that counts as motion')
+    parser.add_argument('--gate-report-interval', type=float, default=10.0,
+                        help='Seconds between frame-gate counter lines (0 to disable)')
+
+
+def gate_from_args(args, threshold):
+    """Build an InferenceGate from `add_gate_args` options, or None if gating is off."""
+    if not (args.adaptive_stride or args.motion_gate):
+        return None
+    stride = AdaptiveStride(threshold, max_stride=args.max_stride, near_margin=args.near_margin) \
+        if args.adaptive_stride else None
+    motion = MotionGate(threshold=args.motion_threshold) if args.motion_gate else None
+    max_skip = max(args.max_stride, 1) * 4 if stride else 30
+    return InferenceGate(stride=stride, motion=motion, max_skip=max_skip,
+                         report_interval=args.gate_report_interval)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Frame pipeline - run capture, inference and sink (writer/display/alerts) as
+separate stages joined by bounded queues.
+
+The decoder and inference stages run on background threads; the sink stage runs
+on the calling thread so that `cv2.imshow`/`cv2.waitKey` stay on the main thread.
+
+Drop policies:
+    latest  - keep only the newest frame between stages (live cameras / streams)
+    all     - keep every frame and apply back-pressure (video files)
+"""
+
+import queue
+import threading
+import time
+
+DROP_POLICIES = ('latest', 'all')
+
+# Marks the end of the stream between stages
+_EOS = object()
+
+
+def resolve_drop_policy(source, policy=None):
+    """Pick a drop policy for a video source.
+
+    Args:
+        source: Camera index, stream URL or video file path
+        policy: Explicit policy ('latest', 'all') or None/'auto' to infer it
+
+    Returns:
+        'latest' for cameras and network streams, 'all' for files.
+    """
+    if policy and policy != 'auto':
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {policy}")
+        return policy
+    if isinstance(source, int) or str(source).isdigit():
+        return 'latest'
+    if '://' in str(source):
+        return 'latest'
+    return 'all'
+
+
+class StageStats:
+    """Throughput counters for a single pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.busy = 0.0
+        self._window_count = 0
+        self._window_start = time.perf_counter()
+
+    def record(self, elapsed):
+        self.count += 1
+        self.busy += elapsed
+        self._window_count += 1
+
+    def fps(self, now=None):
+        """Frames per second since the last call to `reset_window`."""
+        now = now or time.perf_counter()
+        span = now - self._window_start
+        return self._window_count / span if span > 0 else 0.0
+
+    def reset_window(self, now=None):
+        self._window_count = 0
+        self._window_start = now or time.perf_counter()
+
+    def rewind(self, start):
+        """Make the window span everything recorded since `start`."""
+        self._window_count = self.count
+        self._window_start = start
+
+
+class FramePipeline:
+    """Decoder -> inference -> sink pipeline joined by bounded queues."""
+
+    def __init__(self, read_fn, infer_fn, sink_fn, policy='all', queue_size=4, stats_interval=5.0):
+        """Create the pipeline.
+
+        Args:
+            read_fn: Callable returning (ok, frame), e.g. `cv2.VideoCapture.read`
+            infer_fn: Callable mapping a frame to a score
+            sink_fn: Callable (frame, score) -> bool; returning False stops the pipeline
+            policy: 'latest' to drop stale frames, 'all' to keep every frame
+            queue_size: Capacity of each inter-stage queue ('latest' always uses 1)
+            stats_interval: Seconds between stats lines (0 disables periodic output)
+        """
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {policy}")
+        self.read_fn = read_fn
+        self.infer_fn = infer_fn
+        self.sink_fn = sink_fn
+        self.policy = policy
+        self.stats_interval = stats_interval
+
+        size = 1 if policy == 'latest' else max(1, int(queue_size))
+        self.decoded = queue.Queue(maxsize=size)
+        self.inferred = queue.Queue(maxsize=size)
+
+        self.stats = {name: StageStats(name) for name in ('decode', 'infer', 'sink')}
+        self.dropped = {'decode': 0, 'infer': 0}
+        self.errors = []
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def _put(self, q, item, stage):
+        """Queue an item honouring the drop policy; returns False once stopped."""
+        if self.policy == 'latest' and item is not _EOS:
+            while True:
+                try:
+                    q.put_nowait(item)
+                    return True
+                except queue.Full:
+                    try:
+                        q.get_nowait()
+                        with self._lock:
+                            self.dropped[stage] += 1
+                    except queue.Empty:
+                        pass
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _EOS
+
+    def _decode_loop(self):
+        stats = self.stats['decode']
+        try:
+            while not self._stop.is_set():
+                t0 = time.perf_counter()
+                ret, frame = self.read_fn()
+                if not ret:
+                    break
+                stats.record(time.perf_counter() - t0)
+                if not self._put(self.decoded, frame, 'decode'):
+                    return
+        except Exception as e:
+            self.errors.append(e)
+        self._put(self.decoded, _EOS, 'decode')
+
+    def _infer_loop(self):
+        stats = self.stats['infer']
+        try:
+            while True:
+                frame = self._get(self.decoded)
+                if frame is _EOS:
+                    break
+                t0 = time.perf_counter()
+                score = self.infer_fn(frame)
+                stats.record(time.perf_counter() - t0)
+                if not self._put(self.inferred, (frame, score), 'infer'):
+                    return
+        except Exception as e:
+            self.errors.append(e)
+        self._put(self.inferred, _EOS, 'infer')
+
+    def snapshot(self):
+        """Return current per-stage throughput and queue depth."""
+        now = time.perf_counter()
+        return {
+            'policy': self.policy,
+            'stages': {
+                name: {
+                    'frames': s.count,
+                    'fps': round(s.fps(now), 2),
+                    'busy_ms': round(1000.0 * s.busy / s.count, 2) if s.count else 0.0,
+                }
+                for name, s in self.stats.items()
+            },
+            'queues': {
+                'decode->infer': (self.decoded.qsize(), self.decoded.maxsize),
+                'infer->sink': (self.inferred.qsize(), self.inferred.maxsize),
+            },
+            'dropped': dict(self.dropped),
+        }
+
+    def format_stats(self, snap=None):
+        snap = snap or self.snapshot()
+        stages = ' | '.join(f"{n} {s['fps']:.1f} fps ({s['busy_ms']:.1f} ms)" for n, s in snap['stages'].items())
+        queues = ' '.join(f"{n}={d}/{m}" for n, (d, m) in snap['queues'].items())
+        dropped = sum(snap['dropped'].values())
+        return f"[pipeline:{snap['policy']}] {stages} | queues {queues} | dropped {dropped}"
+
+    def _maybe_report(self, last_report):
+        if not self.stats_interval:
+            return last_report
+        now = time.perf_counter()
+        if now - last_report < self.stats_interval:
+            return last_report
+        print(self.format_stats())
+        for s in self.stats.values():
+            s.reset_window(now)
+        return now
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        """Run until the source is exhausted or the sink asks to stop.
+
+        Returns:
+            Final stats snapshot (see `snapshot`).
+        """
+        start = time.perf_counter()
+        for s in self.stats.values():
+            s.reset_window(start)
+        workers = [
+            threading.Thread(target=self._decode_loop, name='pipeline-decode', daemon=True),
+            threading.Thread(target=self._infer_loop, name='pipeline-infer', daemon=True),
+        ]
+        for w in workers:
+            w.start()
+
+        stats = self.stats['sink']
+        last_report = start
+        try:
+            while True:
+                item = self._get(self.inferred)
+                if item is _EOS:
+                    break
+                frame, score = item
+                t0 = time.perf_counter()
+                keep_going = self.sink_fn(frame, score)
+                stats.record(time.perf_counter() - t0)
+                if keep_going is False:
+                    break
+                last_report = self._maybe_report(last_report)
+        finally:
+            self.stop()
+            for w in workers:
+                w.join(timeout=2.0)
+
+        # Summarize over the whole run rather than the last window
+        for s in self.stats.values():
+            s.rewind(start)
+        snap = self.snapshot()
+        if self.stats_interval:
+            print(self.format_stats(snap))
+        if self.errors:
+            raise self.errors[0]
+        return snap
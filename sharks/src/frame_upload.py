@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Frame upload - prepare detection frames for the report API.
+
+Frames are sent as raw JPEG multipart parts (see `alert_delivery`), so the bytes
+that go over the link are decided here:
+    quality  - JPEG quality of the uploaded image
+    max_side - downscale so the longer side is at most this many pixels
+    roi      - crop to the tiles that fired (tiled inference) plus a margin
+    dedupe   - skip the image when it is a near-duplicate (perceptual dHash within
+               `max_distance` bits) of one already uploaded for the same event
+"""
+
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+def dhash(image, size=8):
+    """Difference hash of an image: horizontal gradient signs of a (size+1) x size thumbnail."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class FrameDeduper:
+    """Remembers the hashes uploaded per event and flags near-duplicates."""
+
+    def __init__(self, max_distance=6, max_keys=64, per_key=8):
+        """Create the deduper.
+
+        Args:
+            max_distance: Hashes within this many bits count as the same picture (0 disables)
+            max_keys: Events remembered (least recently used are forgotten)
+            per_key: Hashes remembered per event
+        """
+        self.max_distance = max_distance
+        self.max_keys = max_keys
+        self.per_key = per_key
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self.skipped = 0
+
+    def check(self, key, image):
+        """True if `image` adds nothing over what was uploaded for `key`; records it otherwise."""
+        if not self.max_distance:
+            return False
+        h = dhash(image)
+        with self._lock:
+            hashes = self._seen.get(key)
+            if hashes is None:
+                hashes = self._seen[key] = []
+                while len(self._seen) > self.max_keys:
+                    self._seen.popitem(last=False)
+            else:
+                self._seen.move_to_end(key)
+                if any(hamming(h, seen) <= self.max_distance for seen in hashes):
+                    self.skipped += 1
+                    return True
+            hashes.append(h)
+            del hashes[:-self.per_key]
+            return False
+
+    def forget(self, key):
+        with self._lock:
+            self._seen.pop(key, None)
+
+
+class FrameEncoder:
+    """JPEG encoding with optional ROI crop and downscale."""
+
+    def __init__(self, quality=80, max_side=1280, roi=False, roi_margin=0.25):
+        """Create the encoder.
+
+        Args:
+            quality: JPEG quality (1-100)
+            max_side: Longer image side after downscaling (0 keeps the size)
+            roi: Crop to the union of the given boxes when there are any
+            roi_margin: Margin around the ROI as a fraction of its size
+        """
+        self.params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+        self.max_side = int(max_side or 0)
+        self.roi = roi
+        self.roi_margin = roi_margin
+
+    def region(self, frame, boxes=None):
+        """Image to upload and its (x, y, w, h) in frame coordinates."""
+        h, w = frame.shape[:2]
+        if not self.roi or boxes is None or not len(boxes):
+            return frame, (0, 0, w, h)
+        boxes = np.asarray(boxes)
+        x0, y0 = boxes[:, 0].min(), boxes[:, 1].min()
+        x1, y1 = (boxes[:, 0] + boxes[:, 2]).max(), (boxes[:, 1] + boxes[:, 3]).max()
+        mx, my = (x1 - x0) * self.roi_margin, (y1 - y0) * self.roi_margin
+        x0, y0 = int(max(0, x0 - mx)), int(max(0, y0 - my))
+        x1, y1 = int(min(w, x1 + mx)), int(min(h, y1 + my))
+        return frame[y0:y1, x0:x1], (x0, y0, x1 - x0, y1 - y0)
+
+    def encode(self, image):
+        """JPEG bytes of `image`, downscaled to `max_side` (None if encoding fails)."""
+        h, w = image.shape[:2]
+        if self.max_side and max(h, w) > self.max_side:
+            f = self.max_side / max(h, w)
+            image = cv2.resize(image, (max(1, int(w * f)), max(1, int(h * f))), interpolation=cv2.INTER_AREA)
+        ok, buf = cv2.imencode('.jpg', image, self.params)
+        return buf.tobytes() if ok else None
+
+
+def add_upload_args(parser):
+    """Register alert image options on an argparse parser."""
+    parser.add_argument('--alert-quality', type=int, default=80, help='JPEG quality of uploaded detection frames')
+    parser.add_argument('--alert-max-side', type=int, default=1280,
+                        help='Downscale uploaded frames to this longer side in pixels (0 keeps the size)')
+    parser.add_argument('--alert-roi', action='store_true',
+                        help='Upload only the region around the tiles that fired (tiled inference)')
+    parser.add_argument('--alert-dedupe', type=int, default=6,
+                        help='Skip images within this many dHash bits of one already sent for the event (0 disables)')
+
+
+def encoder_from_args(args):
+    return FrameEncoder(quality=args.alert_quality, max_side=args.alert_max_side, roi=args.alert_roi)
+
+
+def deduper_from_args(args):
+    return FrameDeduper(max_distance=args.alert_dedupe)
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Interpreter pool - pre-allocated TFLite interpreters with explicit threading and
+delegate configuration.
+
+Each interpreter in the pool owns its tensors, so concurrent callers (multi-stream
+batching, tiled inference, offline batch jobs) can run in parallel without sharing
+mutable state. `autotune` benchmarks thread counts and delegates on the current CPU,
+picks the fastest configuration and records it next to the model so later starts
+can reuse the choice.
+
+Delegates:
+    xnnpack - TFLite's default CPU delegate (XNNPACK) with `num_threads` threads
+    none    - plain builtin kernels, default delegates disabled
+    <path>  - external delegate shared library loaded with `load_delegate`
+
+Example:
+    pool = InterpreterPool('models/best_shark_mobilenetv2.tflite', size=2, num_threads=2)
+    scores = pool.run(batch)
+"""
+
+import json
+import os
+import platform
+import queue
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+DELEGATES = ('xnnpack', 'none')
+
+_tflite = None
+
+
+def tflite_module():
+    """Return the TFLite interpreter module (tflite-runtime / LiteRT preferred, TF as fallback).
+
+    Importing TensorFlow adds seconds to start-up, so it is only used when neither
+    standalone runtime is installed.
+    """
+    global _tflite
+    if _tflite is None:
+        try:
+            import tflite_runtime.interpreter as module
+        except ImportError:
+            try:
+                import ai_edge_litert.interpreter as module
+            except ImportError:
+                try:
+                    import tensorflow as tf
+                    module = tf.lite
+                except ImportError:
+                    raise ImportError("TFLite runtime not available. Install tflite-runtime.")
+        _tflite = module
+    return _tflite
+
+
+def make_interpreter(model_path, num_threads=None, delegate='xnnpack'):
+    """Create and allocate a single interpreter.
+
+    Args:
+        model_path: Path to the .tflite model
+        num_threads: CPU threads for the interpreter (None: runtime default)
+        delegate: 'xnnpack', 'none' or a path to an external delegate library
+    """
+    tflite = tflite_module()
+    kwargs = {'model_path': str(model_path)}
+    if num_threads:
+        kwargs['num_threads'] = int(num_threads)
+    # tflite-runtime exposes these at module level, full TF under tf.lite.experimental
+    experimental = getattr(tflite, 'experimental', None)
+    if delegate == 'none':
+        resolver = getattr(tflite, 'OpResolverType', None) or getattr(experimental, 'OpResolverType', None)
+        if resolver is not None:
+            kwargs['experimental_op_resolver_type'] = resolver.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+    elif delegate and delegate != 'xnnpack':
+        load_delegate = getattr(tflite, 'load_delegate', None) or experimental.load_delegate
+        kwargs['experimental_delegates'] = [load_delegate(delegate)]
+    interpreter = tflite.Interpreter(**kwargs)
+    interpreter.allocate_tensors()
+    return interpreter
+
+
+class PooledInterpreter:
+    """One interpreter plus its cached tensor details."""
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self._refresh()
+
+    def _refresh(self):
+        self.input_details = self.interpreter.get_input_details()
+        self.output_details = self.interpreter.get_output_details()
+
+    def _ensure_batch(self, shape):
+        index = self.input_details[0]['index']
+        if self.input_details[0]['shape'][0] != shape[0]:
+            self.interpreter.resize_tensor_input(index, list(shape))
+            self.interpreter.allocate_tensors()
+            self._refresh()
+        return index
+
+    def run(self, batch):
+        """Invoke on a (N, H, W, C) batch, resizing the input tensor if N changed.
+
+        Returns:
+            A copy of the first output tensor.
+        """
+        index = self._ensure_batch(batch.shape)
+        dtype = self.input_details[0]['dtype']
+        self.interpreter.set_tensor(index, batch if batch.dtype == dtype else batch.astype(dtype))
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_details[0]['index'])
+
+    def run_into(self, fill, batch_size=1):
+        """Invoke after `fill(view)` wrote the input directly into the input tensor.
+
+        Skips the `set_tensor` copy. The view must not be kept: TFLite refuses
+        to invoke while references to its internal buffers are alive.
+
+        Returns:
+            A copy of the first output tensor.
+        """
+        shape = list(self.input_details[0]['shape'])
+        index = self._ensure_batch([batch_size] + shape[1:])
+        view = self.interpreter.tensor(index)()
+        fill(view)
+        del view
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_details[0]['index'])
+
+    def warmup(self, runs=2):
+        """Invoke on blank input so the first real frame does not pay for delegate / kernel setup.
+
+        Returns:
+            Seconds spent.
+        """
+        t0 = time.perf_counter()
+        for _ in range(runs):
+            self.run_into(lambda view: view.fill(0))
+        return time.perf_counter() - t0
+
+
+class InterpreterPool:
+    """N pre-allocated interpreters handed out to concurrent callers."""
+
+    def __init__(self, model_path, size=1, num_threads=None, delegate='xnnpack'):
+        """Create the pool.
+
+        Args:
+            model_path: Path to the .tflite model
+            size: Number of interpreters
+            num_threads: CPU threads per interpreter
+            delegate: 'xnnpack', 'none' or a path to an external delegate library
+        """
+        self.model_path = str(model_path)
+        self.size = max(1, int(size))
+        self.num_threads = num_threads
+        self.delegate = delegate
+        self.slots = [PooledInterpreter(make_interpreter(model_path, num_threads, delegate))
+                      for _ in range(self.size)]
+        self._free = queue.Queue()
+        for slot in self.slots:
+            self._free.put(slot)
+        self._executor = None
+        self._lock = threading.Lock()
+        # Serializes run_parallel callers taking several interpreters at once
+        self._gather_lock = threading.Lock()
+
+    @property
+    def input_details(self):
+        return self.slots[0].input_details
+
+    @property
+    def output_details(self):
+        return self.slots[0].output_details
+
+    @contextmanager
+    def acquire(self, timeout=None):
+        """Borrow an interpreter for exclusive use."""
+        slot = self._free.get(timeout=timeout)
+        try:
+            yield slot
+        finally:
+            self._free.put(slot)
+
+    def run(self, batch):
+        """Run a batch on a free interpreter; returns a copy of the output."""
+        with self.acquire() as slot:
+            return slot.run(batch)
+
+    def run_into(self, fill, batch_size=1):
+        """`PooledInterpreter.run_into` on a free interpreter."""
+        with self.acquire() as slot:
+            return slot.run_into(fill, batch_size)
+
+    def run_parallel(self, batch):
+        """Split a batch across all interpreters and run the chunks concurrently.
+
+        Chunks all have the same size (the last one is zero-padded) and chunk i goes
+        to the i-th interpreter taken, so for a given batch size every interpreter
+        keeps one input shape instead of being resized whenever it gets the short chunk.
+        """
+        n = len(batch)
+        if self.size == 1 or n < 2:
+            return self.run(batch)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='tflite-pool')
+        chunk = -(-n // self.size)
+        chunks = [batch[i:i + chunk] for i in range(0, n, chunk)]
+        if len(chunks[-1]) < chunk:
+            padded = np.zeros((chunk,) + batch.shape[1:], dtype=batch.dtype)
+            padded[:len(chunks[-1])] = chunks[-1]
+            chunks[-1] = padded
+        with self._gather_lock:
+            slots = sorted((self._free.get() for _ in chunks), key=self.slots.index)
+        try:
+            outputs = list(self._executor.map(lambda job: job[0].run(job[1]), zip(slots, chunks)))
+        finally:
+            for slot in slots:
+                self._free.put(slot)
+        return np.concatenate(outputs)[:n]
+
+    def warmup(self, runs=2):
+        """`PooledInterpreter.warmup` on every interpreter; returns seconds spent."""
+        return sum(slot.warmup(runs) for slot in self.slots)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+def _host_signature():
+    return {'machine': platform.machine(), 'processor': platform.processor(), 'cpus': os.cpu_count()}
+
+
+def tune_path(model_path):
+    return str(model_path) + '.tune.json'
+
+
+def _time_config(model_path, num_threads, delegate, runs):
+    interpreter = PooledInterpreter(make_interpreter(model_path, num_threads, delegate))
+    detail = interpreter.input_details[0]
+    sample = np.zeros(detail['shape'], dtype=detail['dtype'])
+    for _ in range(3):
+        interpreter.run(sample)
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        interpreter.run(sample)
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def autotune(model_path, thread_options=None, delegates=DELEGATES, runs=20, force=False):
+    """Pick the fastest (num_threads, delegate) for this CPU and record it.
+
+    The result is stored in `<model>.tune.json` and reused as long as the model
+    file and the host signature are unchanged (unless `force` is set).
+
+    Returns:
+        dict with 'num_threads', 'delegate' and 'latency_ms'.
+    """
+    model_path = str(model_path)
+    path = tune_path(model_path)
+    host = _host_signature()
+    mtime = os.path.getmtime(model_path)
+    if not force and os.path.exists(path):
+        try:
+            with open(path, 'r') as f:
+                record = json.load(f)
+            if record.get('host') == host and record.get('model_mtime') == mtime:
+                return record['choice']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    cpus = os.cpu_count() or 1
+    if thread_options is None:
+        thread_options = sorted({1, 2, 4, cpus} & set(range(1, cpus + 1)))
+    results = []
+    for delegate in delegates:
+        for threads in thread_options:
+            try:
+                latency = _time_config(model_path, threads, delegate, runs)
+            except Exception as e:
+                print(f"[autotune] threads={threads} delegate={delegate} failed: {e}")
+                continue
+            results.append({'num_threads': threads, 'delegate': delegate, 'latency_ms': round(1000.0 * latency, 3)})
+            print(f"[autotune] threads={threads} delegate={delegate} {1000.0 * latency:.2f} ms")
+    if not results:
+        raise RuntimeError(f"No interpreter configuration could run {model_path}")
+    choice = min(results, key=lambda r: r['latency_ms'])
+    record = {'host': host, 'model': model_path, 'model_mtime': mtime, 'choice': choice, 'results': results}
+    try:
+        with open(path, 'w') as f:
+            json.dump(record, f, indent=2)
+    except OSError as e:
+        print(f"[autotune] could not record choice to {path}: {e}")
+    print(f"[autotune] selected threads={choice['num_threads']} delegate={choice['delegate']}")
+    return choice
+
+
+def add_interpreter_args(parser, pool=True):
+    """Register TFLite interpreter options on an argparse parser."""
+    parser.add_argument('--num-threads', type=int, default=None, help='CPU threads per TFLite interpreter')
+    parser.add_argument('--delegate', default='xnnpack',
+                        help="TFLite delegate: 'xnnpack', 'none' or path to an external delegate library")
+    if pool:
+        parser.add_argument('--pool-size', type=int, default=1, help='Number of pre-allocated TFLite interpreters')
+    parser.add_argument('--autotune', action='store_true',
+                        help='Benchmark thread counts / delegates at startup and use the fastest')
+
+
+def pool_from_args(args, model_path):
+    """Build an InterpreterPool from `add_interpreter_args` options."""
+    num_threads, delegate = args.num_threads, args.delegate
+    if args.autotune:
+        choice = autotune(model_path)
+        num_threads, delegate = choice['num_threads'], choice['delegate']
+    return InterpreterPool(model_path, size=getattr(args, 'pool_size', 1), num_threads=num_threads, delegate=delegate)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Keras engine - compiled inference for Keras models without `Model.predict`.
+
+`Model.predict` builds a data adapter and a step loop on every call; for one
+frame that costs more than the MobileNetV2 forward pass itself. `KerasEngine`
+traces the model once into a `tf.function` with a fixed `(None, H, W, 3)` float32
+input signature, so single frames and micro-batches of any size reuse the same
+graph, and warms it up at load time.
+
+Options:
+    jit_compile   XLA-compile the graph. 'auto' enables it only when a GPU is
+                  visible: on CPU, TensorFlow's oneDNN kernels are usually faster
+                  than XLA's. XLA compiles per input shape, so batches are padded
+                  to power-of-two sizes up to `max_batch`, all compiled at warm-up.
+    precision     'float32' (default), 'mixed_float16' (GPUs with tensor cores) or
+                  'mixed_bfloat16' (CPUs with AMX / AVX512-BF16). The model is
+                  cloned with that compute dtype; variables and the output layer
+                  stay float32.
+
+TensorFlow is imported when an engine is created, not when this module is.
+
+Example:
+    engine = load_engine('models/best_shark_model.h5', precision='mixed_float16')
+    scores = engine.predict(batch)   # (N, H, W, 3) float32 -> (N, 1) float32
+"""
+
+import time
+
+import numpy as np
+
+from preprocessing import load_manifest
+
+PRECISIONS = ('float32', 'mixed_float16', 'mixed_bfloat16')
+XLA_MODES = ('auto', 'on', 'off')
+
+
+def _tf():
+    try:
+        import tensorflow as tf
+    except ImportError:
+        raise ImportError("TensorFlow not available. Install tensorflow.")
+    return tf
+
+
+def with_precision(model, precision):
+    """Clone a model with a mixed-precision compute dtype (the output layer stays float32)."""
+    if precision == 'float32':
+        return model
+    keras = _tf().keras
+    output = model.layers[-1]
+
+    def clone_layer(layer):
+        config = layer.get_config()
+        if layer is not output and not isinstance(layer, keras.layers.InputLayer):
+            config['dtype'] = precision
+        return layer.__class__.from_config(config)
+
+    clone = keras.models.clone_model(model, clone_function=clone_layer)
+    clone.set_weights(model.get_weights())
+    return clone
+
+
+class KerasEngine:
+    """Traced (optionally XLA-compiled, mixed-precision) forward pass of a Keras model."""
+
+    def __init__(self, model, max_batch=8, jit_compile='auto', precision='float32', warmup=True, input_size=None):
+        """Trace the model.
+
+        Args:
+            model: Loaded Keras model with a (None, H, W, 3) input
+            max_batch: Largest batch compiled ahead of time; larger batches run in chunks
+            jit_compile: 'auto', 'on' / True or 'off' / False (see module docstring)
+            precision: One of PRECISIONS
+            warmup: Run the compiled function once per batch size before returning
+            input_size: (H, W, C) for models whose input shape leaves them open
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision {precision!r}, expected one of {PRECISIONS}")
+        tf = _tf()
+        self.source_model = model
+        self.precision = precision
+        self.model = with_precision(model, precision)
+        shape = tuple(model.input_shape[1:])
+        if None in shape:
+            if input_size is None:
+                raise ValueError(f"Model input {model.input_shape} has open dimensions; pass input_size")
+            shape = input_size
+        self.input_size = tuple(int(d) for d in shape)
+        if jit_compile in ('auto', None):
+            jit_compile = bool(tf.config.list_physical_devices('GPU'))
+        self.jit_compile = jit_compile in (True, 'on')
+        self.max_batch = max(1, int(max_batch))
+        # Without XLA the traced graph takes any batch size; XLA recompiles per shape,
+        # so batches are padded to one of a few fixed sizes
+        self.batch_sizes = [1]
+        if self.jit_compile:
+            while self.batch_sizes[-1] < self.max_batch:
+                self.batch_sizes.append(min(2 * self.batch_sizes[-1], self.max_batch))
+        self._padded = {}
+
+        forward = tf.autograph.experimental.do_not_convert(
+            lambda x: tf.cast(self.model(x, training=False), tf.float32))
+        self._fn = tf.function(forward, input_signature=[tf.TensorSpec((None,) + self.input_size, tf.float32)],
+                               jit_compile=self.jit_compile)
+        self.warmup_seconds = self.warmup() if warmup else 0.0
+
+    @property
+    def input_shape(self):
+        return (None,) + self.input_size
+
+    def warmup(self):
+        """Run every compiled batch size once on blank input; returns seconds spent."""
+        t0 = time.perf_counter()
+        for n in self.batch_sizes:
+            self._fn(np.zeros((n,) + self.input_size, dtype=np.float32))
+        return time.perf_counter() - t0
+
+    def _bucket(self, n):
+        for size in self.batch_sizes:
+            if size >= n:
+                return size
+        return self.batch_sizes[-1]
+
+    def _run(self, batch):
+        n = len(batch)
+        if not self.jit_compile or n in self.batch_sizes:
+            return self._fn(batch).numpy()
+        size = self._bucket(n)
+        padded = self._padded.get(size)
+        if padded is None:
+            padded = self._padded[size] = np.zeros((size,) + self.input_size, dtype=np.float32)
+        padded[:n] = batch
+        return self._fn(padded).numpy()[:n]
+
+    def predict(self, batch):
+        """Model output for a preprocessed (N, H, W, 3) batch, as a float32 (N, ...) array."""
+        batch = np.asarray(batch, dtype=np.float32)
+        if len(batch) <= self.max_batch or not self.jit_compile:
+            return self._run(batch)
+        return np.concatenate([self._run(batch[i:i + self.max_batch])
+                               for i in range(0, len(batch), self.max_batch)])
+
+    def describe(self):
+        return (f"Keras engine: {'XLA' if self.jit_compile else 'graph'}, {self.precision}, "
+                f"warm-up {1000 * self.warmup_seconds:.0f} ms")
+
+
+def load_engine(model_path, **kwargs):
+    """Load a Keras model file and wrap it in a KerasEngine.
+
+    Models with open spatial dimensions are traced at the manifest's input size.
+    """
+    model = _tf().keras.models.load_model(str(model_path), compile=False)
+    if 'input_size' not in kwargs:
+        size = load_manifest(model_path)['input_size'] or [224, 224]
+        kwargs['input_size'] = (size[0], size[1], 3)
+    return KerasEngine(model, **kwargs)
+
+
+def add_keras_args(parser, batch=True):
+    """Add Keras engine options to an argparse parser (`batch=False` for callers with their own batch size)."""
+    parser.add_argument('--xla', choices=XLA_MODES, default='auto',
+                        help="XLA-compile Keras models ('auto': only when a GPU is visible)")
+    parser.add_argument('--precision', choices=PRECISIONS, default='float32',
+                        help='Compute dtype for Keras models (mixed_float16 for GPUs, mixed_bfloat16 for AMX CPUs)')
+    if batch:
+        parser.add_argument('--keras-batch', type=int, default=8,
+                            help='Largest Keras batch compiled ahead of time (XLA only)')
+
+
+def keras_engine_from_args(args, model_path, max_batch=None):
+    """KerasEngine for the parsed options."""
+    return load_engine(model_path, max_batch=max_batch or args.keras_batch, jit_compile=args.xla,
+                       precision=args.precision)
@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+"""
+Metrics - low-overhead counters, gauges and histograms for the detection loops.
+
+The hot path only increments counters and drops durations / scores into fixed
+histogram buckets (a bisect and an add under a lock). Everything else happens
+off the loop:
+
+    /metrics       - Prometheus text format on a local HTTP port (`--metrics-port`)
+    log line       - compact window summary every `--metrics-interval` seconds
+    /profile       - with `--profile`: sample all thread stacks for `?seconds=N` and
+                     return them as collapsed stacks (flamegraph.pl / speedscope);
+                     SIGUSR1 writes the same trace to `--profile-dir`
+
+Example:
+    metrics = LoopMetrics()
+    t0 = time.perf_counter()
+    ...
+    metrics.observe('invoke', time.perf_counter() - t0)
+    metrics.frames_inferred.inc()
+"""
+
+import bisect
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Seconds; per-stage latency buckets from sub-millisecond preprocessing to slow Keras calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SCORE_BUCKETS = tuple(round(0.1 * i, 1) for i in range(1, 11))
+STAGES = ('decode', 'preprocess', 'invoke', 'postprocess', 'buffer', 'encode', 'output')
+
+_IMPORTED = time.time()
+
+
+def process_age():
+    """Seconds since this process started (/proc on Linux, else since this module was imported).
+
+    Counts interpreter start-up and imports too, so time-to-first-inference covers
+    the whole cold boot and not just model loading.
+    """
+    try:
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        with open('/proc/self/stat') as f:
+            # Field 22 (starttime, clock ticks after boot); the command name before ')' may contain spaces
+            ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        return uptime - ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.time() - _IMPORTED
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+class Counter:
+    """Monotonic count; `fn` makes it read an existing counter instead."""
+
+    kind = 'counter'
+
+    def __init__(self, fn=None):
+        self.fn = fn
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self._lock:
+            self._value += n
+
+    @property
+    def value(self):
+        return self.fn() if self.fn is not None else self._value
+
+
+class Gauge(Counter):
+    """Current value (queue depth, ...); set explicitly or read from `fn`."""
+
+    kind = 'gauge'
+
+    def set(self, value):
+        self._value = value
+
+
+class Histogram:
+    """Cumulative-bucket histogram with an approximate quantile over any window."""
+
+    kind = 'histogram'
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum
+
+    def quantile(self, q, counts=None):
+        """Approximate q-quantile, interpolated within its bucket (None when empty).
+
+        Args:
+            q: Quantile in [0, 1]
+            counts: Per-bucket counts to use instead of the totals (e.g. a window delta)
+        """
+        counts = self.counts if counts is None else counts
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for i, n in enumerate(counts):
+            if n and seen + n >= rank:
+                lo = self.buckets[i - 1] if i > 0 else 0.0
+                hi = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lo + (hi - lo) * max(0.0, rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+
+class Registry:
+    """Named metric families with optional labels, rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._families = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, labels, **kwargs):
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            family = self._families.setdefault(name, {'help': help_text, 'type': cls.kind, 'children': {}})
+            metric = family['children'].get(key)
+            if metric is None:
+                metric = family['children'][key] = cls(**kwargs)
+            return metric
+
+    def counter(self, name, help_text='', labels=None, fn=None):
+        return self._get(Counter, name, help_text, labels, fn=fn)
+
+    def gauge(self, name, help_text='', labels=None, fn=None):
+        return self._get(Gauge, name, help_text, labels, fn=fn)
+
+    def histogram(self, name, help_text='', labels=None, buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            families = {name: dict(f, children=dict(f['children'])) for name, f in self._families.items()}
+        for name, family in sorted(families.items()):
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['type']}")
+            for key, metric in family['children'].items():
+                if family['type'] != 'histogram':
+                    try:
+                        value = metric.value
+                    except Exception:
+                        continue
+                    lines.append(f"{name}{_label_text(key)} {value}")
+                    continue
+                counts, total = metric.snapshot()
+                cumulative = 0
+                for bound, n in zip(metric.buckets + (float('inf'),), counts):
+                    cumulative += n
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{name}_bucket{_label_text(key + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_label_text(key)} {total}")
+                lines.append(f"{name}_count{_label_text(key)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+
+class LoopMetrics:
+    """The instruments shared by the detection loops."""
+
+    def __init__(self, registry=None):
+        self.registry = registry or Registry()
+        r = self.registry
+        self.frames_read = r.counter('shark_frames_read_total', 'Frames read from the source')
+        self.frames_inferred = r.counter('shark_frames_inferred_total', 'Frames the model was run on')
+        self.scores = r.histogram('shark_score', 'Shark score of inferred frames', buckets=SCORE_BUCKETS)
+        self.events = {}
+        self._stages = {}
+        self._queues = {}
+        self._alerts = None
+        self._dropped = []
+        self._skipped = []
+        self.started = time.time()
+        r.gauge('shark_uptime_seconds', 'Seconds since the loop started', fn=lambda: round(time.time() - self.started, 1))
+        self.first_inference = None
+        r.gauge('shark_time_to_first_inference_seconds', 'Seconds from process start to the first inferred frame',
+                fn=lambda: self.first_inference or 0.0)
+
+    def mark_first_inference(self):
+        """Record (and print) time-to-first-inference; later calls do nothing."""
+        if self.first_inference is None:
+            self.first_inference = round(process_age(), 3)
+            print(f"[startup] first inference {self.first_inference:.2f} s after process start")
+
+    def stage(self, name):
+        hist = self._stages.get(name)
+        if hist is None:
+            hist = self._stages[name] = self.registry.histogram(
+                'shark_stage_seconds', 'Per-frame time spent in each loop stage', labels={'stage': name})
+        return hist
+
+    def observe(self, stage, seconds):
+        self.stage(stage).observe(seconds)
+
+    def event(self, kind):
+        counter = self.events.get(kind)
+        if counter is None:
+            counter = self.events[kind] = self.registry.counter(
+                'shark_detection_events_total', 'Detection events by kind', labels={'kind': kind})
+        counter.inc()
+
+    def track_queue(self, name, fn):
+        """Report a queue depth read from `fn` (e.g. `queue.qsize`)."""
+        self._queues[name] = self.registry.gauge('shark_queue_depth', 'Items waiting in each queue',
+                                                 labels={'queue': name}, fn=fn)
+
+    def track_dropped(self, name, fn):
+        """Report frames dropped by a component (read from `fn`)."""
+        self._dropped.append(self.registry.counter('shark_frames_dropped_total', 'Frames dropped before inference',
+                                                   labels={'by': name}, fn=fn))
+
+    def track_stream(self, source):
+        """Report a StreamSource's stale frames (dropped by its drain thread) and reconnects."""
+        self.track_dropped('stream', lambda: source.stats['dropped'])
+        self.registry.counter('shark_stream_reconnects_total', 'Live stream reconnects',
+                              fn=lambda: source.stats['reconnects'])
+
+    def track_skipped(self, gate):
+        """Report frames an InferenceGate skipped instead of inferring."""
+        for reason in ('stride', 'motion'):
+            self._skipped.append(self.registry.counter(
+                'shark_frames_skipped_total', 'Frames the inference gate skipped', labels={'reason': reason},
+                fn=lambda reason=reason: gate.counters[f'skipped_{reason}']))
+
+    def track_alerts(self, dispatcher):
+        """Report an AlertDispatcher's delivery counters and queue depth."""
+        self._alerts = {}
+        for state in ('queued', 'sent', 'failed', 'spooled', 'dropped', 'coalesced'):
+            self._alerts[state] = self.registry.counter('shark_alerts_total', 'Alert payloads by delivery outcome',
+                                                        labels={'state': state},
+                                                        fn=lambda state=state: dispatcher.stats[state])
+        self.track_queue('alerts', dispatcher._queue.qsize)
+
+    def snapshot(self):
+        """Values the log line is computed from (counters and histogram buckets)."""
+        return {
+            'time': time.perf_counter(),
+            'read': self.frames_read.value,
+            'inferred': self.frames_inferred.value,
+            'dropped': sum(c.value for c in self._dropped),
+            'skipped': sum(c.value for c in self._skipped),
+            'alerts': {k: c.value for k, c in (self._alerts or {}).items()},
+            'stages': {name: h.snapshot()[0] for name, h in self._stages.items()},
+            'scores': self.scores.snapshot()[0],
+        }
+
+    def format_line(self, prev, cur):
+        """Compact summary of the window between two snapshots."""
+        span = max(1e-9, cur['time'] - prev['time'])
+        parts = [f"read {(cur['read'] - prev['read']) / span:.1f}/s",
+                 f"inferred {(cur['inferred'] - prev['inferred']) / span:.1f}/s",
+                 f"dropped {cur['dropped'] - prev['dropped']}", f"skipped {cur['skipped'] - prev['skipped']}"]
+        stages = []
+        for name in STAGES:
+            if name not in cur['stages']:
+                continue
+            old = prev['stages'].get(name, [0] * len(cur['stages'][name]))
+            window = [a - b for a, b in zip(cur['stages'][name], old)]
+            p50, p95 = self._stages[name].quantile(0.5, window), self._stages[name].quantile(0.95, window)
+            if p50 is not None:
+                stages.append(f"{name} {1000 * p50:.1f}/{1000 * p95:.1f}")
+        if stages:
+            parts.append("p50/p95 ms " + ' '.join(stages))
+        window = [a - b for a, b in zip(cur['scores'], prev['scores'])]
+        p95 = self.scores.quantile(0.95, window)
+        if p95 is not None:
+            parts.append(f"score p95 {p95:.2f}")
+        if cur['alerts']:
+            a, b = cur['alerts'], prev['alerts']
+            parts.append("alerts q/s/f {}/{}/{}".format(*(a[k] - b.get(k, 0) for k in ('queued', 'sent', 'failed'))))
+        if self._queues:
+            parts.append("queues " + ' '.join(f"{name}={g.value}" for name, g in self._queues.items()))
+        return "[metrics] " + ' | '.join(parts)
+
+
+class MetricsReporter:
+    """Background thread printing `LoopMetrics.format_line` every `interval` seconds."""
+
+    def __init__(self, metrics, interval=30.0):
+        self.metrics = metrics
+        self.interval = interval
+        self._stop = threading.Event()
+        self._prev = metrics.snapshot()
+        self._thread = threading.Thread(target=self._run, name='metrics-log', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._report()
+
+    def _report(self):
+        cur = self.metrics.snapshot()
+        print(self.metrics.format_line(self._prev, cur), flush=True)
+        self._prev = cur
+
+    def close(self):
+        """Stop the thread and report the last (partial) window."""
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+        if self.metrics.frames_read.value != self._prev['read']:
+            self._report()
+
+
+class SamplingProfiler:
+    """Samples the stacks of all other threads and folds them into collapsed-stack counts."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    def collect(self, seconds):
+        """Sample for `seconds`; returns {'thread;outer;...;inner': samples}."""
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        stacks = _Tally()
+        deadline = time.perf_counter() + seconds
+        with self._lock:
+            while time.perf_counter() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    calls = []
+                    while frame is not None:
+                        code = frame.f_code
+                        calls.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                        frame = frame.f_back
+                    calls.append(names.get(ident, f"thread-{ident}"))
+                    stacks[';'.join(reversed(calls))] += 1
+                time.sleep(self.interval)
+        return stacks
+
+    def collapsed(self, seconds):
+        """Collapsed-stack text (one `stack count` line per stack), as flamegraph.pl expects."""
+        return ''.join(f"{stack} {n}\n" for stack, n in self.collect(seconds).most_common())
+
+    def dump(self, directory, seconds):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"profile-{time.strftime('%Y%m%dT%H%M%S')}.folded")
+        with open(path, 'w') as f:
+            f.write(self.collapsed(seconds))
+        print(f"[profile] wrote {seconds:g}s of samples to {path}")
+        return path
+
+    def install_signal(self, directory, seconds, signum=getattr(signal, 'SIGUSR1', None)):
+        """Dump a trace to `directory` on `signum` (SIGUSR1), sampling on a background thread."""
+        if signum is None or threading.current_thread() is not threading.main_thread():
+            return False
+
+        def handler(_signum, _frame):
+            threading.Thread(target=self.dump, args=(directory, seconds), name='profiler', daemon=True).start()
+        signal.signal(signum, handler)
+        return True
+
+
+class MetricsServer:
+    """Local HTTP endpoint serving /metrics (and /profile when a profiler is attached)."""
+
+    def __init__(self, registry, port, host='127.0.0.1', profiler=None, max_profile_seconds=60.0):
+        self.registry = registry
+        self.profiler = profiler
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == '/metrics':
+                    self._reply(200, server.registry.render(), 'text/plain; version=0.0.4')
+                elif url.path == '/profile' and server.profiler is not None:
+                    try:
+                        seconds = float(parse_qs(url.query).get('seconds', ['10'])[0])
+                    except ValueError:
+                        self._reply(400, 'seconds must be a number\n')
+                        return
+                    seconds = min(max(seconds, 0.1), max_profile_seconds)
+                    self._reply(200, server.profiler.collapsed(seconds))
+                else:
+                    self._reply(404, 'not found\n')
+
+            def _reply(self, status, text, content_type='text/plain'):
+                body = text.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.address = self.httpd.server_address
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='metrics-http', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class MetricsRuntime:
+    """LoopMetrics plus the optional endpoint, log reporter and profiler configured from arguments."""
+
+    def __init__(self, metrics, server=None, reporter=None, profiler=None):
+        self.metrics = metrics
+        self.server = server
+        self.reporter = reporter
+        self.profiler = profiler
+
+    def close(self):
+        if self.reporter is not None:
+            self.reporter.close()
+            self.reporter = None
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+
+def add_metrics_args(parser):
+    """Register metrics / profiling options on an argparse parser."""
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='Serve Prometheus metrics on this local port at /metrics (0 disables)')
+    parser.add_argument('--metrics-host', default='127.0.0.1', help='Address the metrics endpoint binds to')
+    parser.add_argument('--metrics-interval', type=float, default=30.0,
+                        help='Seconds between compact metrics log lines (0 disables)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Enable the sampling profiler: GET /profile?seconds=N and SIGUSR1 dump collapsed stacks')
+    parser.add_argument('--profile-seconds', type=float, default=10.0, help='Sampling duration of a SIGUSR1 dump')
+    parser.add_argument('--profile-dir', default='profiles', help='Directory for SIGUSR1 profile dumps')
+
+
+def metrics_from_args(args, metrics=None):
+    """Start the endpoint / reporter / profiler requested by `add_metrics_args` options."""
+    metrics = metrics or LoopMetrics()
+    profiler = SamplingProfiler() if args.profile else None
+    if profiler is not None and profiler.install_signal(args.profile_dir, args.profile_seconds):
+        print(f"[profile] kill -USR1 {os.getpid()} writes {args.profile_seconds:g}s of stacks to {args.profile_dir}/")
+    server = None
+    if args.metrics_port:
+        server = MetricsServer(metrics.registry, args.metrics_port, args.metrics_host, profiler)
+        host, port = server.address[:2]
+        print(f"[metrics] serving http://{host}:{port}/metrics" + (" and /profile" if profiler else ""))
+    reporter = MetricsReporter(metrics, args.metrics_interval) if args.metrics_interval else None
+    return MetricsRuntime(metrics, server, reporter, profiler)
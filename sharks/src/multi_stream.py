@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+Multi-stream detector - serve several drone feeds from one model.
+
+Every source (camera index, RTSP/HTTP URL or video file) gets a reader thread.
+The inference loop gathers the newest frame of each stream into a dynamic
+micro-batch, closing the batch when it is full or when the oldest frame has
+waited `max_latency` seconds, and runs it through the single model of a
+`SharkDetector` (Keras, or a TFLite interpreter resized to the batch dimension).
+Scores are handed back to per-stream sink threads, which keep their own event
+engine, overlay, video writer and alert path.
+
+Example usage:
+    python multi_stream.py --model models/best_shark_mobilenetv2.tflite --tflite \\
+        --sources rtsp://10.0.0.11/live rtsp://10.0.0.12/live videos/beach.mp4 --output-dir detections/streams
+"""
+
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from detection_events import DetectionEventEngine, add_event_args, engine_from_args
+from frame_pipeline import DROP_POLICIES, resolve_drop_policy
+from frame_upload import add_upload_args, deduper_from_args, encoder_from_args
+from keras_engine import add_keras_args, keras_engine_from_args
+from preprocessing import load_manifest, resolve_threshold
+from shark_detector import SharkDetector
+from stream_source import add_stream_args, open_source, stream_from_args
+
+# Marks the end of a stream
+_EOS = object()
+
+
+def _bucket(n, max_batch):
+    """Round a batch size up to a power of two so TFLite only sees a few tensor shapes."""
+    size = 1
+    while size < n:
+        size *= 2
+    return max(n, min(size, max_batch))
+
+
+class StreamContext:
+    """Per-stream state: capture, queues, event engine, writer and counters."""
+
+    def __init__(self, index, source, name, policy, queue_size, events):
+        self.index = index
+        self.source = source
+        self.name = name
+        self.policy = policy
+        self.events = events
+        self.cap = None
+        self.writer = None
+        self.fps = 0.0
+        self.frames = queue.Queue(maxsize=1 if policy == 'latest' else queue_size)
+        self.results = queue.Queue(maxsize=queue_size)
+        self.done = False
+        # End-of-stream marker handed to the sink
+        self.closed = False
+        self.display_frame = None
+        self.stats = {'read': 0, 'dropped': 0, 'scored': 0, 'latency': 0.0}
+
+
+class MultiStreamDetector:
+    """Dynamic micro-batching across several video sources sharing one SharkDetector."""
+
+    def __init__(self, detector, sources, names=None, max_batch=8, max_latency=0.05, drop_policy=None,
+                 queue_size=4, output_dir=None, display=False, events_factory=None, stats_interval=5.0,
+                 open_stream=None):
+        """Create the server.
+
+        Args:
+            detector: SharkDetector providing the model, overlay and alert path
+            sources: List of camera indices, stream URLs or video files
+            names: Optional per-stream drone names (default: `<DRONE_NAME>-<n>`)
+            max_batch: Maximum frames per micro-batch
+            max_latency: Seconds the first frame of a batch may wait for more frames
+            drop_policy: 'latest', 'all' or None to infer per source
+            queue_size: Frame queue capacity for 'all' streams and per-stream result queues
+            output_dir: Directory for per-stream annotated videos (None disables recording)
+            display: Show each stream in its own window
+            events_factory: Callable returning a fresh DetectionEventEngine per stream
+            stats_interval: Seconds between throughput lines (0 disables them)
+            open_stream: Callable(source) returning a capture (default: `stream_source.open_source`)
+        """
+        if detector.tile_grid is not None:
+            raise ValueError("Tiled inference is not supported in multi-stream mode")
+        if not sources:
+            raise ValueError("At least one source is required")
+        self.detector = detector
+        self.max_batch = max(1, int(max_batch))
+        self.max_latency = max_latency
+        self.output_dir = output_dir
+        self.display = display
+        self.stats_interval = stats_interval
+        self.open_stream = open_stream or open_source
+        events_factory = events_factory or (lambda: DetectionEventEngine(enter_threshold=detector.threshold))
+        base_name = os.getenv("DRONE_NAME", "drone")
+        names = list(names or [])
+
+        self.streams = []
+        for i, source in enumerate(sources):
+            name = names[i] if i < len(names) else f"{base_name}-{i + 1}"
+            policy = resolve_drop_policy(source, drop_policy)
+            self.streams.append(StreamContext(i, source, name, policy, queue_size, events_factory()))
+
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self.batches = 0
+        self.batched_frames = 0
+        self._buffers = {}
+
+    def _open(self, ctx):
+        ctx.cap = self.open_stream(ctx.source)
+        if not ctx.cap.isOpened():
+            raise ValueError(f"Could not open video source: {ctx.source}")
+        ctx.fps = ctx.cap.get(cv2.CAP_PROP_FPS) or 25.0
+        if self.output_dir:
+            os.makedirs(self.output_dir, exist_ok=True)
+            width = int(ctx.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(ctx.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            path = os.path.join(self.output_dir, f"{ctx.name}.mp4")
+            ctx.writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), ctx.fps, (width, height))
+
+    def _read_loop(self, ctx):
+        """Reader thread: decode frames into the stream's queue."""
+        while not self._stop.is_set():
+            ret, frame = ctx.cap.read()
+            if not ret:
+                break
+            ctx.stats['read'] += 1
+            item = (frame, time.perf_counter())
+            if ctx.policy == 'latest':
+                # Replace a stale frame rather than waiting for the batcher
+                try:
+                    ctx.frames.get_nowait()
+                    ctx.stats['dropped'] += 1
+                except queue.Empty:
+                    pass
+                ctx.frames.put_nowait(item)
+            else:
+                while not self._stop.is_set():
+                    try:
+                        ctx.frames.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+            self._ready.set()
+        while not self._stop.is_set():
+            try:
+                ctx.frames.put(_EOS, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self._ready.set()
+
+    def _sink_loop(self, ctx):
+        """Sink thread: events, overlay, alerts and recording for one stream."""
+        while True:
+            item = ctx.results.get()
+            if item is _EOS:
+                break
+            frame, score, t_read = item
+            try:
+                events = ctx.events.update(score)
+                self.detector.annotate_frame(frame, score, detected=ctx.events.active)
+                for event in events:
+                    self.detector.handle_event(frame, event, drone_name=ctx.name)
+                if ctx.writer:
+                    ctx.writer.write(frame)
+            except Exception as e:
+                # A failing alert or writer must not stop the sink: its queue would fill and stall the batcher
+                print(f"[multi-stream] {ctx.name}: sink error: {type(e).__name__}: {e}")
+            if self.display:
+                ctx.display_frame = frame
+            ctx.stats['scored'] += 1
+            ctx.stats['latency'] += time.perf_counter() - t_read
+        try:
+            for event in ctx.events.end():
+                self.detector.handle_event(None, event, drone_name=ctx.name)
+        except Exception as e:
+            print(f"[multi-stream] {ctx.name}: sink error: {type(e).__name__}: {e}")
+
+    def _put_result(self, ctx, item, drop_oldest):
+        """Hand an item to a stream's sink without letting a stalled sink block the batcher for good.
+
+        With `drop_oldest` a full queue loses its oldest result instead of waiting;
+        otherwise the put waits until the sink catches up or the server stops.
+
+        Returns:
+            True if the item was queued.
+        """
+        if not drop_oldest:
+            while not self._stop.is_set():
+                try:
+                    ctx.results.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        while True:
+            try:
+                ctx.results.put_nowait(item)
+                return True
+            except queue.Full:
+                pass
+            try:
+                ctx.results.get_nowait()
+                ctx.stats['dropped'] += 1
+            except queue.Empty:
+                pass
+
+    def _collect(self):
+        """Gather at most one frame per stream until the batch is full or the deadline passes."""
+        batch = []
+        deadline = None
+        pending = [ctx for ctx in self.streams if not ctx.done]
+        while pending and len(batch) < self.max_batch and not self._stop.is_set():
+            self._ready.clear()
+            for ctx in list(pending):
+                try:
+                    item = ctx.frames.get_nowait()
+                except queue.Empty:
+                    continue
+                pending.remove(ctx)
+                if item is _EOS:
+                    ctx.done = True
+                    ctx.closed = self._put_result(ctx, _EOS, drop_oldest=ctx.policy == 'latest')
+                    continue
+                batch.append((ctx, item))
+                if deadline is None:
+                    deadline = item[1] + self.max_latency
+                if len(batch) >= self.max_batch:
+                    break
+            if not pending or len(batch) >= self.max_batch:
+                break
+            timeout = 0.1 if deadline is None else deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            self._ready.wait(timeout)
+        return batch
+
+    def _infer(self, batch):
+        """Run one micro-batch through the shared model."""
+        n = len(batch)
+        size = _bucket(n, self.max_batch) if self.detector.use_tflite else n
+        processed = self._batch_buffer(size)
+        for i, (_, (frame, _)) in enumerate(batch):
+            self.detector.preprocess_frame(frame, out=processed[i])
+        if size > n:
+            processed[n:] = 0
+        return self.detector.predict_batch(processed)[:n]
+
+    def _batch_buffer(self, size):
+        """Preallocated (size, H, W, 3) input batch, one per batch size."""
+        buffer = self._buffers.get(size)
+        if buffer is None:
+            pre = self.detector.preprocessor
+            buffer = np.empty((size, pre.height, pre.width, 3), dtype=pre.dtype)
+            self._buffers[size] = buffer
+        return buffer
+
+    def format_stats(self, elapsed):
+        avg = self.batched_frames / self.batches if self.batches else 0.0
+        parts = []
+        for ctx in self.streams:
+            s = ctx.stats
+            latency = 1000.0 * s['latency'] / s['scored'] if s['scored'] else 0.0
+            parts.append(f"{ctx.name} {s['scored'] / elapsed:.1f} fps {latency:.0f} ms drop {s['dropped']}")
+        return f"[multi-stream] batches {self.batches} avg {avg:.2f} | " + ' | '.join(parts)
+
+    def run(self):
+        """Process all streams until they end or 'q' is pressed in a display window."""
+        threads = []
+        start = time.perf_counter()
+        try:
+            for ctx in self.streams:
+                self._open(ctx)
+            for ctx in self.streams:
+                threads.append(threading.Thread(target=self._read_loop, args=(ctx,),
+                                                name=f"read-{ctx.name}", daemon=True))
+                threads.append(threading.Thread(target=self._sink_loop, args=(ctx,),
+                                                name=f"sink-{ctx.name}", daemon=True))
+            for t in threads:
+                t.start()
+
+            start = last_report = time.perf_counter()
+            while not all(ctx.done for ctx in self.streams):
+                batch = self._collect()
+                if batch:
+                    scores = self._infer(batch)
+                    self.batches += 1
+                    self.batched_frames += len(batch)
+                    for (ctx, (frame, t_read)), score in zip(batch, scores):
+                        self._put_result(ctx, (frame, float(score), t_read), drop_oldest=ctx.policy == 'latest')
+                if self.display:
+                    for ctx in self.streams:
+                        if ctx.display_frame is not None:
+                            cv2.imshow(f"The Surfer : {ctx.name}", ctx.display_frame)
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        break
+                now = time.perf_counter()
+                if self.stats_interval and now - last_report >= self.stats_interval:
+                    print(self.format_stats(now - start))
+                    last_report = now
+        finally:
+            self._stop.set()
+            for ctx in self.streams:
+                if not ctx.closed:
+                    ctx.done = True
+                    # Shutting down: never wait on a sink that may be stuck
+                    ctx.closed = self._put_result(ctx, _EOS, drop_oldest=True)
+            for t in threads:
+                t.join(timeout=5.0)
+            for ctx in self.streams:
+                if ctx.cap is not None:
+                    ctx.cap.release()
+                if ctx.writer:
+                    ctx.writer.release()
+            if self.display:
+                cv2.destroyAllWindows()
+            if self.stats_interval:
+                print(self.format_stats(max(time.perf_counter() - start, 1e-9)))
+            self.detector.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shark detection on several video streams with one model.")
+    parser.add_argument('--model', required=True, help='Path to model file (.h5 or .tflite)')
+    parser.add_argument('--sources', nargs='+', required=True, help='Camera indices, stream URLs or video files')
+    parser.add_argument('--names', nargs='*', help='Drone name per source (default: <DRONE_NAME>-<n>)')
+    parser.add_argument('--tflite', action='store_true', help='Use TFLite model')
+    parser.add_argument('--threshold', type=float, default=None,
+                        help="Detection threshold (default: the model's calibrated threshold, else 0.5)")
+    add_event_args(parser)
+    parser.add_argument('--max-batch', type=int, default=8, help='Maximum frames per micro-batch')
+    parser.add_argument('--max-latency', type=float, default=0.05,
+                        help='Seconds a frame may wait for a micro-batch to fill')
+    parser.add_argument('--drop-policy', choices=('auto',) + DROP_POLICIES, default='auto',
+                        help="'latest' keeps only the newest frame per stream, 'all' keeps every frame")
+    parser.add_argument('--output-dir', help='Directory for per-stream annotated videos')
+    parser.add_argument('--display', action='store_true', help='Show each stream in a window')
+    parser.add_argument('--alert-spool', default='detections/alert_spool.jsonl',
+                        help='Spool file for alerts while the API is unreachable')
+    add_upload_args(parser)
+    add_keras_args(parser, batch=False)
+    add_stream_args(parser)
+    parser.add_argument('--stats-interval', type=float, default=5.0,
+                        help='Seconds between throughput reports (0 to disable)')
+    args = parser.parse_args()
+
+    try:
+        threshold = resolve_threshold(args.threshold, load_manifest(args.model))
+        detector = SharkDetector(args.model, use_tflite=args.tflite, threshold=threshold,
+                                 alert_spool=args.alert_spool, encoder=encoder_from_args(args),
+                                 deduper=deduper_from_args(args),
+                                 keras_engine=None if args.tflite else keras_engine_from_args(args, args.model,
+                                                                                              args.max_batch))
+        sources = [int(s) if s.isdigit() else s for s in args.sources]
+        server = MultiStreamDetector(
+            detector, sources, names=args.names, max_batch=args.max_batch, max_latency=args.max_latency,
+            drop_policy=args.drop_policy, output_dir=args.output_dir, display=args.display,
+            events_factory=lambda: engine_from_args(args, threshold), stats_interval=args.stats_interval,
+            open_stream=lambda source: stream_from_args(args, source, min_side=detector.img_size))
+        server.run()
+    except KeyboardInterrupt:
+        print("\nStopped by user")
+        sys.exit(0)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
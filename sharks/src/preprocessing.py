@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Preprocessing helpers shared by the detectors and the trainer's export stage.
+
+Normalizations map uint8 pixels to model input as `pixel * scale + offset`:
+    unit         - [0, 1]   (pixel / 255)
+    mobilenetv2  - [-1, 1]  (pixel / 127.5 - 1), same as mobilenet_v2.preprocess_input
+
+Quantized (uint8 / int8) TFLite models are fed directly from uint8 pixels: the
+normalization and the input quantization (`q = x / scale + zero_point`) collapse
+into one affine transform, which is the identity for a uint8 model calibrated on
+MobileNetV2 input, so no float32 tensor is ever built.
+
+The trainer records how a model expects its input in a sidecar manifest
+(`<model>.meta.json`: input size, normalization, class order, calibrated
+threshold); the detectors read it with `load_manifest` so preprocessing always
+matches training.
+"""
+
+import json
+import os
+import threading
+
+import cv2
+import numpy as np
+
+NORMALIZATIONS = {
+    'unit': (1.0 / 255.0, 0.0),
+    'mobilenetv2': (1.0 / 127.5, -1.0),
+}
+
+MANIFEST_VERSION = 1
+POSITIVE_CLASS = 'shark'
+# Every model the trainer has produced uses MobileNetV2 preprocess_input and the
+# alphabetical flow_from_directory class order; models without a manifest get these
+DEFAULT_MANIFEST = {
+    'input_size': None,
+    'normalization': 'mobilenetv2',
+    'classes': ['no_shark', 'shark'],
+    'positive_class': POSITIVE_CLASS,
+    'threshold': None,
+}
+
+
+def manifest_path(model_path):
+    return str(model_path) + '.meta.json'
+
+
+def write_manifest(model_path, input_size, normalization, classes, threshold=None, **extra):
+    """Write the preprocessing manifest next to a model file."""
+    if normalization not in NORMALIZATIONS:
+        raise ValueError(f"Unknown normalization: {normalization}")
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'model': os.path.basename(str(model_path)),
+        'input_size': [int(input_size), int(input_size)] if isinstance(input_size, int) else list(input_size),
+        'normalization': normalization,
+        'classes': list(classes),
+        'positive_class': POSITIVE_CLASS,
+        'threshold': None if threshold is None else round(float(threshold), 4),
+    }
+    manifest.update(extra)
+    with open(manifest_path(model_path), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_manifest(model_path):
+    """Read a model's manifest, filling in defaults for models exported without one."""
+    manifest = dict(DEFAULT_MANIFEST)
+    path = manifest_path(model_path)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            manifest.update(json.load(f))
+        manifest['found'] = True
+    else:
+        manifest['found'] = False
+    if manifest['normalization'] not in NORMALIZATIONS:
+        raise ValueError(f"{path}: unknown normalization {manifest['normalization']!r}")
+    return manifest
+
+
+def positive_index(manifest):
+    """Index of the shark class in the manifest's class order (the sigmoid scores index 1)."""
+    classes = manifest['classes']
+    return classes.index(manifest['positive_class']) if manifest['positive_class'] in classes else 1
+
+
+def resolve_threshold(threshold, manifest, default=0.5):
+    """An explicit threshold wins, then the manifest's calibrated one, then `default`."""
+    if threshold is not None:
+        return threshold
+    return manifest['threshold'] if manifest.get('threshold') is not None else default
+
+
+def is_quantized(detail):
+    """True if a TFLite tensor detail describes an integer (quantized) tensor."""
+    return np.dtype(detail['dtype']) in (np.dtype(np.uint8), np.dtype(np.int8))
+
+
+def pixel_transform(detail, normalization='unit'):
+    """Affine (alpha, beta) mapping uint8 pixels straight to the tensor's values."""
+    scale, offset = NORMALIZATIONS[normalization]
+    if not is_quantized(detail):
+        return scale, offset
+    q_scale, zero_point = detail['quantization']
+    return scale / q_scale, offset / q_scale + zero_point
+
+
+def quantize_pixels(pixels, detail, normalization='unit'):
+    """Convert uint8 RGB pixels to the integer input dtype of a quantized model."""
+    dtype = np.dtype(detail['dtype'])
+    alpha, beta = pixel_transform(detail, normalization)
+    if dtype == np.uint8 and abs(alpha - 1.0) < 1e-2 and abs(beta) <= 0.5:
+        # Calibrated to the pixel range already: feed pixels as they are
+        return pixels
+    info = np.iinfo(dtype)
+    out = pixels.astype(np.float32)
+    out *= alpha
+    out += beta
+    np.rint(out, out=out)
+    np.clip(out, info.min, info.max, out=out)
+    return out.astype(dtype)
+
+
+def dequantize(output, detail):
+    """Map a model output tensor back to float scores."""
+    if not is_quantized(detail):
+        return output
+    scale, zero_point = detail['quantization']
+    return (output.astype(np.float32) - zero_point) * scale
+
+
+class FramePreprocessor:
+    """Resize / colour-convert / normalize frames into preallocated buffers.
+
+    Every step writes into an existing array (`cv2.resize(dst=...)`,
+    `cv2.cvtColor(dst=...)`, in-place scale/offset), so steady-state frames do
+    not allocate. The target can be the preprocessor's own input buffer or a
+    view of the interpreter's input tensor (see `PooledInterpreter.run_into`).
+    Scratch buffers are per thread, so one preprocessor can serve several
+    pooled interpreters.
+    """
+
+    def __init__(self, height, width, normalization='unit', input_detail=None):
+        """Create the preprocessor.
+
+        Args:
+            height: Model input height
+            width: Model input width
+            normalization: 'unit' ([0, 1]) or 'mobilenetv2' ([-1, 1])
+            input_detail: TFLite input detail; quantized inputs get integer output
+        """
+        if normalization not in NORMALIZATIONS:
+            raise ValueError(f"Unknown normalization: {normalization}")
+        self.height = int(height)
+        self.width = int(width)
+        self.normalization = normalization
+        detail = input_detail or {'dtype': np.float32}
+        self.dtype = np.dtype(detail['dtype'])
+        self.quantized = is_quantized(detail)
+        alpha, beta = pixel_transform(detail, normalization)
+        self.alpha = np.float32(alpha)
+        self.beta = np.float32(beta)
+        # uint8 model calibrated to the pixel range: pixels are the input
+        self.identity = self.quantized and self.dtype == np.uint8 and abs(alpha - 1.0) < 1e-2 and abs(beta) <= 0.5
+        if self.quantized:
+            info = np.iinfo(self.dtype)
+            self.limits = (np.float32(info.min), np.float32(info.max))
+        self._local = threading.local()
+
+    def _scratch(self):
+        local = self._local
+        if not hasattr(local, 'rgb'):
+            local.resized = np.empty((self.height, self.width, 3), dtype=np.uint8)
+            local.rgb = np.empty((self.height, self.width, 3), dtype=np.uint8)
+            local.work = np.empty((self.height, self.width, 3), dtype=np.float32) if self.quantized else None
+            local.buffer = np.empty((1, self.height, self.width, 3), dtype=self.dtype)
+        return local
+
+    def rgb(self, frame):
+        """Resized RGB uint8 copy of a BGR frame (a reused buffer)."""
+        local = self._scratch()
+        if frame.shape[0] == self.height and frame.shape[1] == self.width:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=local.rgb)
+        else:
+            cv2.resize(frame, (self.width, self.height), dst=local.resized, interpolation=cv2.INTER_LINEAR)
+            cv2.cvtColor(local.resized, cv2.COLOR_BGR2RGB, dst=local.rgb)
+        return local.rgb
+
+    def __call__(self, frame, out=None):
+        """Preprocess a BGR frame.
+
+        Args:
+            frame: BGR uint8 frame of any size
+            out: Optional (H, W, 3) or (1, H, W, 3) array of the input dtype to write into
+
+        Returns:
+            `out`, or the preprocessor's (1, H, W, 3) buffer (overwritten by the next call).
+        """
+        local = self._scratch()
+        if out is None:
+            out = local.buffer
+        target = out[0] if out.ndim == 4 else out
+        rgb = self.rgb(frame)
+        if self.identity:
+            np.copyto(target, rgb)
+        elif self.quantized:
+            work = local.work
+            np.multiply(rgb, self.alpha, out=work, dtype=np.float32)
+            work += self.beta
+            np.rint(work, out=work)
+            np.clip(work, self.limits[0], self.limits[1], out=work)
+            np.copyto(target, work, casting='unsafe')
+        else:
+            np.multiply(rgb, self.alpha, out=target, dtype=np.float32)
+            if self.beta:
+                target += self.beta
+        return out
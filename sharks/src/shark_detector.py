@@ -19,172 +19,340 @@ import datetime
 import sys
 from pathlib import Path
 
-import requests
 import cv2
 import numpy as np
-import base64
 import json
 import os
+import time
 from datetime import datetime
 
-# Optional imports based on model type
-try:
-    import tensorflow as tf
-    HAVE_TF = True
-except ImportError:
-    HAVE_TF = False
-
-try:
-    import tflite_runtime.interpreter as tflite
-    HAVE_TFLITE = True
-except ImportError:
-    HAVE_TFLITE = False
+from alert_delivery import AlertDispatcher
+from display import FrameDisplay, add_display_args, display_from_args
+from detection_events import ENDED, STARTED, UPDATED, DetectionEventEngine, add_event_args, engine_from_args
+from frame_gate import add_gate_args, gate_from_args
+from frame_pipeline import DROP_POLICIES, FramePipeline, resolve_drop_policy
+from frame_upload import FrameDeduper, FrameEncoder, add_upload_args, deduper_from_args, encoder_from_args
+from interpreter_pool import InterpreterPool, add_interpreter_args, pool_from_args
+from keras_engine import add_keras_args, keras_engine_from_args, load_engine
+from metrics import LoopMetrics, add_metrics_args, metrics_from_args, process_age
+from preprocessing import (NORMALIZATIONS, FramePreprocessor, dequantize, is_quantized, load_manifest,
+                           positive_index, quantize_pixels, resolve_threshold)
+from stream_source import add_stream_args, open_source, stream_from_args
+from tiling import TiledScore, add_tile_args, grid_from_args
 
 
 class SharkDetector:
     """Shark detection in video streams using TF/TFLite models."""
     
-    def __init__(self, model_path, use_tflite=False, threshold=0.5):
+    def __init__(self, model_path, use_tflite=False, threshold=None, api_url=None,
+                 alert_spool='detections/alert_spool.jsonl', alert_queue=64, events=None, gate=None,
+                 tile_grid=None, pool=None, encoder=None, deduper=None, metrics=None, keras_engine=None):
         """Initialize the detector with a model file.
         
         Args:
             model_path: Path to .h5 or .tflite model
             use_tflite: If True, load as TFLite model
-            threshold: Detection confidence threshold (0-1)
+            threshold: Detection confidence threshold (0-1); default: the model's calibrated threshold, else 0.5
+            api_url: Detection report endpoint (default: `SHARK_API_URL` env var)
+            alert_spool: File used to spool alerts while the API is unreachable (None to disable)
+            alert_queue: In-memory alert queue capacity
+            events: DetectionEventEngine used to debounce alerts (default: EMA with hysteresis at `threshold`)
+            gate: Optional InferenceGate (adaptive stride / motion gate) to skip model runs
+            tile_grid: Optional TileGrid; when set, frames are scored as a batch of overlapping tiles
+            pool: Optional InterpreterPool for TFLite models (default: one interpreter, default threading)
+            encoder: FrameEncoder for uploaded frames (JPEG quality, downscale, ROI crop)
+            deduper: FrameDeduper skipping near-duplicate images within an event
+            metrics: LoopMetrics receiving stage timings and counters (default: a private one)
+            keras_engine: Optional KerasEngine for Keras models (default: traced float32 graph, XLA on GPUs)
         """
         self.model_path = Path(model_path)
-        self.threshold = threshold
-        self.img_size = 224  # Standard size used in training
-        
         if not self.model_path.exists():
             raise FileNotFoundError(f"Model not found: {model_path}")
+
+        # Input size, normalization, class order and threshold recorded by the trainer
+        self.manifest = load_manifest(self.model_path)
+        self.threshold = resolve_threshold(threshold, self.manifest)
+        self.normalization = self.manifest['normalization']
+        # Sigmoid output is P(class 1); flip it if the shark class is class 0
+        self.invert_output = positive_index(self.manifest) == 0
+        self.img_size = 224  # Replaced by the model's input size once loaded
+        self.quantized_input = False
         
         # remember mode to avoid referencing optional imports directly elsewhere
         self.use_tflite = bool(use_tflite)
         self.interpreter = None
         self.input_details = None
         self.output_details = None
+        self.engine = None
 
+        self.pool = pool
         if self.use_tflite:
-            if not HAVE_TFLITE:
-                raise ImportError("TFLite runtime not available. Install tflite-runtime.")
-            # load tflite interpreter and keep references
+            # load tflite interpreter(s) and keep references
             self.interpreter = self._load_tflite_model()
-            self.input_details = self.interpreter.get_input_details()
-            self.output_details = self.interpreter.get_output_details()
+            self.input_details = self.pool.input_details
+            self.output_details = self.pool.output_details
+            # int8/uint8 models are fed quantized pixels directly (no float32 tensor)
+            self.quantized_input = is_quantized(self.input_details[0])
         else:
-            if not HAVE_TF:
-                raise ImportError("TensorFlow not available. Install tensorflow.")
-            self.model = self._load_tf_model()
+            # Traced tf.function instead of Model.predict, which rebuilds its step loop per call
+            self.engine = keras_engine or self._load_tf_model()
+            self.model = self.engine.model
+        self.img_size = self._input_size()
+        # Preallocated resize / colour / normalize buffers, reused for every frame
+        self.preprocessor = FramePreprocessor(self.img_size, self.img_size, self.normalization,
+                                              self.input_details[0] if self.use_tflite else None)
+        
+        self.metrics = metrics or LoopMetrics()
+        self._preprocess_time = 0.0
+        self.events = events or DetectionEventEngine(enter_threshold=self.threshold)
+        self.gate = gate
+        if gate is not None:
+            self.metrics.track_skipped(gate)
+        self.tile_grid = tile_grid
+        self.encoder = encoder or FrameEncoder()
+        self.deduper = deduper or FrameDeduper()
+        self.api_url = api_url or os.getenv("SHARK_API_URL", None)
+        self.alerts = None
+        if self.api_url:
+            self.alerts = AlertDispatcher(self.api_url, spool_path=alert_spool, max_queue=alert_queue)
+            self.metrics.track_alerts(self.alerts)
     
     def _load_tf_model(self):
-        """Load regular TensorFlow model."""
-        # return tf.keras.models.load_model(self.model_path)
-        return tf.keras.models.load_model(self.model_path, compile=False)
+        """Load regular TensorFlow model behind a compiled, warmed-up KerasEngine."""
+        # TensorFlow takes seconds to import, so the engine only loads it for Keras models
+        return load_engine(self.model_path)
     
     def _load_tflite_model(self):
         """Load and prepare TFLite model."""
-        interpreter = tflite.Interpreter(model_path=str(self.model_path))
-        interpreter.allocate_tensors()
-        return interpreter
+        if self.pool is None:
+            self.pool = InterpreterPool(self.model_path)
+        return self.pool.slots[0].interpreter
     
-    def preprocess_frame(self, frame):
-        """Preprocess a frame for inference."""
-        # Resize and normalize
-        img = cv2.resize(frame, (self.img_size, self.img_size))
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        img = img.astype(np.float32) / 255.0
-        
-        # Add batch dimension
-        return np.expand_dims(img, axis=0)
+    def warmup(self):
+        """Run the model once on a blank frame so the first real frame is not slowed by lazy setup.
+
+        A KerasEngine is already warmed up when it is created; its warm-up is not repeated.
+
+        Returns:
+            Seconds spent.
+        """
+        if self.use_tflite:
+            return self.pool.warmup()
+        if not self.engine.warmup_seconds:
+            self.engine.warmup_seconds = self.engine.warmup()
+        return self.engine.warmup_seconds
+    
+    def _input_size(self):
+        """Square input edge of the loaded model (manifest / 224 for fully dynamic models)."""
+        shape = self.input_details[0]['shape'] if self.use_tflite else self.engine.input_shape
+        if shape[1]:
+            return int(shape[1])
+        return int((self.manifest['input_size'] or [224])[0])
+
+    def _scores(self, prediction, n):
+        """Shark probability per image from a raw (N, ...) model output."""
+        scores = np.asarray(prediction, dtype=np.float32).reshape(n, -1)[:, 0]
+        return 1.0 - scores if self.invert_output else scores
+
+    def preprocess_frame(self, frame, out=None):
+        """Preprocess a frame for inference.
+
+        Writes into `out` ((H, W, 3) or (1, H, W, 3)) if given, otherwise into the
+        preprocessor's own (1, H, W, 3) buffer, which the next call overwrites.
+        """
+        return self.preprocessor(frame, out=out)
+    
+    def preprocess_batch(self, images):
+        """Preprocess a (N, H, W, 3) BGR uint8 batch of model-sized images in one pass."""
+        if self.quantized_input:
+            return quantize_pixels(np.ascontiguousarray(images[..., ::-1]), self.input_details[0], self.normalization)
+        # Channel flip + float conversion in a single copy, then scale in place
+        scale, offset = NORMALIZATIONS[self.normalization]
+        batch = images[..., ::-1].astype(np.float32)
+        batch *= scale
+        if offset:
+            batch += offset
+        return batch
+    
+    def _invoke_tflite(self, batch):
+        """Run a (N, H, W, 3) batch through a pooled interpreter (chunks run in parallel)."""
+        return dequantize(self.pool.run_parallel(batch), self.output_details[0])
+    
+    def predict_batch(self, batch):
+        """Run inference on a preprocessed (N, H, W, 3) batch; returns N scores."""
+        t0 = time.perf_counter()
+        if self.use_tflite:
+            prediction = self._invoke_tflite(batch)
+        else:
+            prediction = self.engine.predict(batch)
+        self.metrics.observe('invoke', time.perf_counter() - t0)
+        return self._scores(prediction, len(batch))
+    
+    def predict_tiles(self, frame):
+        """Score overlapping tiles of a frame in one batch; returns a TiledScore."""
+        t0 = time.perf_counter()
+        tiles, boxes = self.tile_grid.extract(frame)
+        batch = self.preprocess_batch(tiles)
+        self.metrics.observe('preprocess', time.perf_counter() - t0)
+        return TiledScore(self.predict_batch(batch), boxes)
+    
+    def _preprocess_into(self, frame, view):
+        t0 = time.perf_counter()
+        self.preprocessor(frame, out=view)
+        self._preprocess_time = time.perf_counter() - t0
     
     def predict(self, frame):
         """Run inference on a frame."""
-        processed = self.preprocess_frame(frame)
+        m = self.metrics
+        m.frames_inferred.inc()
+        if self.tile_grid is not None:
+            score = self.predict_tiles(frame)
+            m.scores.observe(score)
+            m.mark_first_inference()
+            return score
         # Branch based on model type (avoid referencing optional modules directly)
+        t0 = time.perf_counter()
         if self.use_tflite:
-            # TFLite inference using stored interpreter
-            self.interpreter.set_tensor(self.input_details[0]['index'], processed.astype(self.input_details[0]['dtype']))
-            self.interpreter.invoke()
-            prediction = self.interpreter.get_tensor(self.output_details[0]['index'])
-            score = float(prediction.ravel()[0])
+            # TFLite inference: preprocess straight into the interpreter's input tensor
+            prediction = dequantize(self.pool.run_into(lambda view: self._preprocess_into(frame, view)),
+                                    self.output_details[0])
+            m.observe('preprocess', self._preprocess_time)
+            m.observe('invoke', time.perf_counter() - t0 - self._preprocess_time)
         else:
             # Regular TF inference
-            prediction = self.model.predict(processed, verbose=0)
-            score = float(prediction[0][0])
+            x = self.preprocess_frame(frame)
+            t1 = time.perf_counter()
+            m.observe('preprocess', t1 - t0)
+            prediction = self.engine.predict(x)
+            m.observe('invoke', time.perf_counter() - t1)
         
+        score = float(self._scores(prediction, 1)[0])
+        m.scores.observe(score)
+        m.mark_first_inference()
         return score
     
-    def process_frame(self, frame):
-        """Process a frame and add visual feedback."""
-        # Make prediction
-        score = self.predict(frame)
-        
-        # Add visual feedback
+    def score_frame(self, frame):
+        """Score a frame, reusing the last score when the frame gate skips it."""
+        if self.gate is None:
+            return self.predict(frame)
+        return self.gate.score(frame, self.predict)
+    
+    def annotate_frame(self, frame, score, detected=None):
+        """Draw the timestamp / detection overlay on a frame in place."""
+        if detected is None:
+            detected = score > self.threshold
         current_time_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         text = f"{current_time_stamp}"        
         color = (0, 255, 0) 
-        if score > self.threshold:
+        if detected:
             color = (0, 0, 255)
             text += f" | Shark Spotted" 
         cv2.putText(frame, text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
         
-        if score > self.threshold:
-            # Draw red rectangle for high confidence shark detection
-            h, w = frame.shape[:2]
-            cv2.rectangle(frame, (0, 0), (w, h), color, 2)
-            # encode frame as JPEG and base64 for metadata
-            ok, buf = cv2.imencode('.jpg', frame)
-            if ok:
-                b64_frame = base64.b64encode(buf.tobytes()).decode('utf-8')
-            else:
-                b64_frame = ""
+        if detected:
+            # Draw red rectangle for high confidence shark detection: around the tiles
+            # that fired in tiled mode, around the whole frame otherwise
+            fired = score.fired(self.threshold) if isinstance(score, TiledScore) else ()
+            for x, y, bw, bh in fired:
+                cv2.rectangle(frame, (int(x), int(y)), (int(x + bw), int(y + bh)), color, 2)
+            if not len(fired):
+                h, w = frame.shape[:2]
+                cv2.rectangle(frame, (0, 0), (w, h), color, 2)
+        return frame
+    
+    def send_alert(self, frame, score, event=None, drone_name=None, boxes=None):
+        """Report a detection to `SHARK_API_URL` (if set) with the frame attached as a JPEG part."""
+        drone_name = drone_name or os.getenv("DRONE_NAME", "drone-1")
+        t0 = time.perf_counter()
+        image, roi = self.encoder.region(frame, boxes)
+        metadata = {"timestamp": datetime.utcnow().isoformat() + "Z", "roi": [int(v) for v in roi]}
+        duplicate = False
+        if event is not None:
+            metadata["event_id"] = event.event_id
+            metadata["event"] = event.kind
+            # Later reports of an event skip the image when it looks like one already sent
+            duplicate = self.deduper.check((drone_name, event.event_id), image) and event.kind != STARTED
+        jpeg = None if duplicate else self.encoder.encode(image)
+        if duplicate:
+            metadata["image_deduplicated"] = True
+        self.metrics.observe('encode', time.perf_counter() - t0)
 
-            payload = {
-                "droneName": os.getenv("DRONE_NAME", "drone-1"),
-                "sharkType": "unknown",
-                "size": 0.0,
-                "lattitude": float(os.getenv("DRONE_LAT", 0.0)),
-                "longitude": float(os.getenv("DRONE_LON", 0.0)),
-                "accuracy": float(score),
-                "metadata": {
-                    "timestamp": datetime.utcnow().isoformat() + "Z",
-                    "frame_jpeg_base64": b64_frame
-                }
-            }
+        payload = {
+            "droneName": drone_name,
+            "sharkType": "unknown",
+            "size": 0.0,
+            "latitude": float(os.getenv("DRONE_LAT", 0.0)),
+            "longitude": float(os.getenv("DRONE_LON", 0.0)),
+            "accuracy": float(score),
+            "metadata": metadata,
+            "image": jpeg,
+        }
 
-            api_url = os.getenv("SHARK_API_URL", None)
-            print(f"Sending shark detection to API: {api_url}")
-            payload_log = payload.copy()
-            payload_log['metadata'] = {k: v for k, v in payload['metadata'].items() if k != 'frame_jpeg_base64'}
-            print(f"Payload: {json.dumps(payload_log)}")
-            if api_url:
-                # Try requests first, fall back to stdlib urllib if needed. Failures are ignored so video loop continues.
-                try:
-                    resp = requests.post(api_url, json=payload, timeout=5)
-                    resp.raise_for_status()
-                except Exception:
-                    try:
-                        import urllib.request
-                        req = urllib.request.Request(api_url, data=json.dumps(payload).encode('utf-8'),
-                                                    headers={'Content-Type': 'application/json'})
-                        with urllib.request.urlopen(req, timeout=5) as r:
-                            _ = r.read()
-                    except Exception:
-                        pass
-        
+        print(f"Sending shark detection to API: {self.api_url}")
+        payload_log = {k: v for k, v in payload.items() if k != 'image'}
+        print(f"Payload: {json.dumps(payload_log)} image={len(jpeg) if jpeg else 0} bytes")
+        if self.alerts:
+            # Delivery happens on a background thread so the video loop never waits on the network
+            self.alerts.submit(payload)
+    
+    def close(self):
+        """Flush pending alerts and stop the delivery thread."""
+        if self.alerts:
+            stats = self.alerts.close()
+            self.alerts = None
+            print(f"Alert delivery: {json.dumps(stats)}")
+    
+    def handle_event(self, frame, event, drone_name=None, score=None):
+        """Alert when a detection starts or improves; log when it ends."""
+        prefix = f"[{drone_name}] " if drone_name else ""
+        self.metrics.event(event.kind)
+        print(f"{prefix}Detection {event.kind}: id={event.event_id} score={event.score:.3f} "
+              f"peak={event.peak_score:.3f} frames={event.frames}")
+        if event.kind in (STARTED, UPDATED) and frame is not None:
+            boxes = score.fired(self.threshold) if isinstance(score, TiledScore) else None
+            self.send_alert(frame, event.peak_score, event, drone_name=drone_name, boxes=boxes)
+        elif event.kind == ENDED:
+            self.deduper.forget((drone_name or os.getenv("DRONE_NAME", "drone-1"), event.event_id))
+    
+    def handle_result(self, frame, score):
+        """Overlay and alert for an already scored frame."""
+        t0 = time.perf_counter()
+        events = self.events.update(score)
+        self.annotate_frame(frame, score, detected=self.events.active)
+        for event in events:
+            self.handle_event(frame, event, score=score)
+        self.metrics.observe('postprocess', time.perf_counter() - t0)
+        return frame
+    
+    def process_frame(self, frame):
+        """Process a frame and add visual feedback."""
+        # Make prediction
+        score = self.score_frame(frame)
+        self.handle_result(frame, score)
         return frame, score
     
-    def process_video(self, source=0, output=None):
+    def process_video(self, source=0, output=None, pipeline=False, drop_policy=None, queue_size=4,
+                      stats_interval=5.0, display=None):
         """Process video from file or camera.
         
         Args:
-            source: Camera index or video file path
+            source: Camera index, stream URL, video file path or an opened StreamSource
             output: Optional output video file path
+            pipeline: If True, run decode / inference / sink as separate stages
+            drop_policy: Pipeline policy 'latest' or 'all' (default: inferred from source)
+            queue_size: Capacity of each inter-stage queue in pipeline mode
+            stats_interval: Seconds between pipeline stats lines (0 to disable)
+            display: FrameDisplay for the preview window (default: a window; pass a disabled one for headless)
         """
-        cap = cv2.VideoCapture(source)
+        if display is None:
+            display = FrameDisplay('The Surfer : Shark Detector')
+        # Live sources get low-latency options, a drain thread and reconnects (stream_source.py)
+        cap = source if hasattr(source, 'read') else open_source(source)
+        source = getattr(cap, 'source', source)
         if not cap.isOpened():
             raise ValueError(f"Could not open video source: {source}")
+        if hasattr(cap, 'stats'):
+            self.metrics.track_stream(cap)
         
         # Setup video writer if output specified
         writer = None
@@ -199,31 +367,58 @@ class SharkDetector:
                 (width, height)
             )
         
+        def read():
+            t0 = time.perf_counter()
+            ret, frame = cap.read()
+            if ret:
+                self.metrics.observe('decode', time.perf_counter() - t0)
+                self.metrics.frames_read.inc()
+            return ret, frame
+        
+        def sink(frame, score):
+            processed_frame = self.handle_result(frame, score)
+            t0 = time.perf_counter()
+            
+            # Write frame if recording
+            if writer:
+                writer.write(processed_frame)
+            
+            # Display result (no-op when headless), break on 'q' key
+            keep_going = display.show(processed_frame)
+            self.metrics.observe('output', time.perf_counter() - t0)
+            return keep_going
+        
         try:
+            if pipeline:
+                policy = resolve_drop_policy(source, drop_policy)
+                frames = FramePipeline(read, self.score_frame, sink, policy=policy,
+                                       queue_size=queue_size, stats_interval=stats_interval)
+                self.metrics.track_queue('decode->infer', frames.decoded.qsize)
+                self.metrics.track_queue('infer->sink', frames.inferred.qsize)
+                self.metrics.track_dropped('pipeline', lambda: sum(frames.dropped.values()))
+                frames.run()
+                return
+            
             while True:
-                ret, frame = cap.read()
+                ret, frame = read()
                 if not ret:
                     break
                 
                 # Process frame
-                processed_frame, score = self.process_frame(frame)
-                
-                # Write frame if recording
-                if writer:
-                    writer.write(processed_frame)
-                
-                # Display result
-                cv2.imshow('The Surfer : Shark Detector', processed_frame)
-                
-                # Break on 'q' key
-                if cv2.waitKey(1) & 0xFF == ord('q'):
+                score = self.score_frame(frame)
+                if not sink(frame, score):
                     break
         
         finally:
             cap.release()
             if writer:
                 writer.release()
-            cv2.destroyAllWindows()
+            display.close()
+            for event in self.events.end():
+                self.handle_event(None, event)
+            if self.gate is not None:
+                print(self.gate.report())
+            self.close()
 
 
 def main():
@@ -232,17 +427,64 @@ def main():
     parser.add_argument('--input', default=0, help='Input source (video file or camera index)')
     parser.add_argument('--output', help='Optional output video file')
     parser.add_argument('--tflite', action='store_true', help='Use TFLite model')
-    parser.add_argument('--threshold', type=float, default=0.5, help='Detection threshold')
+    parser.add_argument('--threshold', type=float, default=None,
+                        help="Detection threshold (default: the model's calibrated threshold, else 0.5)")
+    add_event_args(parser)
+    add_gate_args(parser)
+    add_tile_args(parser)
+    add_interpreter_args(parser)
+    add_keras_args(parser)
+    parser.add_argument('--alert-spool', default='detections/alert_spool.jsonl',
+                        help='Spool file for alerts while the API is unreachable')
+    parser.add_argument('--alert-queue', type=int, default=64, help='In-memory alert queue capacity')
+    add_upload_args(parser)
+    parser.add_argument('--pipeline', action='store_true',
+                        help='Run decode, inference and output as separate pipelined stages')
+    parser.add_argument('--drop-policy', choices=('auto',) + DROP_POLICIES, default='auto',
+                        help="Pipeline frame policy: 'latest' keeps only the newest frame, 'all' keeps every frame")
+    parser.add_argument('--queue-size', type=int, default=4, help='Pipeline queue capacity per stage')
+    parser.add_argument('--stats-interval', type=float, default=5.0,
+                        help='Seconds between pipeline throughput reports (0 to disable)')
+    add_stream_args(parser)
+    add_display_args(parser)
+    add_metrics_args(parser)
     args = parser.parse_args()
     
+    runtime = None
     try:
+        # Stage timings / counters, optional /metrics endpoint, log line and profiler
+        runtime = metrics_from_args(args)
+        threshold = resolve_threshold(args.threshold, load_manifest(args.model))
         # Initialize detector
-        detector = SharkDetector(args.model, use_tflite=args.tflite, threshold=args.threshold)
+        detector = SharkDetector(args.model, use_tflite=args.tflite, threshold=threshold,
+                                 alert_spool=args.alert_spool, alert_queue=args.alert_queue,
+                                 encoder=encoder_from_args(args), deduper=deduper_from_args(args),
+                                 events=engine_from_args(args, threshold),
+                                 gate=gate_from_args(args, threshold),
+                                 pool=pool_from_args(args, args.model) if args.tflite else None,
+                                 keras_engine=None if args.tflite else keras_engine_from_args(args, args.model),
+                                 metrics=runtime.metrics)
+        if detector.engine is not None:
+            print(detector.engine.describe())
+        # Tiles match the model's input size
+        detector.tile_grid = grid_from_args(args, tile=detector.img_size)
+        print(f"Model input {detector.img_size}px, {detector.normalization} normalization, "
+              f"threshold {threshold:.2f}" + ("" if detector.manifest['found'] else " (no model manifest)"))
+        loaded = process_age()
+        warmup = detector.warmup()
+        print(f"[startup] model ready {loaded:.2f} s after process start, warm-up {1000 * warmup:.0f} ms")
         
         # Process video
         detector.process_video(
-            source=0 if args.input == '0' else args.input,
-            output=args.output
+            # Decode-time reduction never goes below the model input (tiles need the full frame)
+            source=stream_from_args(args, 0 if args.input == '0' else args.input,
+                                    min_side=None if detector.tile_grid else detector.img_size),
+            output=args.output,
+            pipeline=args.pipeline,
+            drop_policy=args.drop_policy,
+            queue_size=args.queue_size,
+            stats_interval=args.stats_interval,
+            display=display_from_args(args, 'The Surfer : Shark Detector')
         )
     
     except KeyboardInterrupt:
@@ -251,7 +493,13 @@ def main():
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
+    finally:
+        if runtime is not None:
+            runtime.close()
 
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'scan':
+        from archive_scan import main as scan_main
+        sys.exit(scan_main(sys.argv[2:]))
     main()
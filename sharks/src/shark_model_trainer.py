@@ -6,31 +6,114 @@ This script implements a training pipeline derived from `shark_detection.ipynb`.
 It uses transfer learning (MobileNetV2) by default, trains a small head, optionally
 fine-tunes top layers, and writes the best model to disk.
 
+Lighter backbones (`--backbone`: MobileNetV2 at width 0.5 / 0.35, MobileNetV3-Small)
+at 128-160px inputs trade some accuracy for several times the frame rate on drone
+CPUs. `--teacher` adds a knowledge-distillation phase: the student is trained on
+data/train against the teacher's softened scores as well as the labels. Every run
+measures test accuracy and single-frame CPU latency (Keras and float32 TFLite) and
+records them in models/runs.json, printed as an accuracy / latency table.
+
 Usage examples:
   python src/shark_model_trainer.py --data_dir data --epochs 10
   python src/shark_model_trainer.py --data_dir data --epochs 10 --fine_tune_epochs 5 --unfreeze 50
 
+  python src/shark_model_trainer.py --data_dir data --epochs 10 --input_pipeline tfdata --cache disk
+  python src/shark_model_trainer.py --data_dir data --epochs 50 --feature_cache --dropout 0.3 --lr 3e-4
+  python src/shark_model_trainer.py --data_dir data --epochs 10 --export all
+  python src/shark_model_trainer.py --data_dir data --export_only --export float16 int8
+  python src/shark_model_trainer.py --data_dir data --backbone mobilenetv2_0.35 --img_size 160 --epochs 10 \
+      --teacher models/best_shark_mobilenetv2.h5 --distill_epochs 10 --export int8
+  python src/shark_model_trainer.py sweep sweep.json --data_dir data --workers 4 --threads_per_trial 2
+
 Outputs:
   - models/best_shark_mobilenetv2.h5 (best during training)
   - models/final_shark_mobilenetv2.h5 (final model after fine-tuning)
+  - models/best_shark_mobilenetv2_<variant>.tflite (with --export)
+  - models/best_shark_mobilenetv2.tflite (fastest exported variant within --accuracy_budget)
+  - models/export_report.json (size, CPU latency and validation accuracy per variant)
+  - models/runs.json (backbone, input size, accuracy and CPU latency of every run)
+  - other backbones / input sizes are named after them, e.g. models/best_shark_mobilenetv2_0.35_160.h5,
+    models/best_shark_mobilenetv2_0.35_160.tflite and models/export_report_shark_mobilenetv2_0.35_160.json
+    (MobileNetV3 checkpoints use the native .keras format instead of .h5)
+  - <model>.meta.json next to every model (input size, normalization, class order and the
+    threshold calibrated on the --threshold_holdout slice of data/train, which is kept out of training),
+    read by the detectors to build matching preprocessing
+  - sweeps/<name>/leaderboard.json (with `sweep`, see sweep.py)
 """
 
 from pathlib import Path
 import argparse
+import hashlib
+import json
 import os
 import math
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
 
 import tensorflow as tf
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
-from tensorflow.keras.applications import MobileNetV2
+from tensorflow.keras.applications import MobileNetV2, MobileNetV3Small
 from tensorflow.keras.applications.mobilenet_v2 import preprocess_input
 from tensorflow.keras.layers import GlobalAveragePooling2D, Dense, Dropout
 from tensorflow.keras.models import Model
-from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint, ReduceLROnPlateau
-
-
-def build_transfer_model(img_size=224, dropout=0.5):
-	base = MobileNetV2(include_top=False, weights='imagenet', input_shape=(img_size, img_size, 3))
+from tensorflow.keras.callbacks import Callback, EarlyStopping, ModelCheckpoint, ReduceLROnPlateau
+
+from feature_cache import FeatureStore, load_rgb
+from interpreter_pool import make_interpreter
+from keras_engine import KerasEngine, load_engine
+from preprocessing import (dequantize, is_quantized, load_manifest, manifest_path, quantize_pixels, resolve_threshold,
+	write_manifest)
+
+EXPORT_VARIANTS = ('float32', 'dynamic', 'float16', 'int8')
+INPUT_PIPELINES = ('generator', 'tfdata')
+AUTOTUNE = tf.data.AUTOTUNE
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+# Matches preprocess_input used by make_generators
+NORMALIZATION = 'mobilenetv2'
+# --backbone name -> (application, width multiplier)
+BACKBONES = {
+	'mobilenetv2': (MobileNetV2, 1.0),
+	'mobilenetv2_0.5': (MobileNetV2, 0.5),
+	'mobilenetv2_0.35': (MobileNetV2, 0.35),
+	'mobilenetv3_small': (MobileNetV3Small, 1.0),
+}
+DEFAULT_BACKBONE = 'mobilenetv2'
+DEFAULT_IMG_SIZE = 224
+# Keras 3 cannot rebuild MobileNetV3's hard-swish ops from a legacy .h5 file
+KERAS_FORMAT_BACKBONES = ('mobilenetv3_small',)
+
+
+def model_name(backbone=DEFAULT_BACKBONE, img_size=DEFAULT_IMG_SIZE):
+	"""Base name of a configuration's files: shark_mobilenetv2 for the default one, else shark_<backbone>_<size>."""
+	if backbone == DEFAULT_BACKBONE and img_size == DEFAULT_IMG_SIZE:
+		return 'shark_mobilenetv2'
+	return f"shark_{backbone}_{img_size}"
+
+
+def checkpoint_suffix(backbone=DEFAULT_BACKBONE):
+	return '.keras' if backbone in KERAS_FORMAT_BACKBONES else '.h5'
+
+
+def build_backbone(backbone=DEFAULT_BACKBONE, img_size=224):
+	"""ImageNet-pretrained feature extractor (no top) expecting preprocess_input's [-1, 1] pixels."""
+	if backbone not in BACKBONES:
+		raise ValueError(f"Unknown backbone: {backbone}")
+	application, alpha = BACKBONES[backbone]
+	kwargs = {}
+	if application is MobileNetV3Small:
+		# MobileNetV3 normally rescales [0, 255] itself; keep the [-1, 1] input of the other backbones
+		kwargs['include_preprocessing'] = False
+	return application(include_top=False, weights='imagenet', input_shape=(img_size, img_size, 3), alpha=alpha,
+		**kwargs)
+
+
+def build_transfer_model(img_size=224, dropout=0.5, lr=1e-4, backbone=DEFAULT_BACKBONE):
+	base = build_backbone(backbone, img_size)
 	base.trainable = False
 
 	x = base.output
@@ -40,11 +123,81 @@ def build_transfer_model(img_size=224, dropout=0.5):
 	outputs = Dense(1, activation='sigmoid')(x)
 
 	model = Model(inputs=base.input, outputs=outputs)
-	model.compile(optimizer=tf.keras.optimizers.Adam(1e-4), loss='binary_crossentropy', metrics=['accuracy'])
+	model.compile(optimizer=tf.keras.optimizers.Adam(lr), loss='binary_crossentropy', metrics=['accuracy'])
 	return model, base
 
 
-def make_generators(data_dir, img_size=224, batch_size=32):
+def build_head(feature_dim, dropout=0.5, lr=1e-4):
+	"""The classification head of build_transfer_model on its own, fed pooled backbone features."""
+	inputs = tf.keras.Input(shape=(feature_dim,))
+	x = Dense(128, activation='relu')(inputs)
+	x = Dropout(dropout)(x)
+	outputs = Dense(1, activation='sigmoid')(x)
+	head = Model(inputs=inputs, outputs=outputs)
+	head.compile(optimizer=tf.keras.optimizers.Adam(lr), loss='binary_crossentropy', metrics=['accuracy'])
+	return head
+
+
+def transplant_head(head, model):
+	"""Copy trained head weights into the matching Dense layers of the full model."""
+	src = [l for l in head.layers if isinstance(l, Dense)]
+	dst = [l for l in model.layers if isinstance(l, Dense)]
+	for a, b in zip(src, dst):
+		b.set_weights(a.get_weights())
+
+
+def embed_fn(base, batch_size=32):
+	"""Callable mapping uint8 RGB batches to pooled embeddings of a frozen backbone."""
+	embedder = Model(inputs=base.input, outputs=GlobalAveragePooling2D()(base.output))
+
+	def embed(images):
+		return embedder.predict(preprocess_input(images.astype(np.float32)), verbose=0, batch_size=batch_size)
+	return embed
+
+
+def cached_features(data_dir, base, img_size=224, aug_copies=2, cache_dir='.cache/features', batch_size=32,
+		holdout=0.0):
+	"""Backbone features of data/train (plain + `aug_copies` augmented variants) and data/test.
+
+	The `holdout` slice of data/train (see list_images) is left out.
+
+	Returns:
+		(x_train, y_train, x_val, y_val)
+	"""
+	embed = embed_fn(base, batch_size)
+	splits = []
+	for split, copies, split_holdout in (('train', aug_copies, holdout), ('test', 0, 0.0)):
+		paths, labels = list_images(Path(data_dir) / split, split_holdout)
+		if not paths:
+			raise FileNotFoundError(f"No images found under {Path(data_dir) / split}")
+		items = [(path, seed) for seed in range(copies + 1) for path in paths]
+		store = FeatureStore(cache_dir, f"{split}_{base.name}_{img_size}")
+		splits.append(store.features(items, embed, img_size, batch_size))
+		splits.append(np.asarray(labels * (copies + 1), dtype=np.float32))
+	return tuple(splits)
+
+
+def train_head_on_features(model, base, args, best_path, callbacks=()):
+	"""Train the head of `model` on cached backbone features, then copy it into `model`."""
+	t0 = time.perf_counter()
+	x_train, y_train, x_val, y_val = cached_features(args.data_dir, base, args.img_size, args.feature_aug_copies,
+		args.feature_cache_dir, args.batch_size, args.threshold_holdout)
+	print(f"Features ready in {time.perf_counter() - t0:.1f}s: train {x_train.shape}, val {x_val.shape}")
+	head = build_head(x_train.shape[1], dropout=args.dropout, lr=args.lr)
+	t0 = time.perf_counter()
+	history = head.fit(x_train, y_train, batch_size=args.batch_size, epochs=args.epochs,
+		validation_data=(x_val, y_val), shuffle=True, verbose=2, callbacks=[
+			EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True),
+			ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=3, min_lr=1e-7),
+		] + list(callbacks))
+	print(f"Head trained on cached features in {time.perf_counter() - t0:.1f}s")
+	transplant_head(head, model)
+	model.save(best_path)
+	return history
+
+
+def make_generators(data_dir, img_size=224, batch_size=32, holdout=0.0):
+	"""Augmented data/train and plain data/test generators; the `holdout` slice of data/train is left out."""
 	train_dir = Path(data_dir) / 'train'
 	val_dir = Path(data_dir) / 'test'
 
@@ -57,7 +210,8 @@ def make_generators(data_dir, img_size=224, batch_size=32):
 		width_shift_range=0.2,
 		height_shift_range=0.2,
 		horizontal_flip=True,
-		fill_mode='nearest'
+		fill_mode='nearest',
+		validation_split=holdout
 	)
 
 	val_datagen = ImageDataGenerator(preprocessing_function=preprocess_input)
@@ -66,7 +220,8 @@ def make_generators(data_dir, img_size=224, batch_size=32):
 		train_dir,
 		target_size=(img_size, img_size),
 		batch_size=batch_size,
-		class_mode='binary'
+		class_mode='binary',
+		subset='training' if holdout else None
 	)
 
 	val_gen = val_datagen.flow_from_directory(
@@ -79,76 +234,683 @@ def make_generators(data_dir, img_size=224, batch_size=32):
 	return train_gen, val_gen
 
 
-def train(args):
+def class_names(directory):
+	"""Class folders in the alphabetical order flow_from_directory assigns indices in."""
+	return sorted(d.name for d in Path(directory).iterdir() if d.is_dir())
+
+
+def calibrate_threshold(scores, labels, default=0.5):
+	"""Threshold maximizing Youden's J (TPR - FPR) on validation scores.
+
+	Candidates are midpoints between consecutive distinct scores; ties go to the
+	highest threshold (fewest false alarms). Falls back to `default` when the
+	validation set lacks one of the classes.
+	"""
+	scores = np.asarray(scores, dtype=np.float64)
+	labels = np.asarray(labels).astype(bool)
+	positives, negatives = labels.sum(), (~labels).sum()
+	if not positives or not negatives:
+		return default
+	values = np.unique(scores)
+	candidates = np.concatenate([[values[0] - 1e-6], (values[:-1] + values[1:]) / 2.0, [values[-1] + 1e-6]])
+	best, best_j = default, -1.0
+	for t in candidates:
+		predicted = scores > t
+		j = (predicted & labels).sum() / positives - (predicted & ~labels).sum() / negatives
+		if j >= best_j:
+			best, best_j = float(np.clip(t, 0.0, 1.0)), j
+	return best
+
+
+def keras_scores(model, images, batch_size=32):
+	"""Sigmoid scores of a Keras model on uint8 RGB images."""
+	x = preprocess_input(images.astype(np.float32))
+	return model.predict(x, verbose=0, batch_size=batch_size).reshape(len(images), -1)[:, 0]
+
+
+def threshold_images(data_dir, img_size=224, holdout=0.1):
+	"""Images the detection threshold is calibrated on: the held-out slice of data/train.
+
+	Without a holdout, data/test itself is used and the accuracy reported on it is optimistic.
+	"""
+	if not holdout:
+		print("No --threshold_holdout: calibrating thresholds on data/test, reported accuracy is optimistic")
+		return load_image_arrays(Path(data_dir) / 'test', img_size)
+	return load_image_arrays(Path(data_dir) / 'train', img_size, holdout=holdout, subset='holdout')
+
+
+def accuracy_at(scores, labels, threshold):
+	return float(np.mean((np.asarray(scores) > threshold) == np.asarray(labels).astype(bool))) if len(labels) else 0.0
+
+
+def write_model_manifest(model_path, data_dir, img_size, calibration, test, holdout=0.1, **extra):
+	"""Calibrate a threshold and write `<model>.meta.json`.
+
+	Args:
+		calibration: (scores, labels) the threshold is fitted on (see threshold_images)
+		test: (scores, labels) on data/test; the manifest's accuracy is measured there at that threshold
+		holdout: Fraction of data/train the calibration scores come from (0: data/test)
+	"""
+	threshold = calibrate_threshold(*calibration)
+	accuracy = accuracy_at(*test, threshold)
+	manifest = write_manifest(model_path, img_size, NORMALIZATION, class_names(Path(data_dir) / 'train'),
+		threshold=threshold, calibration={'method': 'youden', 'holdout': holdout, 'samples': int(len(calibration[1])),
+			'accuracy': round(accuracy, 4), 'test_samples': int(len(test[1]))}, **extra)
+	print(f"Wrote manifest for {model_path}: threshold {threshold:.3f} (test accuracy {accuracy:.3f})")
+	return manifest
+
+
+def list_images(directory, holdout=0.0, subset='training'):
+	"""(paths, labels) of a folder-per-class directory, labelled like flow_from_directory.
+
+	With `holdout`, the first `holdout` fraction of each class's files forms the
+	'holdout' subset and the rest the 'training' one: the split ImageDataGenerator
+	makes with `validation_split`.
+	"""
+	directory = Path(directory)
+	paths, labels = [], []
+	for idx, c in enumerate(class_names(directory)):
+		files = [f for f in sorted((directory / c).iterdir()) if f.suffix.lower() in IMAGE_EXTENSIONS]
+		cut = int(holdout * len(files))
+		for f in files[:cut] if subset == 'holdout' else files[cut:]:
+			paths.append(str(f))
+			labels.append(idx)
+	return paths, labels
+
+
+def files_fingerprint(paths, img_size):
+	"""Short hash of file names, sizes and mtimes; changes whenever the data changes."""
+	h = hashlib.sha1(str(img_size).encode())
+	for path in paths:
+		st = os.stat(path)
+		h.update(f"{path}|{st.st_size}|{st.st_mtime_ns}".encode())
+	return h.hexdigest()[:12]
+
+
+def build_augmenter():
+	"""Batch-level augmentation matching the ImageDataGenerator settings of make_generators."""
+	return tf.keras.Sequential([
+		tf.keras.layers.RandomRotation(20.0 / 360.0, fill_mode='nearest'),
+		tf.keras.layers.RandomTranslation(0.2, 0.2, fill_mode='nearest'),
+		tf.keras.layers.RandomFlip('horizontal'),
+	], name='augment')
+
+
+def make_dataset(directory, img_size=224, batch_size=32, training=False, cache='memory', cache_dir='.cache/tfdata',
+		holdout=0.0):
+	"""tf.data pipeline: parallel decode + resize -> cache -> shuffle -> batch -> augment -> prefetch.
+
+	Args:
+		directory: Folder-per-class image directory (data/train or data/test)
+		img_size: Square input size
+		batch_size: Batch size
+		training: Shuffle and augment
+		cache: 'memory', 'disk' (files under `cache_dir`, keyed by a data fingerprint) or 'none'
+		cache_dir: Directory for 'disk' caches
+		holdout: Fraction of each class left out (see list_images)
+
+	Returns:
+		(dataset, number of images)
+	"""
+	paths, labels = list_images(directory, holdout)
+	if not paths:
+		raise FileNotFoundError(f"No images found under {directory}")
+
+	def load(path, label):
+		img = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+		img = tf.image.resize(img, (img_size, img_size))
+		# Cache compact uint8 pixels; normalization happens per batch
+		return tf.cast(tf.round(img), tf.uint8), tf.cast(label, tf.float32)
+
+	ds = tf.data.Dataset.from_tensor_slices((paths, labels)).map(load, num_parallel_calls=AUTOTUNE)
+	if cache == 'memory':
+		ds = ds.cache()
+	elif cache == 'disk':
+		os.makedirs(cache_dir, exist_ok=True)
+		name = f"{Path(directory).name}_{img_size}_{files_fingerprint(paths, img_size)}"
+		ds = ds.cache(os.path.join(cache_dir, name))
+	elif cache != 'none':
+		raise ValueError(f"Unknown cache mode: {cache}")
+	if training:
+		ds = ds.shuffle(len(paths), reshuffle_each_iteration=True)
+	ds = ds.batch(batch_size)
+	augment = build_augmenter() if training else None
+
+	def finish(images, y):
+		x = tf.cast(images, tf.float32)
+		if augment is not None:
+			x = augment(x, training=True)
+		return preprocess_input(x), y
+
+	ds = ds.map(finish, num_parallel_calls=AUTOTUNE).prefetch(AUTOTUNE)
+	return ds, len(paths)
+
+
+def make_datasets(data_dir, img_size=224, batch_size=32, cache='memory', cache_dir='.cache/tfdata', holdout=0.0):
+	"""tf.data counterpart of make_generators: same directories, same class labels."""
+	train_dir = Path(data_dir) / 'train'
+	val_dir = Path(data_dir) / 'test'
+	if not train_dir.exists() or not val_dir.exists():
+		raise FileNotFoundError(f"Expected data/train and data/test under {data_dir}")
+	train = make_dataset(train_dir, img_size, batch_size, training=True, cache=cache, cache_dir=cache_dir,
+		holdout=holdout)
+	val = make_dataset(val_dir, img_size, batch_size, training=False, cache=cache, cache_dir=cache_dir)
+	return train, val
+
+
+def measure_input_throughput(dataset, batches=None):
+	"""Images/sec delivered by an input pipeline alone (no model); also warms its cache."""
+	images = 0
+	t0 = time.perf_counter()
+	for x, _ in dataset.take(batches) if batches else dataset:
+		images += int(x.shape[0])
+	return images / max(time.perf_counter() - t0, 1e-9)
+
+
+class ThroughputCallback(Callback):
+	"""Print training images/sec at the end of every epoch."""
+
+	def __init__(self, samples):
+		super().__init__()
+		self.samples = samples
+		self._start = None
+
+	def on_epoch_begin(self, epoch, logs=None):
+		self._start = time.perf_counter()
+
+	def on_epoch_end(self, epoch, logs=None):
+		elapsed = max(time.perf_counter() - self._start, 1e-9)
+		print(f"Epoch {epoch + 1}: {self.samples / elapsed:.1f} images/sec ({elapsed:.1f}s)")
+
+
+def load_image_arrays(directory, img_size=224, limit=None, seed=0, holdout=0.0, subset='training'):
+	"""Load a folder-per-class directory (or one `list_images` subset of it) as uint8 RGB arrays.
+
+	Class indices follow the alphabetical folder order used by flow_from_directory.
+	"""
+	samples = list(zip(*list_images(directory, holdout, subset)))
+	if limit is not None and len(samples) > limit:
+		order = np.random.default_rng(seed).permutation(len(samples))[:limit]
+		samples = [samples[i] for i in order]
+	images = np.empty((len(samples), img_size, img_size, 3), dtype=np.uint8)
+	labels = np.empty(len(samples), dtype=np.int32)
+	for i, (path, label) in enumerate(samples):
+		images[i] = load_rgb(path, img_size)
+		labels[i] = label
+	return images, labels
+
+
+def representative_dataset(data_dir, img_size=224, num_samples=100):
+	"""Calibration samples for full-integer quantization, drawn from data/train."""
+	images, _ = load_image_arrays(Path(data_dir) / 'train', img_size, limit=num_samples)
+
+	def gen():
+		for img in images:
+			yield [preprocess_input(img[None].astype(np.float32))]
+	return gen
+
+
+def convert_to_tflite(model, variant, data_dir, img_size=224, calibration_samples=100):
+	"""Convert a Keras model to a TFLite flatbuffer.
+
+	Variants: float32, dynamic (dynamic-range int8 weights), float16 (float16 weights),
+	int8 (full-integer with uint8 input/output, calibrated on data/train).
+	"""
+	converter = tf.lite.TFLiteConverter.from_keras_model(model)
+	if variant == 'dynamic':
+		converter.optimizations = [tf.lite.Optimize.DEFAULT]
+	elif variant == 'float16':
+		converter.optimizations = [tf.lite.Optimize.DEFAULT]
+		converter.target_spec.supported_types = [tf.float16]
+	elif variant == 'int8':
+		converter.optimizations = [tf.lite.Optimize.DEFAULT]
+		converter.representative_dataset = representative_dataset(data_dir, img_size, calibration_samples)
+		converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+		converter.inference_input_type = tf.uint8
+		converter.inference_output_type = tf.uint8
+	elif variant != 'float32':
+		raise ValueError(f"Unknown export variant: {variant}")
+	return converter.convert()
+
+
+def tflite_scores(model_path, images):
+	"""Scores of a TFLite model on uint8 RGB images and the single-image CPU latency of each invoke.
+
+	Returns:
+		(scores, latencies in seconds)
+	"""
+	interpreter = make_interpreter(model_path)
+	input_detail = interpreter.get_input_details()[0]
+	output_detail = interpreter.get_output_details()[0]
+	scores = []
+	latencies = []
+	for img in images:
+		if is_quantized(input_detail):
+			x = quantize_pixels(img, input_detail, 'mobilenetv2')[None]
+		else:
+			x = preprocess_input(img[None].astype(np.float32))
+		interpreter.set_tensor(input_detail['index'], x)
+		t0 = time.perf_counter()
+		interpreter.invoke()
+		latencies.append(time.perf_counter() - t0)
+		scores.append(float(dequantize(interpreter.get_tensor(output_detail['index']), output_detail).ravel()[0]))
+	return np.asarray(scores, dtype=np.float32), latencies
+
+
+def evaluate_tflite(model_path, images, labels, threshold=None):
+	"""Accuracy, scores and median single-image CPU latency of a TFLite model.
+
+	Accuracy is measured at `threshold`, or at the threshold of the model's manifest
+	(0.5 without one) if None; no threshold is fitted on `images`.
+	"""
+	scores, latencies = tflite_scores(model_path, images)
+	threshold = resolve_threshold(threshold, load_manifest(model_path))
+	return {
+		'accuracy': accuracy_at(scores, labels, threshold),
+		'threshold': threshold,
+		'scores': scores,
+		'latency_ms': 1000.0 * statistics.median(latencies) if latencies else 0.0,
+	}
+
+
+def export_models(checkpoint, data_dir, img_size=224, variants=EXPORT_VARIANTS, out_dir='models',
+		calibration_samples=100, accuracy_budget=0.01, name='shark_mobilenetv2', holdout=0.1):
+	"""Export TFLite variants of a checkpoint and pick the one to ship.
+
+	Each variant gets its own threshold, calibrated on the `holdout` slice of data/train,
+	and is measured for file size, CPU latency and accuracy on data/test at that threshold.
+	The fastest variant whose accuracy is within `accuracy_budget` of the best one
+	(smallest file on ties) is copied to `<out_dir>/best_<name>.tflite`.
+	"""
+	checkpoint = Path(checkpoint)
+	out_dir = Path(out_dir)
+	out_dir.mkdir(exist_ok=True)
+	model = tf.keras.models.load_model(checkpoint, compile=False)
+	images, labels = load_image_arrays(Path(data_dir) / 'test', img_size)
+	cal_images, cal_labels = threshold_images(data_dir, img_size, holdout)
+
+	report = []
+	for variant in variants:
+		path = out_dir / f"{checkpoint.stem}_{variant}.tflite"
+		print(f"Exporting {variant} -> {path}")
+		path.write_bytes(convert_to_tflite(model, variant, data_dir, img_size, calibration_samples))
+		scores, latencies = tflite_scores(path, images)
+		manifest = write_model_manifest(path, data_dir, img_size, (tflite_scores(path, cal_images)[0], cal_labels),
+			(scores, labels), holdout=holdout, variant=variant)
+		report.append({'variant': variant, 'path': str(path), 'size_kb': round(path.stat().st_size / 1024.0, 1),
+			'latency_ms': round(1000.0 * statistics.median(latencies), 3),
+			'accuracy': manifest['calibration']['accuracy'], 'threshold': round(manifest['threshold'], 4)})
+
+	print(f"{'variant':<10}{'size (KB)':>12}{'latency (ms)':>15}{'accuracy':>10}{'threshold':>11}")
+	for row in report:
+		print(f"{row['variant']:<10}{row['size_kb']:>12.1f}{row['latency_ms']:>15.2f}{row['accuracy']:>10.3f}"
+			f"{row['threshold']:>11.3f}")
+
+	best_accuracy = max(row['accuracy'] for row in report)
+	eligible = [row for row in report if row['accuracy'] >= best_accuracy - accuracy_budget]
+	chosen = min(eligible, key=lambda row: (row['latency_ms'], row['size_kb']))
+	ship_path = out_dir / f"best_{name}.tflite"
+	shutil.copyfile(chosen['path'], ship_path)
+	shutil.copyfile(manifest_path(chosen['path']), manifest_path(ship_path))
+	print(f"Selected {chosen['variant']} -> {ship_path}")
+
+	report_name = 'export_report.json' if name == model_name() else f"export_report_{name}.json"
+	with open(out_dir / report_name, 'w') as f:
+		json.dump({'checkpoint': str(checkpoint), 'accuracy_budget': accuracy_budget,
+			'selected': chosen['variant'], 'variants': report}, f, indent=2)
+	return report
+
+
+def teacher_logits(scores, eps=1e-6):
+	"""Sigmoid scores back to logits."""
+	scores = np.clip(np.asarray(scores, dtype=np.float32), eps, 1.0 - eps)
+	return np.log(scores) - np.log1p(-scores)
+
+
+def distillation_loss(temperature=2.0, alpha=0.5):
+	"""Knowledge-distillation loss for a sigmoid classifier.
+
+	Targets are packed as (N, 2) [label, teacher logit]. `alpha` weighs binary
+	cross-entropy against the label; the rest is cross-entropy between the teacher's
+	and the student's sigmoids at `temperature`, scaled by temperature**2 so its
+	gradients keep their size as the temperature grows.
+	"""
+	def loss(y_true, y_pred):
+		labels, logits = y_true[:, :1], y_true[:, 1:2]
+		p = tf.clip_by_value(tf.cast(y_pred, tf.float32), 1e-6, 1.0 - 1e-6)
+		student = (tf.math.log(p) - tf.math.log1p(-p)) / temperature
+		soft = tf.keras.losses.binary_crossentropy(tf.sigmoid(logits / temperature), tf.sigmoid(student))
+		hard = tf.keras.losses.binary_crossentropy(labels, p)
+		return alpha * hard + (1.0 - alpha) * temperature ** 2 * soft
+	return loss
+
+
+def distillation_accuracy(y_true, y_pred):
+	"""Accuracy against the label column of distillation targets."""
+	return tf.keras.metrics.binary_accuracy(y_true[:, :1], y_pred)
+
+
+class DistillationInputs(tf.keras.utils.Sequence):
+	"""Batches of a flow_from_directory iterator with the teacher's logits attached to the labels.
+
+	The iterator runs at the teacher's input size, so teacher and student see the same
+	augmented image; the student gets it resized to `img_size`.
+	"""
+
+	def __init__(self, generator, teacher, img_size):
+		super().__init__()
+		self.generator = generator
+		self.teacher = teacher
+		self.img_size = img_size
+
+	def __len__(self):
+		return len(self.generator)
+
+	def __getitem__(self, index):
+		x, y = self.generator[index]
+		logits = teacher_logits(self.teacher.predict(x).reshape(len(x), -1)[:, 0])
+		if x.shape[1:3] != (self.img_size, self.img_size):
+			x = tf.image.resize(x, (self.img_size, self.img_size), antialias=True).numpy()
+		return x, np.stack([y, logits], axis=1).astype(np.float32)
+
+	def on_epoch_end(self):
+		self.generator.on_epoch_end()
+
+
+def load_teacher(path, batch_size=32):
+	"""Teacher checkpoint as a KerasEngine; it must take the same normalization as the student."""
+	manifest = load_manifest(path)
+	if manifest['normalization'] != NORMALIZATION:
+		raise ValueError(f"Teacher {path} expects {manifest['normalization']!r} inputs, the student {NORMALIZATION!r}")
+	return load_engine(path, max_batch=batch_size, jit_compile='off')
+
+
+def unfreeze_top(base, layers):
+	"""Make the last `layers` layers of a backbone trainable (none for 0)."""
+	base.trainable = True
+	for layer in base.layers[:len(base.layers) - layers]:
+		layer.trainable = False
+
+
+def measure_keras_latency(model, runs=50):
+	"""Median single-frame CPU latency (ms) of a Keras model through the detectors' KerasEngine."""
+	engine = KerasEngine(model, max_batch=1, jit_compile='off')
+	frame = np.zeros((1,) + engine.input_size, dtype=np.float32)
+	latencies = []
+	for _ in range(runs):
+		t0 = time.perf_counter()
+		engine.predict(frame)
+		latencies.append(time.perf_counter() - t0)
+	return 1000.0 * statistics.median(latencies)
+
+
+def record_run(models_dir, row):
+	"""Add (or replace, by model name) a run in `<models_dir>/runs.json` and print the accuracy / latency table."""
+	path = Path(models_dir) / 'runs.json'
+	runs = []
+	if path.exists():
+		with open(path, 'r') as f:
+			runs = json.load(f)
+	runs = [r for r in runs if r['model'] != row['model']] + [row]
+	with open(path, 'w') as f:
+		json.dump(runs, f, indent=2)
+
+	slowest = max(r['tflite_latency_ms'] for r in runs)
+	print(f"{'model':<34}{'params':>10}{'accuracy':>10}{'keras (ms)':>12}{'tflite (ms)':>13}{'speedup':>9}")
+	for r in sorted(runs, key=lambda r: r['tflite_latency_ms']):
+		print(f"{r['model']:<34}{r['params']:>10,}{r['accuracy']:>10.3f}{r['keras_latency_ms']:>12.2f}"
+			f"{r['tflite_latency_ms']:>13.2f}{slowest / max(r['tflite_latency_ms'], 1e-9):>8.1f}x")
+	return runs
+
+
+def report_run(checkpoint, args, name, images, labels):
+	"""Measure a trained checkpoint for accuracy and per-frame CPU latency and record it.
+
+	Accuracy is on data/test at the calibrated threshold of the checkpoint's manifest;
+	latency is the median single-frame time of the Keras model and of its float32
+	TFLite conversion on this CPU.
+	"""
+	model = tf.keras.models.load_model(checkpoint, compile=False)
+	with tempfile.TemporaryDirectory() as tmp:
+		tflite_path = Path(tmp) / 'model.tflite'
+		tflite_path.write_bytes(convert_to_tflite(model, 'float32', args.data_dir, args.img_size))
+		# Scored at the checkpoint's calibrated threshold
+		tflite = evaluate_tflite(tflite_path, images, labels, threshold=load_manifest(checkpoint)['threshold'])
+	row = {
+		'model': name,
+		'checkpoint': str(checkpoint),
+		'backbone': args.backbone,
+		'img_size': args.img_size,
+		'params': int(model.count_params()),
+		'teacher': args.teacher,
+		'accuracy': load_manifest(checkpoint)['calibration']['accuracy'],
+		'keras_latency_ms': round(measure_keras_latency(model), 3),
+		'tflite_latency_ms': round(tflite['latency_ms'], 3),
+		'tflite_accuracy': round(tflite['accuracy'], 4),
+	}
+	print(f"{name}: accuracy {row['accuracy']:.3f}, {row['keras_latency_ms']:.2f} ms/frame (Keras), "
+		f"{row['tflite_latency_ms']:.2f} ms/frame (TFLite float32)")
+	return record_run(Path(checkpoint).parent, row)
+
+
+def make_inputs(args):
+	"""Training / validation inputs for the configured pipeline.
+
+	Returns:
+		(train_data, val_data, train_samples, steps_per_epoch, val_steps)
+	"""
+	if args.input_pipeline == 'tfdata':
+		(train_gen, train_samples), (val_gen, val_samples) = make_datasets(args.data_dir, img_size=args.img_size,
+			batch_size=args.batch_size, cache=args.cache, cache_dir=args.cache_dir, holdout=args.threshold_holdout)
+		if args.cache == 'none':
+			print(f"Input pipeline: {measure_input_throughput(train_gen, batches=10):.1f} images/sec")
+		else:
+			# A full first pass decodes and fills the cache (the first epoch would otherwise); a few batches
+			# are enough to time reading it back
+			print(f"Input pipeline: {measure_input_throughput(train_gen):.1f} images/sec (cold), "
+				f"{measure_input_throughput(train_gen, batches=10):.1f} images/sec (cached)")
+		return train_gen, val_gen, train_samples, None, None
+	train_gen, val_gen = make_generators(args.data_dir, img_size=args.img_size, batch_size=args.batch_size,
+		holdout=args.threshold_holdout)
+	return (train_gen, val_gen, train_gen.samples, math.ceil(train_gen.samples / args.batch_size),
+		math.ceil(val_gen.samples / args.batch_size))
+
+
+def train(args, models_dir='models', callbacks=()):
+	"""Train (and optionally fine-tune / export) one configuration.
+
+	Args:
+		args: Parsed trainer arguments
+		models_dir: Output directory for checkpoints, manifests and exports
+		callbacks: Extra Keras callbacks added to every training phase
+
+	Returns:
+		Path of the best checkpoint (the final one if no best was saved).
+	"""
 	img_size = args.img_size
-	batch_size = args.batch_size
 	epochs = args.epochs
 
-	train_gen, val_gen = make_generators(args.data_dir, img_size=img_size, batch_size=batch_size)
-
-	model, base = build_transfer_model(img_size=img_size, dropout=args.dropout)
-
-	models_dir = Path('models')
-	models_dir.mkdir(exist_ok=True)
-
-	best_path = models_dir / 'best_shark_mobilenetv2.h5'
-	final_path = models_dir / 'final_shark_mobilenetv2.h5'
-
-	callbacks = [
-		EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True),
-		ModelCheckpoint(str(best_path), monitor='val_accuracy', save_best_only=True),
-		ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=3, min_lr=1e-7)
-	]
-
-	steps_per_epoch = math.ceil(train_gen.samples / batch_size)
-	val_steps = math.ceil(val_gen.samples / batch_size)
-
-	history = model.fit(
-		train_gen,
-		epochs=epochs,
-		steps_per_epoch=steps_per_epoch,
-		validation_data=val_gen,
-		validation_steps=val_steps,
-		callbacks=callbacks
-	)
+	model, base = build_transfer_model(img_size=img_size, dropout=args.dropout, lr=args.lr, backbone=args.backbone)
+
+	models_dir = Path(models_dir)
+	models_dir.mkdir(parents=True, exist_ok=True)
+
+	name = model_name(args.backbone, img_size)
+	best_path = models_dir / f"best_{name}{checkpoint_suffix(args.backbone)}"
+	final_path = models_dir / f"final_{name}{checkpoint_suffix(args.backbone)}"
+	if args.teacher and Path(args.teacher).resolve() in (best_path.resolve(), final_path.resolve()):
+		raise ValueError(f"Teacher {args.teacher} would be overwritten by this run; pick another --backbone / "
+			f"--img_size or models_dir")
+
+	inputs = None
+	head_accuracy = None
+	if args.feature_cache:
+		# Frozen backbone: train the head on embeddings computed once
+		history = train_head_on_features(model, base, args, best_path, callbacks)
+		# best_path now holds the head restored at its lowest val_loss; later phases have to beat it
+		losses = history.history['val_loss']
+		head_accuracy = history.history['val_accuracy'][int(np.argmin(losses))]
+	else:
+		inputs = make_inputs(args)
+		train_gen, val_gen, train_samples, steps_per_epoch, val_steps = inputs
+
+	# Shared by every phase, so a fine-tune or distillation epoch only replaces best_path when it beats
+	# all earlier epochs
+	checkpoint = ModelCheckpoint(str(best_path), monitor='val_accuracy', mode='max', save_best_only=True,
+		initial_value_threshold=head_accuracy)
+
+	def phase_callbacks():
+		return [
+			EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True),
+			checkpoint,
+			ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=3, min_lr=1e-7),
+			ThroughputCallback(train_samples)
+		] + list(callbacks)
+
+	if not args.feature_cache:
+		history = model.fit(
+			train_gen,
+			epochs=epochs,
+			steps_per_epoch=steps_per_epoch,
+			validation_data=val_gen,
+			validation_steps=val_steps,
+			callbacks=phase_callbacks()
+		)
 
 	# Optionally fine-tune
 	if args.fine_tune_epochs and args.unfreeze > 0:
 		print(f"Starting fine-tune: unfreezing last {args.unfreeze} layers and training for {args.fine_tune_epochs} epochs")
-		base.trainable = True
 		# Freeze all layers except the last `unfreeze` layers
-		for layer in base.layers[:-args.unfreeze]:
-			layer.trainable = False
+		unfreeze_top(base, args.unfreeze)
 
 		model.compile(optimizer=tf.keras.optimizers.Adam(1e-5), loss='binary_crossentropy', metrics=['accuracy'])
 
+		if inputs is None:
+			inputs = make_inputs(args)
+			train_gen, val_gen, train_samples, steps_per_epoch, val_steps = inputs
 		history_f = model.fit(
 			train_gen,
 			epochs=args.fine_tune_epochs,
 			steps_per_epoch=steps_per_epoch,
 			validation_data=val_gen,
 			validation_steps=val_steps,
-			callbacks=callbacks
+			callbacks=phase_callbacks()
 		)
 
+	# Optionally distill the teacher into the model
+	if args.teacher and args.distill_epochs:
+		# The backbone stays frozen unless fine-tuning was requested (or --distill_unfreeze says otherwise),
+		# and unfrozen layers get the fine-tune learning rate
+		layers = args.distill_unfreeze
+		if layers is None:
+			layers = args.unfreeze if args.fine_tune_epochs else 0
+		lr = args.distill_lr or (1e-5 if layers > 0 else args.lr)
+		print(f"Starting distillation from {args.teacher} for {args.distill_epochs} epochs "
+			f"(temperature {args.temperature}, label weight {args.distill_alpha}, {layers} backbone layers "
+			f"trainable, lr {lr:g})")
+		teacher = load_teacher(args.teacher, args.batch_size)
+		teacher_train, teacher_val = make_generators(args.data_dir, img_size=teacher.input_size[0],
+			batch_size=args.batch_size, holdout=args.threshold_holdout)
+		train_samples = teacher_train.samples
+		unfreeze_top(base, layers)
+		model.compile(optimizer=tf.keras.optimizers.Adam(lr),
+			loss=distillation_loss(args.temperature, args.distill_alpha),
+			metrics=[tf.keras.metrics.MeanMetricWrapper(distillation_accuracy, name='accuracy')])
+		history_d = model.fit(
+			DistillationInputs(teacher_train, teacher, img_size),
+			epochs=args.distill_epochs,
+			validation_data=DistillationInputs(teacher_val, teacher, img_size),
+			callbacks=phase_callbacks()
+		)
+		# Checkpoints written from here on carry the plain loss
+		model.compile(optimizer=tf.keras.optimizers.Adam(lr), loss='binary_crossentropy',
+			metrics=['accuracy'])
+
 	# Save final model
 	model.save(final_path)
 	print(f"Saved final model to {final_path}")
 
+	# Record preprocessing and a calibrated threshold next to both checkpoints
+	images, labels = load_image_arrays(Path(args.data_dir) / 'test', img_size)
+	cal_images, cal_labels = threshold_images(args.data_dir, img_size, args.threshold_holdout)
+	for path, trained in ((final_path, model), (best_path, None)):
+		if trained is None and not path.exists():
+			continue
+		trained = trained or tf.keras.models.load_model(path, compile=False)
+		write_model_manifest(path, args.data_dir, img_size, (keras_scores(trained, cal_images), cal_labels),
+			(keras_scores(trained, images), labels), holdout=args.threshold_holdout)
+
+	checkpoint = best_path if best_path.exists() else final_path
+	report_run(checkpoint, args, name, images, labels)
+
+	if args.export:
+		export_models(checkpoint, args.data_dir, img_size=img_size, variants=export_variants(args.export),
+			out_dir=models_dir, calibration_samples=args.calibration_samples, accuracy_budget=args.accuracy_budget,
+			name=name, holdout=args.threshold_holdout)
+	return checkpoint
+
+
+def export_variants(names):
+	return EXPORT_VARIANTS if 'all' in names else tuple(names)
+
 
-def parse_args():
+def parse_args(argv=None):
 	p = argparse.ArgumentParser(description='Train shark detector using transfer learning')
 	p.add_argument('--data_dir', default='data', help='Path containing train/ and test/ folders')
-	p.add_argument('--img_size', type=int, default=224, help='Input image size')
+	p.add_argument('--img_size', type=int, default=DEFAULT_IMG_SIZE,
+		help='Input image size (128-160 for the lighter backbones on drone CPUs)')
+	p.add_argument('--backbone', choices=tuple(BACKBONES), default=DEFAULT_BACKBONE,
+		help='Pretrained feature extractor: MobileNetV2 at width 1.0 / 0.5 / 0.35 or MobileNetV3-Small')
 	p.add_argument('--batch_size', type=int, default=32, help='Batch size')
 	p.add_argument('--epochs', type=int, default=10, help='Initial training epochs')
 	p.add_argument('--dropout', type=float, default=0.5, help='Dropout rate in head')
+	p.add_argument('--lr', type=float, default=1e-4, help='Learning rate of the head training phase')
 	p.add_argument('--fine_tune_epochs', type=int, default=0, help='Fine-tuning epochs (0 to skip)')
 	p.add_argument('--unfreeze', type=int, default=20, help='Number of base layers to unfreeze for fine-tuning')
-	return p.parse_args()
+	p.add_argument('--input_pipeline', choices=INPUT_PIPELINES, default='generator',
+		help='generator: ImageDataGenerator; tfdata: parallel decode, cache, batched augmentation, prefetch')
+	p.add_argument('--cache', default='memory', choices=('memory', 'disk', 'none'),
+		help='Decoded-image cache for --input_pipeline tfdata')
+	p.add_argument('--cache_dir', default='.cache/tfdata', help='Directory for --cache disk')
+	p.add_argument('--feature_cache', action='store_true',
+		help='Train the head on cached frozen-backbone features instead of full forward passes')
+	p.add_argument('--feature_cache_dir', default='.cache/features', help='Directory of the feature store')
+	p.add_argument('--feature_aug_copies', type=int, default=2,
+		help='Augmented variants per training image embedded into the feature cache')
+	p.add_argument('--teacher', help='Trained checkpoint (e.g. models/best_shark_mobilenetv2.h5) to distill from')
+	p.add_argument('--distill_epochs', type=int, default=10, help='Distillation epochs with --teacher (0 to skip)')
+	p.add_argument('--distill_unfreeze', type=int, default=None,
+		help='Backbone layers trained during distillation (default: --unfreeze with --fine_tune_epochs, else none)')
+	p.add_argument('--distill_lr', type=float, default=None,
+		help='Learning rate of the distillation phase (default: 1e-5 with backbone layers trainable, else --lr)')
+	p.add_argument('--temperature', type=float, default=2.0, help='Softening temperature of the distillation loss')
+	p.add_argument('--distill_alpha', type=float, default=0.5,
+		help='Weight of the label loss in distillation (the rest goes to the teacher scores)')
+	p.add_argument('--export', nargs='+', choices=EXPORT_VARIANTS + ('all',),
+		help='Export TFLite variants of the best checkpoint after training')
+	p.add_argument('--export_only', action='store_true', help='Skip training and export --checkpoint')
+	p.add_argument('--checkpoint',
+		help='Checkpoint used by --export_only (default: models/best_<model name>.h5 / .keras)')
+	p.add_argument('--calibration_samples', type=int, default=100, help='data/train images used to calibrate int8')
+	p.add_argument('--threshold_holdout', type=float, default=0.1,
+		help='Fraction of each data/train class kept out of training to calibrate detection thresholds '
+		'(0: calibrate on data/test, with optimistic accuracy)')
+	p.add_argument('--accuracy_budget', type=float, default=0.01,
+		help='Max accuracy drop vs. the best variant when selecting the shipped model')
+	return p.parse_args(argv)
 
 
 if __name__ == '__main__':
+	if len(sys.argv) > 1 and sys.argv[1] == 'sweep':
+		from sweep import main as sweep_main
+		sys.exit(sweep_main(sys.argv[2:]))
 	args = parse_args()
-	train(args)
+	if args.export_only:
+		name = model_name(args.backbone, args.img_size)
+		checkpoint = args.checkpoint or f"models/best_{name}{checkpoint_suffix(args.backbone)}"
+		export_models(checkpoint, args.data_dir, img_size=args.img_size,
+			variants=export_variants(args.export or ['all']), calibration_samples=args.calibration_samples,
+			accuracy_budget=args.accuracy_budget, name=name, holdout=args.threshold_holdout)
+	else:
+		train(args)
 
@@ -0,0 +1,558 @@
+#!/usr/bin/env python3
+"""
+Stream source - low-latency, self-healing frame source for live drone feeds.
+
+`open_source()` returns an object with the `cv2.VideoCapture` interface
+(`isOpened`, `read`, `get`, `release`) that the detectors use instead of a bare
+capture:
+
+    files           read sequentially, every frame, EOF ends the run
+    live sources    (camera indices, rtsp:// rtmp:// udp:// tcp:// srt:// http(s)://)
+                    a drain thread pulls frames off the backend as fast as they
+                    arrive and keeps only the newest, so FFmpeg's and the
+                    socket's buffers never fill up and `read()` always returns
+                    the freshest frame. When the feed drops (read error or no
+                    frame for `timeout` seconds) the backend is reopened with
+                    exponential backoff; `read()` simply waits, the process and
+                    the loaded model stay up.
+
+Network feeds are opened through FFmpeg with latency-oriented options (no input
+buffering, no reorder queue, short probe, TCP or UDP RTSP transport, open / read
+timeouts). HTTP feeds that turn out to be MJPEG (`multipart/x-mixed-replace`)
+are read directly: the drain thread only splits the multipart stream and keeps
+the newest JPEG, which is decoded on demand with `IMREAD_REDUCED_COLOR_{2,4,8}`,
+so downscaling happens inside the JPEG decoder and skipped frames are never
+decoded. For other sources the reduction is a resize right after decode.
+
+`reduce='auto'` picks the largest factor that keeps the shorter frame side at
+or above `min_side` (the model input size); the delivered frame size is fixed
+on the first frame and kept across reconnects.
+
+A local stand-in feed for testing, serving every video in a directory as a
+real-time MJPEG stream (optionally with periodic outages):
+
+    python src/stream_source.py serve videos --port 8090 --outage 20:5
+    python src/shark_detector.py --model models/best_shark_mobilenetv2.tflite --tflite \\
+        --input http://127.0.0.1:8090/shark_near_beach_360p.mjpg
+    python src/stream_source.py probe http://127.0.0.1:8090/shark_near_beach_360p.mjpg --seconds 30
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+from frame_pipeline import resolve_drop_policy
+
+REDUCTIONS = (1, 2, 4, 8)
+_REDUCED_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4,
+                  8: cv2.IMREAD_REDUCED_COLOR_8}
+# FFmpeg demuxer / decoder options for minimum buffering (OPENCV_FFMPEG_CAPTURE_OPTIONS format)
+LOW_LATENCY_OPTIONS = ('fflags;nobuffer', 'flags;low_delay', 'max_delay;0', 'reorder_queue_size;0',
+                       'probesize;32768', 'analyzeduration;0')
+_ENV_LOCK = threading.Lock()
+
+
+def is_live(source):
+    """Cameras and network streams are live; anything else is a file."""
+    return resolve_drop_policy(source) == 'latest'
+
+
+def choose_reduction(height, width, min_side):
+    """Largest factor in REDUCTIONS keeping min(height, width) / factor >= min_side."""
+    best = 1
+    for factor in REDUCTIONS:
+        if min(height, width) / factor >= min_side:
+            best = factor
+    return best
+
+
+class _CaptureBackend:
+    """cv2.VideoCapture opened with latency-oriented FFmpeg options for network URLs."""
+
+    def __init__(self, source, timeout=5.0, transport='tcp'):
+        self.source = source
+        if isinstance(source, int) or '://' not in str(source):
+            self.cap = cv2.VideoCapture(source)
+        else:
+            options = list(LOW_LATENCY_OPTIONS)
+            if str(source).startswith('rtsp'):
+                options.append(f'rtsp_transport;{transport}')
+            params = [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, int(timeout * 1000),
+                      cv2.CAP_PROP_READ_TIMEOUT_MSEC, int(timeout * 1000)]
+            # The options are read from the environment when the capture opens
+            with _ENV_LOCK:
+                previous = os.environ.get('OPENCV_FFMPEG_CAPTURE_OPTIONS')
+                os.environ['OPENCV_FFMPEG_CAPTURE_OPTIONS'] = '|'.join(options)
+                try:
+                    self.cap = cv2.VideoCapture(source, cv2.CAP_FFMPEG, params)
+                finally:
+                    if previous is None:
+                        os.environ.pop('OPENCV_FFMPEG_CAPTURE_OPTIONS', None)
+                    else:
+                        os.environ['OPENCV_FFMPEG_CAPTURE_OPTIONS'] = previous
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) if self.cap.isOpened() else 0.0
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read_raw(self):
+        ret, frame = self.cap.read()
+        return frame if ret else None
+
+    def decode(self, raw, reduce):
+        return raw
+
+    def release(self):
+        self.cap.release()
+
+
+class _MjpegBackend:
+    """HTTP multipart/x-mixed-replace MJPEG reader that hands out undecoded JPEG parts."""
+
+    def __init__(self, response, fps=0.0):
+        self.response = response
+        self.fps = fps
+
+    @classmethod
+    def probe(cls, url, timeout=5.0):
+        """Open `url`; returns an _MjpegBackend if it serves MJPEG, else None."""
+        response = urllib.request.urlopen(url, timeout=timeout)
+        if 'multipart/x-mixed-replace' not in response.headers.get('Content-Type', ''):
+            response.close()
+            return None
+        return cls(response, float(response.headers.get('X-Frame-Rate', 0) or 0))
+
+    def isOpened(self):
+        return self.response is not None
+
+    def read_raw(self):
+        """Next JPEG part as bytes (None at the end of the stream)."""
+        try:
+            length = None
+            line = self.response.readline()
+            while line and not line.strip().startswith(b'--'):
+                line = self.response.readline()
+            if not line:
+                return None
+            while True:
+                line = self.response.readline()
+                if not line:
+                    return None
+                line = line.strip()
+                if not line:
+                    break
+                name, _, value = line.partition(b':')
+                if name.strip().lower() == b'content-length':
+                    length = int(value)
+            if length is not None:
+                data = self.response.read(length)
+                return data if len(data) == length else None
+            # No Content-Length: read up to the JPEG end-of-image marker
+            data = bytearray()
+            while not data.endswith(b'\xff\xd9'):
+                chunk = self.response.read(1)
+                if not chunk:
+                    return None
+                data += chunk
+            return bytes(data)
+        except (OSError, ValueError):
+            return None
+
+    def decode(self, raw, reduce):
+        return cv2.imdecode(np.frombuffer(raw, dtype=np.uint8), _REDUCED_FLAGS[reduce])
+
+    def release(self):
+        if self.response is not None:
+            self.response.close()
+            self.response = None
+
+
+def _open_backend(source, timeout, transport):
+    if str(source).startswith(('http://', 'https://')):
+        try:
+            backend = _MjpegBackend.probe(source, timeout)
+        except (OSError, ValueError):
+            return None
+        if backend is not None:
+            return backend
+    backend = _CaptureBackend(source, timeout, transport)
+    if not backend.isOpened():
+        backend.release()
+        return None
+    return backend
+
+
+class StreamSource:
+    """cv2.VideoCapture-like reader with a drain thread and reconnects for live sources."""
+
+    def __init__(self, source, reduce=1, min_side=None, timeout=5.0, transport='tcp', backoff=0.5,
+                 max_backoff=10.0, connect_timeout=30.0, live=None):
+        """Open the source.
+
+        Args:
+            source: Camera index, stream URL or video file path
+            reduce: Decode-time downscale factor (1, 2, 4, 8) or 'auto' (needs `min_side`)
+            min_side: Smallest shorter frame side 'auto' may reduce to (the model input size)
+            timeout: Seconds without a frame (and open / read timeout) before a live source reconnects
+            transport: RTSP transport, 'tcp' or 'udp'
+            backoff: First reconnect delay in seconds (doubled per failed attempt, with jitter)
+            max_backoff: Upper bound for the reconnect delay
+            connect_timeout: Seconds a live source may take to deliver its first frame
+            live: Force live / file handling (default: from the source)
+        """
+        if isinstance(source, str) and source.isdigit():
+            source = int(source)
+        if reduce != 'auto' and int(reduce) not in REDUCTIONS:
+            raise ValueError(f"Unknown reduction {reduce!r}, expected 'auto' or one of {REDUCTIONS}")
+        self.source = source
+        self.live = is_live(source) if live is None else live
+        self.reduce = reduce if reduce == 'auto' else int(reduce)
+        self.min_side = min_side
+        self.timeout = timeout
+        self.transport = transport
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.size = None
+        self.fps = 0.0
+        self.stats = {'received': 0, 'delivered': 0, 'dropped': 0, 'reconnects': 0}
+
+        self._backend = None
+        self._latest = None
+        self._seq = 0
+        self._read_seq = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+        if not self.live:
+            self._backend = _open_backend(source, timeout, transport)
+            if self._backend is None:
+                return
+            self.fps = self._backend.fps
+            self._pending = self._backend.read_raw()
+            if self._pending is not None:
+                self._set_size(self._pending)
+            return
+
+        self._thread = threading.Thread(target=self._drain, name='stream-drain', daemon=True)
+        self._thread.start()
+        # Wait for the first frame, so the frame size is known before callers open writers
+        deadline = time.monotonic() + connect_timeout
+        with self._cond:
+            while self._seq == 0 and not self._closed and time.monotonic() < deadline:
+                self._cond.wait(0.1)
+            raw, backend = self._latest, self._backend
+        if raw is None:
+            self.release()
+            return
+        frame = backend.decode(raw, 1)
+        if frame is None:
+            self.release()
+            return
+        self._set_size(frame)
+
+    def _set_size(self, frame):
+        h, w = frame.shape[:2]
+        if self.reduce == 'auto':
+            self.reduce = choose_reduction(h, w, self.min_side) if self.min_side else 1
+        self.size = (w // self.reduce, h // self.reduce)
+
+    def _deliver(self, raw, backend):
+        """Decode a raw frame at the delivered size."""
+        if self.size is None:
+            frame = backend.decode(raw, 1)
+            if frame is None:
+                return None
+            self._set_size(frame)
+            if self.reduce > 1:
+                frame = backend.decode(raw, self.reduce)
+        else:
+            frame = backend.decode(raw, self.reduce)
+        if frame is None:
+            return None
+        if (frame.shape[1], frame.shape[0]) != self.size:
+            # Non-JPEG backends, or a feed that came back at another resolution
+            frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        self.stats['delivered'] += 1
+        return frame
+
+    def _drain(self):
+        """Live sources: keep only the newest raw frame; reopen with backoff when the feed drops."""
+        delay = self.backoff
+        while not self._closed:
+            backend = _open_backend(self.source, self.timeout, self.transport)
+            if backend is None:
+                self._sleep(delay)
+                delay = min(self.max_backoff, delay * 2)
+                continue
+            with self._cond:
+                if self._closed:
+                    backend.release()
+                    return
+                self._backend = backend
+                if backend.fps:
+                    self.fps = backend.fps
+            # A feed that goes silent ends read_raw() through FFmpeg's read timeout / the socket timeout
+            while not self._closed:
+                raw = backend.read_raw()
+                if raw is None:
+                    break
+                delay = self.backoff
+                with self._cond:
+                    if self._seq > self._read_seq:
+                        self.stats['dropped'] += 1
+                    self._latest = raw
+                    self._seq += 1
+                    self.stats['received'] += 1
+                    self._cond.notify_all()
+            backend.release()
+            if not self._closed:
+                self.stats['reconnects'] += 1
+                print(f"[stream] {self.source}: feed lost, reconnecting in {delay:.1f}s")
+                self._sleep(delay)
+                delay = min(self.max_backoff, delay * 2)
+
+    def _sleep(self, delay):
+        with self._cond:
+            self._cond.wait(delay * random.uniform(0.8, 1.2))
+
+    def isOpened(self):
+        return not self._closed and (self.live or self._backend is not None)
+
+    def read(self):
+        """Next frame (files) or the newest frame not returned yet (live); (False, None) at the end."""
+        if not self.live:
+            if self._backend is None or self._pending is None:
+                return False, None
+            raw, self._pending = self._pending, None
+            frame = self._deliver(raw, self._backend)
+            self._pending = self._backend.read_raw()
+            self.stats['received'] += 1
+            return frame is not None, frame
+        with self._cond:
+            while self._seq == self._read_seq and not self._closed:
+                self._cond.wait(0.5)
+            if self._closed:
+                return False, None
+            raw, self._read_seq = self._latest, self._seq
+            backend = self._backend
+        # Decoding (and the JPEG reduction) happens here, only for frames that are used
+        frame = self._deliver(raw, backend)
+        return frame is not None, frame
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.size[0]) if self.size else 0.0
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.size[1]) if self.size else 0.0
+        if prop == cv2.CAP_PROP_FPS:
+            # Streams that do not announce a rate get the usual 25 fps default, as with FFmpeg
+            return float(self.fps or 25.0)
+        backend = self._backend
+        if isinstance(backend, _CaptureBackend):
+            return backend.cap.get(prop)
+        return 0.0
+
+    def release(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is None:
+            if self._backend is not None:
+                self._backend.release()
+            return
+        # Live sources: the drain thread owns the backend and releases it when its read returns;
+        # releasing it here could close a capture / response another thread is reading
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.timeout + 1.0)
+            if self._thread.is_alive():
+                print(f"[stream] {self.source}: read still blocked, the feed is released once it returns")
+
+
+def open_source(source, **kwargs):
+    """StreamSource for a camera index, stream URL or file (see StreamSource for options)."""
+    return StreamSource(source, **kwargs)
+
+
+def add_stream_args(parser):
+    """Add live stream options to an argparse parser."""
+    parser.add_argument('--decode-reduce', default='1', choices=('auto',) + tuple(str(r) for r in REDUCTIONS),
+                        help="Downscale frames at decode time ('auto': as far as the model input size allows)")
+    parser.add_argument('--stream-timeout', type=float, default=5.0,
+                        help='Seconds without a frame before a live stream is reconnected')
+    parser.add_argument('--rtsp-transport', choices=('tcp', 'udp'), default='tcp', help='RTSP transport')
+    parser.add_argument('--reconnect-delay', type=float, default=0.5,
+                        help='First reconnect delay in seconds (doubled up to --reconnect-max-delay)')
+    parser.add_argument('--reconnect-max-delay', type=float, default=10.0, help='Longest reconnect delay in seconds')
+    parser.add_argument('--connect-timeout', type=float, default=30.0,
+                        help='Seconds a live source may take to deliver its first frame')
+
+
+def stream_from_args(args, source, min_side=None):
+    """StreamSource for the parsed options; `min_side` is the model input size ('auto' reduction)."""
+    return open_source(source, reduce=args.decode_reduce if args.decode_reduce == 'auto' else int(args.decode_reduce),
+                       min_side=min_side, timeout=args.stream_timeout, transport=args.rtsp_transport,
+                       backoff=args.reconnect_delay, max_backoff=args.reconnect_max_delay,
+                       connect_timeout=args.connect_timeout)
+
+
+class MjpegServer:
+    """Serve the videos of a directory as looping, real-time MJPEG streams (`/<name>.mjpg`)."""
+
+    def __init__(self, directory, port=8090, host='127.0.0.1', quality=80, outage=None):
+        """Start serving.
+
+        Args:
+            directory: Directory with video files (or a single video file)
+            port: TCP port
+            host: Bind address
+            quality: JPEG quality of the streamed frames
+            outage: Optional (every, duration) in seconds: all streams drop and new
+                connections are refused for `duration` seconds every `every` seconds
+        """
+        if os.path.isdir(directory):
+            names = sorted(os.listdir(directory))
+            self.videos = {os.path.splitext(n)[0]: os.path.join(directory, n) for n in names
+                           if n.lower().endswith(('.mp4', '.avi', '.mov', '.mkv'))}
+        else:
+            self.videos = {os.path.splitext(os.path.basename(directory))[0]: directory}
+        self.quality = quality
+        self.outage = outage
+        self.started = time.monotonic()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                name = self.path.strip('/').split('?')[0]
+                name = name[:-5] if name.endswith('.mjpg') else name
+                if not name:
+                    body = ''.join(f"/{n}.mjpg\n" for n in server.videos).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                if name not in server.videos:
+                    self.send_error(404)
+                    return
+                if server.down():
+                    self.send_error(503, 'Simulated outage')
+                    return
+                server.stream(self, server.videos[name])
+
+            def log_message(self, fmt, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='mjpeg-server', daemon=True)
+        self._thread.start()
+
+    def down(self):
+        """True while a simulated outage is in progress."""
+        if not self.outage:
+            return False
+        every, duration = self.outage
+        return (time.monotonic() - self.started) % every >= every - duration
+
+    def stream(self, handler, path):
+        cap = cv2.VideoCapture(path)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+        boundary = 'frame'
+        handler.send_response(200)
+        handler.send_header('Content-Type', f'multipart/x-mixed-replace; boundary={boundary}')
+        handler.send_header('X-Frame-Rate', f'{fps:.3f}')
+        handler.end_headers()
+        next_time = time.monotonic()
+        try:
+            while not self.down():
+                ret, frame = cap.read()
+                if not ret:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                ok, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                handler.wfile.write((f'--{boundary}\r\nContent-Type: image/jpeg\r\n'
+                                     f'Content-Length: {len(jpeg)}\r\n\r\n').encode('ascii'))
+                handler.wfile.write(jpeg.tobytes())
+                handler.wfile.write(b'\r\n')
+                next_time += 1.0 / fps
+                time.sleep(max(0.0, next_time - time.monotonic()))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            cap.release()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def probe(source, seconds, args):
+    """Read a source for `seconds` and report delivered FPS, frame age and stream counters."""
+    src = stream_from_args(args, source)
+    if not src.isOpened():
+        print(f"Could not open {source}")
+        return 1
+    print(f"[probe] {source}: {src.size[0]}x{src.size[1]} @ {src.fps:.1f} fps, reduce {src.reduce}")
+    start = last = time.monotonic()
+    frames = 0
+    try:
+        while time.monotonic() - start < seconds:
+            ret, _ = src.read()
+            if not ret:
+                break
+            frames += 1
+            now = time.monotonic()
+            if now - last >= 5.0:
+                print(f"[probe] {frames / (now - start):.1f} fps delivered, {src.stats}")
+                last = now
+    finally:
+        src.release()
+    print(f"[probe] {frames} frames in {time.monotonic() - start:.1f}s, {src.stats}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stand-in MJPEG feed and stream probe.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve = sub.add_parser('serve', help='Serve videos as real-time MJPEG streams')
+    serve.add_argument('directory', nargs='?', default='videos', help='Directory (or file) of videos')
+    serve.add_argument('--port', type=int, default=8090)
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--quality', type=int, default=80, help='JPEG quality')
+    serve.add_argument('--outage', help="Simulate link loss: 'EVERY:DURATION' in seconds, e.g. 20:5")
+    check = sub.add_parser('probe', help='Read a stream and report FPS and drop / reconnect counters')
+    check.add_argument('source', help='Camera index, stream URL or video file')
+    check.add_argument('--seconds', type=float, default=30.0)
+    add_stream_args(check)
+    args = parser.parse_args(argv)
+
+    if args.command == 'probe':
+        return probe(args.source, args.seconds, args)
+    outage = tuple(float(v) for v in args.outage.split(':')) if args.outage else None
+    server = MjpegServer(args.directory, port=args.port, host=args.host, quality=args.quality, outage=outage)
+    for name in server.videos:
+        print(f"Serving http://{args.host}:{server.port}/{name}.mjpg")
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Sweep - parallel hyperparameter / fine-tune search for shark_model_trainer.
+
+Trials are scheduled on a process pool. Each worker pins itself to its own
+slice of CPUs (`--threads_per_trial` cores, TF intra-op threads to match), so
+concurrent trials do not fight over cores and the TFLite latency measured at
+the end of a trial is not skewed by its neighbours.
+
+A spec is a JSON file naming trainer arguments (`shark_model_trainer.py --help`):
+
+    {
+      "method": "grid",
+      "params": {"dropout": [0.3, 0.5], "unfreeze": [0, 20, 50], "img_size": [160, 224]},
+      "fixed": {"epochs": 10, "fine_tune_epochs": 5, "feature_cache": true}
+    }
+
+`"method": "random"` samples `"trials"` configurations (seeded by `"seed"`);
+random params may also be ranges: `{"min": 1e-5, "max": 1e-3, "log": true}`
+(`"int": true` for integers).
+
+Losing trials are stopped by the median stopping rule: after
+`--warmup_epochs`, a trial whose best `val_loss` so far is worse than the median
+of the other trials' best `val_loss` at the same epoch (once `--min_trials`
+have got that far) is pruned. Per-epoch histories are shared through
+`<out_dir>/history/`.
+
+Every completed trial exports one TFLite `--variant` and is measured for
+accuracy on data/test, file size and CPU latency. Results go to
+`<out_dir>/trials/<id>/` (a drop-in models directory) and the ranking to
+`<out_dir>/leaderboard.json`; trials on the accuracy / latency Pareto front are
+marked. Finished trials are reused when a sweep is re-run with the same out_dir.
+
+Usage:
+  python src/shark_model_trainer.py sweep sweep.json --data_dir data --workers 4 --threads_per_trial 2
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import hashlib
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import statistics
+import time
+import traceback
+
+COMPLETED = 'completed'
+PRUNED = 'pruned'
+FAILED = 'failed'
+
+# CPUs of this worker process, set by _init_worker
+_worker_cpus = None
+
+
+class TrialPruned(Exception):
+    """Raised from a training callback to abandon a losing trial."""
+
+
+def load_spec(path):
+    with open(path, 'r') as f:
+        spec = json.load(f)
+    spec.setdefault('method', 'grid')
+    spec.setdefault('params', {})
+    spec.setdefault('fixed', {})
+    if spec['method'] not in ('grid', 'random'):
+        raise ValueError(f"Unknown sweep method: {spec['method']}")
+    return spec
+
+
+def _sample(rng, values):
+    if isinstance(values, list):
+        return rng.choice(values)
+    lo, hi = values['min'], values['max']
+    if values.get('log'):
+        value = math.exp(rng.uniform(math.log(lo), math.log(hi)))
+    else:
+        value = rng.uniform(lo, hi)
+    return int(round(value)) if values.get('int') else value
+
+
+def expand(spec):
+    """Parameter dicts of all trials in a spec (grid: every combination, random: `trials` samples)."""
+    params = spec['params']
+    names = sorted(params)
+    if spec['method'] == 'grid':
+        for name in names:
+            if not isinstance(params[name], list):
+                raise ValueError(f"Grid parameter {name!r} must be a list of values")
+        combos = [dict(zip(names, values)) for values in itertools.product(*(params[n] for n in names))]
+    else:
+        rng = random.Random(spec.get('seed', 0))
+        combos = [{name: _sample(rng, params[name]) for name in names} for _ in range(int(spec.get('trials', 10)))]
+    return [dict(spec['fixed'], **combo) for combo in combos]
+
+
+def trial_id(index, params):
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:8]
+    return f"{index:03d}-{digest}"
+
+
+def cpu_slots(workers, threads_per_trial):
+    """Disjoint CPU sets, one per worker (shared round-robin if there are not enough CPUs)."""
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+    slots = []
+    for w in range(workers):
+        start = (w * threads_per_trial) % len(cpus)
+        slots.append([cpus[(start + i) % len(cpus)] for i in range(min(threads_per_trial, len(cpus)))])
+    return slots
+
+
+def _init_worker(slots, threads):
+    """Pool initializer: claim a CPU slot, pin this process to it and size TF's thread pools."""
+    global _worker_cpus
+    _worker_cpus = slots.get()
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, _worker_cpus)
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def _write_json(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _read_history(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def median_stop(mine, others, warmup_epochs=2, min_trials=3):
+    """Median stopping rule: True if `mine` is worse than the median of `others` at the same epoch.
+
+    Args:
+        mine: This trial's val_loss per epoch so far
+        others: val_loss histories of the other trials
+        warmup_epochs: Epochs before a trial can be stopped
+        min_trials: Other trials that must have reached this epoch
+    """
+    step = len(mine)
+    if step <= warmup_epochs:
+        return False
+    peers = [min(h[:step]) for h in others if len(h) >= step]
+    if len(peers) < min_trials:
+        return False
+    return min(mine) > statistics.median(peers)
+
+
+def _pruning_callback(history_dir, tid, warmup_epochs, min_trials):
+    from tensorflow.keras.callbacks import Callback
+
+    class MedianStopping(Callback):
+        """Shares this trial's val_loss history and raises TrialPruned when the median rule fires."""
+
+        def __init__(self):
+            super().__init__()
+            self.path = os.path.join(history_dir, f"{tid}.json")
+            self.losses = []
+
+        def on_epoch_end(self, epoch, logs=None):
+            loss = (logs or {}).get('val_loss')
+            if loss is None:
+                return
+            self.losses.append(float(loss))
+            _write_json(self.path, self.losses)
+            others = [_read_history(os.path.join(history_dir, name)) for name in os.listdir(history_dir)
+                      if name.endswith('.json') and name != f"{tid}.json"]
+            if median_stop(self.losses, others, warmup_epochs, min_trials):
+                raise TrialPruned(f"val_loss {min(self.losses):.4f} above the median after {len(self.losses)} epochs")
+
+    return MedianStopping()
+
+
+def warm_features(data_dir, img_size, aug_copies, cache_dir, batch_size, backbone='mobilenetv2', holdout=0.1):
+    """Fill the feature cache for one backbone / input size before trials read it concurrently."""
+    import shark_model_trainer as trainer
+    _, base = trainer.build_transfer_model(img_size=img_size, backbone=backbone)
+    trainer.cached_features(data_dir, base, img_size, aug_copies, cache_dir, batch_size, holdout)
+    return img_size
+
+
+def run_trial(tid, params, data_dir, out_dir, variant='dynamic', warmup_epochs=2, min_trials=3):
+    """Train, export and measure one trial (runs in a pool worker).
+
+    Returns:
+        Result dict (status, metrics, params); also written to trials/<id>/result.json.
+    """
+    import tensorflow as tf
+    import shark_model_trainer as trainer
+
+    trial_dir = os.path.join(out_dir, 'trials', tid)
+    os.makedirs(trial_dir, exist_ok=True)
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(os.path.join(trial_dir, 'error.log'))
+    result = {'id': tid, 'params': params, 'cpus': _worker_cpus}
+    args = trainer.parse_args(['--data_dir', data_dir])
+    for name, value in params.items():
+        setattr(args, name, value)
+    args.export = None
+
+    tf.keras.backend.clear_session()
+    t0 = time.perf_counter()
+    callback = _pruning_callback(os.path.join(out_dir, 'history'), tid, warmup_epochs, min_trials)
+    try:
+        with open(os.path.join(trial_dir, 'train.log'), 'w') as log, contextlib.redirect_stdout(log):
+            checkpoint = trainer.train(args, models_dir=trial_dir, callbacks=[callback])
+            row = trainer.export_models(checkpoint, data_dir, img_size=args.img_size, variants=(variant,),
+                                        out_dir=trial_dir, calibration_samples=args.calibration_samples,
+                                        name=trainer.model_name(args.backbone, args.img_size),
+                                        holdout=args.threshold_holdout)[0]
+        result.update(status=COMPLETED, accuracy=row['accuracy'], size_kb=row['size_kb'],
+                      latency_ms=row['latency_ms'], threshold=row['threshold'], model=row['path'])
+    except TrialPruned as e:
+        result.update(status=PRUNED, reason=str(e))
+    except Exception as e:
+        result.update(status=FAILED, reason=f"{type(e).__name__}: {e}")
+        with open(os.path.join(trial_dir, 'error.log'), 'w') as f:
+            f.write(traceback.format_exc())
+    result['epochs'] = len(callback.losses)
+    result['best_val_loss'] = round(min(callback.losses), 4) if callback.losses else None
+    result['seconds'] = round(time.perf_counter() - t0, 1)
+    _write_json(os.path.join(trial_dir, 'result.json'), result)
+    return result
+
+
+def pareto_front(results):
+    """Ids of completed trials no other trial beats on both accuracy and latency."""
+    done = [r for r in results if r['status'] == COMPLETED]
+    front = set()
+    for r in done:
+        dominated = any(o['accuracy'] >= r['accuracy'] and o['latency_ms'] <= r['latency_ms'] and
+                        (o['accuracy'] > r['accuracy'] or o['latency_ms'] < r['latency_ms']) for o in done)
+        if not dominated:
+            front.add(r['id'])
+    return front
+
+
+def write_leaderboard(out_dir, results, variant):
+    """Rank trials (completed by accuracy then latency, then pruned / failed) and write leaderboard.json."""
+    front = pareto_front(results)
+    order = {COMPLETED: 0, PRUNED: 1, FAILED: 2}
+    ranked = sorted(results, key=lambda r: (order[r['status']], -r.get('accuracy', 0.0), r.get('latency_ms', 0.0),
+                                            r.get('best_val_loss') or float('inf')))
+    for r in ranked:
+        r['pareto'] = r['id'] in front
+    _write_json(os.path.join(out_dir, 'leaderboard.json'), {'variant': variant, 'trials': ranked})
+    return ranked
+
+
+def print_leaderboard(ranked):
+    print(f"{'trial':<14}{'status':<11}{'accuracy':>9}{'size (KB)':>11}{'latency (ms)':>14}{'val_loss':>10}  params")
+    for r in ranked:
+        mark = '*' if r['pareto'] else ' '
+        metrics = (f"{r['accuracy']:>9.3f}{r['size_kb']:>11.1f}{r['latency_ms']:>14.2f}" if r['status'] == COMPLETED
+                   else f"{'-':>9}{'-':>11}{'-':>14}")
+        loss = f"{r['best_val_loss']:>10.4f}" if r.get('best_val_loss') is not None else f"{'-':>10}"
+        params = ' '.join(f"{k}={v:.3g}" if isinstance(v, float) else f"{k}={v}" for k, v in sorted(r['params'].items()))
+        print(f"{mark}{r['id']:<13}{r['status']:<11}{metrics}{loss}  {params}")
+    print("* accuracy / latency Pareto front")
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(prog='shark_model_trainer.py sweep',
+                                description='Parallel hyperparameter / fine-tune sweep')
+    p.add_argument('spec', help='JSON sweep spec (see sweep.py)')
+    p.add_argument('--data_dir', default='data', help='Path containing train/ and test/ folders')
+    p.add_argument('--out_dir', default=None, help='Sweep output directory (default sweeps/<spec name>)')
+    p.add_argument('--workers', type=int, default=None, help='Concurrent trials (default CPUs / threads_per_trial)')
+    p.add_argument('--threads_per_trial', type=int, default=2, help='CPU cores each trial is pinned to')
+    p.add_argument('--variant', default='dynamic', help='TFLite variant exported and measured per trial')
+    p.add_argument('--warmup_epochs', type=int, default=2, help='Epochs before a trial can be pruned')
+    p.add_argument('--min_trials', type=int, default=3, help='Trials needed at an epoch before pruning against them')
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    spec = load_spec(args.spec)
+    trials = expand(spec)
+    if not trials:
+        print("Empty sweep")
+        return 1
+    import shark_model_trainer as trainer
+    known = vars(trainer.parse_args([]))
+    unknown = sorted({name for params in trials for name in params} - set(known))
+    if unknown:
+        raise ValueError(f"Unknown trainer arguments in spec: {', '.join(unknown)}")
+    if args.variant not in trainer.EXPORT_VARIANTS:
+        raise ValueError(f"Unknown export variant: {args.variant}")
+
+    out_dir = args.out_dir or os.path.join('sweeps', os.path.splitext(os.path.basename(args.spec))[0])
+    os.makedirs(os.path.join(out_dir, 'history'), exist_ok=True)
+    ncpu = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    threads = max(1, args.threads_per_trial)
+    workers = max(1, min(args.workers or ncpu // threads, len(trials)))
+
+    results = []
+    pending = []
+    for index, params in enumerate(trials):
+        tid = trial_id(index, params)
+        previous = _read_history(os.path.join(out_dir, 'trials', tid, 'result.json'))
+        if previous and previous.get('status') in (COMPLETED, PRUNED):
+            results.append(previous)
+        else:
+            pending.append((tid, params))
+    print(f"Sweep {out_dir}: {len(trials)} trials ({len(results)} already done), {workers} workers x {threads} threads, "
+          f"exporting {args.variant}")
+
+    # TF is not fork-safe: workers start fresh and claim one CPU slot each
+    ctx = multiprocessing.get_context('spawn')
+    slots = ctx.Queue()
+    for slot in cpu_slots(workers, threads):
+        slots.put(slot)
+    env = {name: str(threads) for name in ('OMP_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS')}
+    os.environ.update(env)
+
+    with concurrent.futures.ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_worker,
+                                                initargs=(slots, threads)) as pool:
+        # Embed each input size once up front instead of in every concurrent trial
+        warm = {}
+        for tid, params in pending:
+            if params.get('feature_cache'):
+                merged = dict(known, **params)
+                key = tuple(merged[name] for name in ('backbone', 'img_size', 'feature_aug_copies', 'feature_cache_dir',
+                                                      'threshold_holdout'))
+                warm.setdefault(key, merged)
+        for merged in warm.values():
+            print(f"Caching {merged['backbone']} features at {merged['img_size']}px")
+        for future in [pool.submit(warm_features, args.data_dir, m['img_size'], m['feature_aug_copies'],
+                                   m['feature_cache_dir'], m['batch_size'], m['backbone'], m['threshold_holdout'])
+                       for m in warm.values()]:
+            future.result()
+
+        futures = [pool.submit(run_trial, tid, params, args.data_dir, out_dir, args.variant, args.warmup_epochs,
+                               args.min_trials) for tid, params in pending]
+        for future in concurrent.futures.as_completed(futures):
+            r = future.result()
+            results.append(r)
+            detail = (f"accuracy {r['accuracy']:.3f}, {r['latency_ms']:.2f} ms" if r['status'] == COMPLETED
+                      else r.get('reason', ''))
+            print(f"[{len(results)}/{len(trials)}] {r['id']} {r['status']} after {r['epochs']} epochs "
+                  f"({r['seconds']:.0f}s): {detail}")
+            write_leaderboard(out_dir, results, args.variant)
+
+    print_leaderboard(write_leaderboard(out_dir, results, args.variant))
+    print(f"Leaderboard written to {os.path.join(out_dir, 'leaderboard.json')}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Tiling - cut high-resolution frames into overlapping model-sized tiles.
+
+Instead of squashing a whole 1080p/4K frame to 224x224 (where a small shark
+becomes a few pixels), the frame is optionally downscaled by `scale`, the region
+below an optional horizon line is covered with overlapping `tile x tile` windows,
+and all tiles are run through the model as one batch.
+
+Tile extraction is a single vectorized NumPy gather over a sliding-window view
+of the frame, so the overhead stays small next to model time.
+"""
+
+import cv2
+import numpy as np
+
+
+def _starts(length, tile, step):
+    """Window start offsets covering [0, length) with the last window flush to the edge."""
+    if length <= tile:
+        return np.array([0])
+    starts = list(range(0, length - tile + 1, step))
+    if starts[-1] != length - tile:
+        starts.append(length - tile)
+    return np.array(starts)
+
+
+class TileGrid:
+    """Overlapping tile layout for frames of a given shape."""
+
+    def __init__(self, tile=224, overlap=0.25, horizon=0.0, scale=1.0):
+        """Create the grid.
+
+        Args:
+            tile: Tile edge in pixels (the model input size)
+            overlap: Fraction of a tile shared with its neighbour (0 - 0.9)
+            horizon: Fraction of the frame height above which no tiles are cut (0 = whole frame)
+            scale: Resize factor applied to the frame before tiling (e.g. 0.5 for 4K)
+        """
+        if not 0.0 <= overlap < 1.0:
+            raise ValueError("overlap must be in [0, 1)")
+        if not 0.0 <= horizon < 1.0:
+            raise ValueError("horizon must be in [0, 1)")
+        self.tile = int(tile)
+        self.overlap = overlap
+        self.horizon = horizon
+        self.scale = scale
+        self._shape = None
+        self._layout = None
+
+    def _plan(self, shape):
+        """Compute (and cache) tile offsets for a frame shape."""
+        if shape == self._shape:
+            return self._layout
+        h, w = shape[:2]
+        sh, sw = int(round(h * self.scale)), int(round(w * self.scale))
+        top = int(sh * self.horizon)
+        # Make sure the working region is at least one tile in both directions
+        fit = max(self.tile / max(sh - top, 1), self.tile / max(sw, 1), 1.0)
+        top = int(round(top * fit))
+        sh = max(int(round(sh * fit)), top + self.tile)
+        sw = max(int(round(sw * fit)), self.tile)
+        step = max(1, int(self.tile * (1.0 - self.overlap)))
+        ys = _starts(sh - top, self.tile, step) + top
+        xs = _starts(sw, self.tile, step)
+        # Tile boxes in original frame coordinates: (x, y, w, h)
+        fx, fy = w / sw, h / sh
+        yy, xx = np.meshgrid(ys, xs, indexing='ij')
+        boxes = np.stack([xx.ravel() * fx, yy.ravel() * fy,
+                          np.full(xx.size, self.tile * fx), np.full(xx.size, self.tile * fy)], axis=1)
+        self._shape = shape
+        self._layout = ((sw, sh), ys, xs, boxes.round().astype(np.int32))
+        return self._layout
+
+    def boxes(self, shape):
+        """Tile boxes (x, y, w, h) in frame coordinates for a frame shape."""
+        return self._plan(tuple(shape))[3]
+
+    def __len__(self):
+        return 0 if self._layout is None else len(self._layout[3])
+
+    def extract(self, frame):
+        """Cut a frame into tiles.
+
+        Returns:
+            (tiles, boxes) - uint8 array (N, tile, tile, C) in the frame's channel order,
+            and int32 boxes (N, 4) as (x, y, w, h) in original frame coordinates.
+        """
+        (sw, sh), ys, xs, boxes = self._plan(tuple(frame.shape))
+        h, w = frame.shape[:2]
+        work = frame if (sw, sh) == (w, h) else cv2.resize(frame, (sw, sh), interpolation=cv2.INTER_AREA)
+        if work.ndim == 2:
+            work = work[:, :, None]
+        views = np.lib.stride_tricks.sliding_window_view(work, (self.tile, self.tile), axis=(0, 1))
+        # views: (H-t+1, W-t+1, C, t, t) -> gather all tiles at once
+        tiles = views[ys[:, None], xs[None, :]]
+        tiles = tiles.reshape(-1, work.shape[2], self.tile, self.tile).transpose(0, 2, 3, 1)
+        return np.ascontiguousarray(tiles), boxes
+
+
+class TiledScore(float):
+    """Max tile score that also carries the per-tile scores and boxes.
+
+    Behaves like a plain float everywhere a frame score is expected (thresholds,
+    event engine, logs), while overlays can still draw the tiles that fired.
+    """
+
+    def __new__(cls, scores, boxes):
+        scores = np.asarray(scores, dtype=np.float32).ravel()
+        obj = super().__new__(cls, float(scores.max()) if scores.size else 0.0)
+        obj.scores = scores
+        obj.boxes = boxes
+        return obj
+
+    def fired(self, threshold):
+        """Boxes of the tiles scoring above `threshold`."""
+        return self.boxes[self.scores > threshold]
+
+
+def add_tile_args(parser):
+    """Register tiled-inference CLI options on an argparse parser."""
+    parser.add_argument('--tiles', action='store_true',
+                        help='Run the model on overlapping tiles instead of the downscaled full frame')
+    parser.add_argument('--tile-overlap', type=float, default=0.25, help='Fraction of overlap between tiles')
+    parser.add_argument('--tile-scale', type=float, default=1.0,
+                        help='Resize factor applied to the frame before tiling (e.g. 0.5 for 4K footage)')
+    parser.add_argument('--horizon', type=float, default=0.0,
+                        help='Only tile below this fraction of the frame height (0 = whole frame)')
+
+
+def grid_from_args(args, tile):
+    """Build a TileGrid from `add_tile_args` options, or None if tiling is off."""
+    if not args.tiles:
+        return None
+    return TileGrid(tile=tile, overlap=args.tile_overlap, horizon=args.horizon, scale=args.tile_scale)